@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple
+
+from .elfcmp import ComparableElf
+from .structs import ElfDiff
+
+
+# Default memory budget of ElfPool in bytes.
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+class ElfPool:
+    """
+    Pool of open ELF files for batch compares. Files are opened on demand
+    and kept open for next compares, until sum of their metadata sizes
+    (see ComparableElf.metadata_size()) exceeds memory_budget, then least
+    recently used files not in use are closed. Files in use are never
+    closed, so one compare may exceed budget.
+
+    :memory_budget: maximal memory of metadata of open files in bytes
+    :compact: open files in compact metadata mode (see compact.py)
+    """
+
+    def __init__(
+        self, memory_budget: int = DEFAULT_MEMORY_BUDGET,
+        compact: bool = True):
+
+        self.memory_budget = memory_budget
+        self.compact = compact
+        self.used_memory = 0
+        # {path: (file, ComparableElf, metadata size)}
+        self._files = OrderedDict()
+        self._in_use = set()
+
+
+    def __len__(self):
+        return len(self._files)
+
+
+    def _get(self, path: str) -> ComparableElf:
+        if path in self._files:
+            self._files.move_to_end(path)
+            return self._files[path][1]
+
+        file_ = open(path, "rb")
+        try:
+            elf = ComparableElf(file_, compact=self.compact)
+        except Exception:
+            file_.close()
+            raise
+
+        size = elf.metadata_size()
+        self._files[path] = (file_, elf, size)
+        self.used_memory += size
+        return elf
+
+
+    def _shrink(self):
+        """ Close least recently used files not in use while over budget. """
+        for path in list(self._files):
+            if self.used_memory <= self.memory_budget:
+                break
+            if path not in self._in_use:
+                self._close(path)
+
+
+    def _close(self, path: str):
+        file_, _, size = self._files.pop(path)
+        self.used_memory -= size
+        file_.close()
+
+
+    @contextmanager
+    def open(self, *paths: str) -> Iterator[List[ComparableElf]]:
+        """
+        Context manager giving ComparableElf objects of files. They stay
+        open at least until exit from context.
+        """
+        added = [path for path in paths if path not in self._in_use]
+        self._in_use.update(added)
+        try:
+            elfs = [self._get(path) for path in paths]
+            self._shrink()
+            yield elfs
+        finally:
+            self._in_use.difference_update(added)
+            self._shrink()
+
+
+    def close(self):
+        for path in list(self._files):
+            self._close(path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def compare_pairs(
+    pairs: Iterable[Tuple[str, str]],
+    memory_budget: int = DEFAULT_MEMORY_BUDGET, compact: bool = True,
+    **kwargs) -> Iterator[Tuple[str, str, ElfDiff]]:
+    """
+    Compare pairs of files, files used by many pairs are parsed once
+    while they fit to memory budget (see ElfPool). ElfDiff streams are
+    open only until next iteration.
+    :kwargs: passed to ComparableElf.compare_to()
+    :returns: iterator of tuples (path_1, path_2, ElfDiff).
+    """
+    with ElfPool(memory_budget, compact) as pool:
+        for path_1, path_2 in pairs:
+            with pool.open(path_1, path_2) as (left_elf, right_elf):
+                yield path_1, path_2, left_elf.compare_to(right_elf, **kwargs)
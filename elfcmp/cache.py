@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Optional
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+from .elfcmp import ComparableElf
+from .rules import Rules
+from .structs import ElfDiff
+
+
+# Version of stored results format, part of key.
+FORMAT_VERSION = 1
+
+# Eviction removes results down to this fraction of max_bytes, so next one
+# is needed only after cache grows again.
+EVICTION_TARGET = 0.75
+
+
+def stream_digest(stream, chunk_size: int = 1024 * 1024) -> str:
+    """ SHA-256 hex digest of whole stream, stream position is restored. """
+    saved_position = stream.tell()
+    hash_ = hashlib.sha256()
+    stream.seek(0, io.SEEK_SET)
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            hash_.update(chunk)
+    finally:
+        stream.seek(saved_position, io.SEEK_SET)
+    return hash_.hexdigest()
+
+
+class ResultCache:
+    """
+    On disk cache of compare results, shared by processes. Key is digest
+    of both files contents and compare options, value is ElfDiff.to_dict()
+    in JSON file. Files are written to temporary files and renamed, so
+    readers never see partial results, and concurrent writers of same key
+    just replace same result. Least recently used results are removed when
+    total size exceeds max_bytes. Total size is counted by puts and is
+    found by listing directory only on first put and on eviction, results
+    of other processes are noticed by next eviction.
+
+    :directory: cache directory, created if missing
+    :max_bytes: maximal total size of stored results
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        os.makedirs(directory, exist_ok=True)
+
+
+    @staticmethod
+    def key(
+        left: ComparableElf, right: ComparableElf, rules: Rules = None,
+        similarity: bool = False) -> str:
+        """ Key of compare of files with options. """
+        options = json.dumps({
+            "version": FORMAT_VERSION,
+            "rules": (rules if rules is not None else Rules()).to_dict(),
+            "similarity": bool(similarity),
+            })
+        hash_ = hashlib.sha256()
+        for part in (
+            stream_digest(left.stream), stream_digest(right.stream), options):
+            hash_.update(part.encode("utf-8"))
+            hash_.update(b"\0")
+        return hash_.hexdigest()
+
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+
+    def get(self, key: str) -> Optional[dict]:
+        """ :returns: stored ElfDiff.to_dict() or None. """
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except OSError:
+            return None
+        except ValueError:
+            # Corrupt result, compare is repeated and result is replaced.
+            self.drop(key)
+            return None
+
+        # Modification time is used as last access time for eviction.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+
+    def put(self, key: str, data: dict):
+        """ Store ElfDiff.to_dict() result atomically. """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = 0
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f)
+                new_size = f.tell()
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += new_size - old_size
+
+        if self._size > self.max_bytes:
+            self.evict(keep=path)
+
+
+    def drop(self, key: str):
+        """ Remove stored result, e.g. unreadable one. """
+        path = self._path(key)
+        try:
+            size = os.stat(path).st_size
+            os.unlink(path)
+        except OSError:
+            return
+        if self._size is not None:
+            self._size -= size
+
+
+    def _entries(self):
+        """ List of (mtime, size, path) of stored results. """
+        result = []
+        for dir_entry in os.scandir(self.directory):
+            if not dir_entry.is_dir():
+                continue
+            for entry in os.scandir(dir_entry.path):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                result.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return result
+
+
+    def size(self) -> int:
+        """ Total size of stored results. """
+        return sum(size for _, size, _ in self._entries())
+
+
+    def evict(self, keep: str = None):
+        """
+        Remove least recently used results while over EVICTION_TARGET of
+        max_bytes.
+        :keep: path of result which is not removed, just stored one
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET
+
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                # Removed by another process.
+                pass
+            total -= size
+
+        self._size = total
+
+
+    def compare(
+        self, left: ComparableElf, right: ComparableElf,
+        rules: Rules = None, similarity: bool = False, **kwargs) -> ElfDiff:
+        """
+        Compare files like left.compare_to(right, rules, similarity), but
+        return stored result if same files were compared with same options.
+        :kwargs: passed to compare_to(), they must not change result
+        """
+        key = self.key(left, right, rules, similarity)
+        data = self.get(key)
+        if data is not None:
+            try:
+                result = ElfDiff.from_dict(data, left, right)
+            except (KeyError, IndexError, TypeError, ValueError,
+                AttributeError):
+                # Valid JSON of wrong shape is dropped like corrupt one.
+                self.drop(key)
+            else:
+                left.compare_result = result
+                return result
+
+        result = left.compare_to(right, rules, similarity, **kwargs)
+        self.put(key, result.to_dict())
+        return result
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Thin client of compare daemon (see daemon.py). Imports nothing but
+standard library, so start is fast.
+
+Run: python3 -m elfcmp.client SOCKET LEFT RIGHT [--rules FILE] [--json]
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+class DaemonError(Exception):
+    """ Error reported by daemon. """
+
+
+def request(socket_path: str, command: str, **kwargs):
+    """
+    Send one request to daemon.
+    :returns: "result" of response.
+    :raises DaemonError: if daemon failed to process request.
+    """
+    message = dict(kwargs, command=command)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as stream:
+            response = json.loads(stream.readline().decode("utf-8"))
+
+    if not response["ok"]:
+        raise DaemonError(response["error"])
+    return response["result"]
+
+
+def compare(
+    socket_path: str, left: str, right: str, rules: dict = None,
+    similarity: bool = False) -> dict:
+    """
+    Compare files by daemon. Paths are made absolute, since daemon may
+    run in another directory.
+    :returns: ElfDiff.to_dict() with "text" key added.
+    """
+    return request(
+        socket_path, "compare",
+        left=os.path.abspath(left), right=os.path.abspath(right),
+        rules=rules, similarity=similarity)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare two ELF files by compare daemon.")
+    parser.add_argument("socket", help="path to daemon Unix socket")
+    parser.add_argument("left", help="path to first ELF file")
+    parser.add_argument("right", help="path to second ELF file")
+    parser.add_argument(
+        "--rules", help="JSON file with ignore and severity rules")
+    parser.add_argument(
+        "--similarity", action="store_true",
+        help="print similarity scores of changed sections and blocks")
+    parser.add_argument(
+        "--json", action="store_true", help="print result as JSON")
+    args = parser.parse_args()
+
+    rules = None
+    if args.rules:
+        with open(args.rules) as f:
+            rules = json.load(f)
+
+    try:
+        result = compare(
+            args.socket, args.left, args.right, rules, args.similarity)
+    except DaemonError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(result["text"])
+
+    # Exit code is 1 if there are differences, like cmp and diff do.
+    sys.exit(0 if result["max_level"] is None else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from collections.abc import Mapping
+from typing import Dict, Iterable
+import sys
+
+from elftools.elf.elffile import ELFFile
+from elftools.elf.sections import Section
+from elftools.elf.segments import Segment
+
+
+SECTION_HEADER_KEYS = (
+    "sh_name", "sh_type", "sh_flags", "sh_addr", "sh_offset", "sh_size",
+    "sh_link", "sh_info", "sh_addralign", "sh_entsize")
+
+SEGMENT_HEADER_KEYS = (
+    "p_type", "p_flags", "p_offset", "p_vaddr", "p_paddr", "p_filesz",
+    "p_memsz", "p_align")
+
+_SECTION_INDEXES = {key: i for i, key in enumerate(SECTION_HEADER_KEYS)}
+_SEGMENT_INDEXES = {key: i for i, key in enumerate(SEGMENT_HEADER_KEYS)}
+
+# Section data is compressed (ELFCOMPRESS_*), pyelftools decompresses it.
+SHF_COMPRESSED = 0x800
+
+
+class CompactSection:
+    """
+    Replacement of pyelftools Section keeping only name and header values
+    in tuple. It has same interface used by compare: dictionary-like
+    access to header, header, name, data() and is_null().
+
+    :name: section name
+    :values: tuple of header values in SECTION_HEADER_KEYS order
+    :stream: stream of ELF file to read data from
+    :index: index of section in section header table, full pyelftools
+        object is elf.get_section(index)
+    """
+
+    __slots__ = ("name", "values", "stream", "index")
+
+    def __init__(self, name: str, values: tuple, stream, index: int = None):
+        self.name = name
+        self.values = values
+        self.stream = stream
+        self.index = index
+
+
+    @classmethod
+    def from_section(
+        cls, section: Section, index: int = None) -> "CompactSection":
+        return cls(
+            section.name,
+            tuple(section[key] for key in SECTION_HEADER_KEYS),
+            section.stream, index)
+
+
+    def __getitem__(self, key: str):
+        return self.values[_SECTION_INDEXES[key]]
+
+
+    @property
+    def header(self) -> Dict:
+        """ Header dictionary, made on every access. """
+        return dict(zip(SECTION_HEADER_KEYS, self.values))
+
+
+    def is_null(self) -> bool:
+        return self["sh_type"] == "SHT_NULL"
+
+
+    def data(self) -> bytes:
+        # Same as pyelftools gives, NOBITS sections are zero filled.
+        if self["sh_type"] == "SHT_NOBITS":
+            return bytes(self["sh_size"])
+        self.stream.seek(self["sh_offset"])
+        return self.stream.read(self["sh_size"])
+
+
+class CompactSegment:
+    """
+    Replacement of pyelftools Segment keeping only header values in tuple.
+
+    :values: tuple of header values in SEGMENT_HEADER_KEYS order
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values: tuple):
+        self.values = values
+
+
+    @classmethod
+    def from_segment(cls, segment: Segment) -> "CompactSegment":
+        return cls(tuple(segment[key] for key in SEGMENT_HEADER_KEYS))
+
+
+    def __getitem__(self, key: str):
+        return self.values[_SEGMENT_INDEXES[key]]
+
+
+    @property
+    def header(self) -> Dict:
+        """ Header dictionary, made on every access. """
+        return dict(zip(SEGMENT_HEADER_KEYS, self.values))
+
+
+def compact_section(section: Section, index: int = None):
+    """
+    CompactSection of section. Compressed sections are kept as is, since
+    their data is decompressed by pyelftools.
+    """
+    if section["sh_flags"] & SHF_COMPRESSED:
+        return section
+    return CompactSection.from_section(section, index)
+
+
+# Approximate memory of ELF structures parsers of one ELFFile.
+PARSERS_SIZE = 80 * 1024
+
+# Parsers of ELF structures shared by files of same class, endianness,
+# type, machine and OS ABI. They are the biggest part of ELFFile memory.
+_shared_structs = {}
+
+
+def share_structs(elf: ELFFile):
+    """
+    Replace ELFFile parsers by shared ones. Parsers keep no state between
+    calls, so they can be used by many files.
+    """
+    structs = _shared_structs.setdefault(elf.structs.__getstate__(), elf.structs)
+    elf.structs = structs
+
+    # Section names table is made by ELFFile.__init__() with own parsers.
+    string_table = getattr(elf, "_section_header_stringtable", None)
+    if string_table is not None:
+        string_table.structs = structs
+
+
+def estimate_size(objects: Iterable) -> int:
+    """
+    Rough estimate of memory used by metadata objects (sections, segments,
+    blocks): sizes of objects, their attributes dictionaries, headers and
+    header values. Shared objects (streams, ELF file) are not counted.
+    """
+    result = 0
+
+    for obj in objects:
+        result += sys.getsizeof(obj)
+
+        if isinstance(obj, (CompactSection, CompactSegment)):
+            result += sys.getsizeof(obj.values)
+            result += sum(sys.getsizeof(v) for v in obj.values)
+        elif hasattr(obj, "__dict__"):
+            result += sys.getsizeof(obj.__dict__)
+            header = getattr(obj, "header", None)
+            if isinstance(header, Mapping):
+                result += sys.getsizeof(header)
+                result += sum(sys.getsizeof(v) for v in header.values())
+
+        name = getattr(obj, "name", None)
+        if isinstance(name, str):
+            result += sys.getsizeof(name)
+
+    return result
@@ -0,0 +1,375 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from typing import Optional, List
+import bz2
+import io
+import lzma
+import zlib
+
+
+# Magic numbers of supported containers: {format name: magic bytes}.
+compression_magics = {
+    "gzip": b"\x1f\x8b",
+    "xz": b"\xfd7zXZ\x00",
+    "bz2": b"BZh",
+    }
+
+
+def detect_compression(stream) -> Optional[str]:
+    """
+    Check first bytes of stream for known compression magic numbers.
+    Stream position is restored.
+    :returns: format name (key of compression_magics) or None.
+    """
+    saved_position = stream.tell()
+    head = stream.read(max(len(m) for m in compression_magics.values()))
+    stream.seek(saved_position, io.SEEK_SET)
+
+    for format_, magic in compression_magics.items():
+        if head.startswith(magic):
+            return format_
+
+    return None
+
+
+class _Checkpoint:
+    """
+    Saved decompressor state at some position of decompressed stream.
+
+    :decompressor: copy of decompressor object or None if decompression
+        starts here with a fresh one (beginning of gzip member, xz stream...).
+    :input: compressed bytes already read from source but not consumed.
+    :source_offset: offset in compressed source to continue reading from.
+    :offset: offset in decompressed stream.
+    :pending: decompressed bytes from offset that are not emitted as chunk yet.
+    """
+    __slots__ = ("decompressor", "input", "source_offset", "offset", "pending")
+
+    def __init__(self, decompressor, input_, source_offset, offset, pending):
+        self.decompressor = decompressor
+        self.input = input_
+        self.source_offset = source_offset
+        self.offset = offset
+        self.pending = pending
+
+
+class SeekableDecompressor(io.RawIOBase):
+    """
+    Read-only seekable view of gzip/xz/bz2 compressed stream.
+
+    Decompressed stream is split into chunks of chunk_size bytes. Recently
+    used chunks are kept in LRU cache, so repeated reads of same places
+    (headers, tables) cost nothing. For backward seeks out of cache
+    decompression is restarted from nearest checkpoint instead of
+    the beginning of source. zlib decompressor state can be copied, so
+    gzip gets checkpoint every checkpoint_interval bytes. lzma and bz2 states
+    can not be copied, for them checkpoints are made only on stream
+    (member) boundaries. Count of checkpoints is bounded: when limit is hit
+    every second one is dropped and interval is doubled.
+
+    :format_: compression format, see compression_magics
+    :chunk_size: size of cached chunk of decompressed data
+    :max_cached_chunks: capacity of chunks cache
+    :checkpoint_interval: distance between checkpoints in decompressed data
+    :max_checkpoints: maximal count of stored checkpoints
+    """
+
+    # Size of compressed data read from source at once.
+    source_read_size = 64 * 1024
+
+    def __init__(
+        self, stream, format_: str = None,
+        chunk_size: int = 64 * 1024,
+        max_cached_chunks: int = 256,
+        checkpoint_interval: int = 1024 * 1024,
+        max_checkpoints: int = 64):
+
+        super(SeekableDecompressor, self).__init__()
+
+        if format_ is None:
+            format_ = detect_compression(stream)
+
+        if format_ not in compression_magics:
+            raise ValueError(
+                "Unsupported compression format: {}".format(format_))
+
+        self.source = stream
+        self.format_ = format_
+        self.chunk_size = chunk_size
+        self.max_cached_chunks = max_cached_chunks
+        # Checkpoints are made on chunk boundaries only.
+        self.checkpoint_interval = (
+            -(-checkpoint_interval // chunk_size) * chunk_size)
+        self.max_checkpoints = max_checkpoints
+
+        self._source_start = stream.tell()
+        self._position = 0
+        self._size = None
+        self._chunks = OrderedDict()
+        self._checkpoints = []  # type: List[_Checkpoint]
+        self._restart(None)
+
+
+    def _new_decompressor(self):
+        if self.format_ == "gzip":
+            return zlib.decompressobj(zlib.MAX_WBITS | 16)
+        if self.format_ == "xz":
+            return lzma.LZMADecompressor()
+        return bz2.BZ2Decompressor()
+
+
+    def _restart(self, checkpoint: Optional[_Checkpoint]):
+        """ Set decompression state to checkpoint or to the beginning. """
+        if checkpoint is None:
+            self._decompressor = self._new_decompressor()
+            self._input = b""
+            self._source_offset = self._source_start
+            self._offset = 0
+            self._pending = bytearray()
+            return
+
+        if checkpoint.decompressor is None:
+            self._decompressor = self._new_decompressor()
+        else:
+            self._decompressor = checkpoint.decompressor.copy()
+
+        self._input = checkpoint.input
+        self._source_offset = checkpoint.source_offset
+        self._offset = checkpoint.offset
+        self._pending = bytearray(checkpoint.pending)
+
+
+    def _save_checkpoint(self, fresh: bool = False):
+        """
+        Save current state as checkpoint.
+        :fresh: True if current decompressor has not consumed anything yet.
+        """
+        if fresh:
+            decompressor = None
+        elif self.format_ == "gzip":
+            decompressor = self._decompressor.copy()
+        else:
+            return
+
+        if self._checkpoints and self._checkpoints[-1].offset >= self._offset:
+            return
+
+        self._checkpoints.append(
+            _Checkpoint(
+                decompressor, self._input, self._source_offset,
+                self._offset, bytes(self._pending)))
+
+        # Thin out checkpoints to keep them bounded.
+        if len(self._checkpoints) > self.max_checkpoints:
+            self._checkpoints = self._checkpoints[1::2]
+            self.checkpoint_interval *= 2
+
+
+    def _read_source(self) -> bytes:
+        self.source.seek(self._source_offset, io.SEEK_SET)
+        data = self.source.read(self.source_read_size)
+        self._source_offset += len(data)
+        return data
+
+
+    def _decompress_some(self, max_length: int) -> bytes:
+        """
+        Decompress at most max_length next bytes.
+        :returns: empty bytes at the end of compressed data.
+        """
+        while True:
+            decompressor = self._decompressor
+
+            if decompressor.eof:
+                # End of gzip member or xz/bz2 stream. Maybe next one follows.
+                # zlib keeps not consumed input both in unconsumed_tail and
+                # unused_data, so unused_data is enough for all formats.
+                rest = decompressor.unused_data
+                if not rest:
+                    rest = self._read_source()
+                if not rest:
+                    return b""
+                self._decompressor = self._new_decompressor()
+                self._input = rest
+                self._save_checkpoint(fresh=True)
+                continue
+
+            if self.format_ == "gzip":
+                if not self._input:
+                    self._input = self._read_source()
+                    if not self._input:
+                        raise EOFError("Compressed data is truncated")
+                data = decompressor.decompress(self._input, max_length)
+                self._input = decompressor.unconsumed_tail
+            else:
+                data_in = b""
+                if decompressor.needs_input:
+                    data_in = self._input or self._read_source()
+                    self._input = b""
+                    if not data_in:
+                        raise EOFError("Compressed data is truncated")
+                data = decompressor.decompress(data_in, max_length)
+
+            if data:
+                return data
+
+
+    def _next_chunk(self) -> bytes:
+        """
+        Decompress next chunk from current state, put it to cache.
+        :returns: empty bytes at the end of decompressed data.
+        """
+        chunk_index = self._offset // self.chunk_size
+
+        if self._offset % self.checkpoint_interval == 0 and self._offset:
+            self._save_checkpoint()
+
+        while len(self._pending) < self.chunk_size:
+            data = self._decompress_some(self.chunk_size - len(self._pending))
+            if not data:
+                self._size = self._offset + len(self._pending)
+                break
+            self._pending += data
+
+        chunk = bytes(self._pending)
+        self._pending = bytearray()
+        self._offset += len(chunk)
+
+        if chunk:
+            self._cache_chunk(chunk_index, chunk)
+
+        return chunk
+
+
+    def _cache_chunk(self, index: int, chunk: bytes):
+        self._chunks[index] = chunk
+        self._chunks.move_to_end(index)
+        while len(self._chunks) > self.max_cached_chunks:
+            self._chunks.popitem(last=False)
+
+
+    def _get_chunk(self, index: int) -> bytes:
+        """ Get chunk by index from cache or decompress it. """
+        chunk = self._chunks.get(index)
+        if chunk is not None:
+            self._chunks.move_to_end(index)
+            return chunk
+
+        target = index * self.chunk_size
+        if self._size is not None and target >= self._size:
+            return b""
+
+        # Choose nearest restart point before target: current state
+        # or one of checkpoints.
+        if self._offset > target:
+            best = None
+            for checkpoint in self._checkpoints:
+                if checkpoint.offset > target:
+                    break
+                best = checkpoint
+            self._restart(best)
+        else:
+            for checkpoint in reversed(self._checkpoints):
+                if self._offset < checkpoint.offset <= target:
+                    self._restart(checkpoint)
+                    break
+
+        while True:
+            current = self._offset // self.chunk_size
+            chunk = self._next_chunk()
+            if not chunk or current == index:
+                return chunk
+
+
+    def size(self) -> int:
+        """ Size of decompressed data. Decompresses everything once. """
+        if self._size is None:
+            index = self._offset // self.chunk_size
+            while self._get_chunk(index):
+                index += 1
+        return self._size
+
+
+    def readable(self) -> bool:
+        return True
+
+
+    def seekable(self) -> bool:
+        return True
+
+
+    def tell(self) -> int:
+        return self._position
+
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size() + offset
+        else:
+            raise ValueError("Invalid whence: {}".format(whence))
+
+        if position < 0:
+            raise ValueError("Negative seek position {}".format(position))
+
+        self._position = position
+        return position
+
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size() - self._position
+            if size <= 0:
+                return b""
+
+        result = []
+        while size > 0:
+            index, start = divmod(self._position, self.chunk_size)
+            chunk = self._get_chunk(index)
+            part = chunk[start:start + size]
+            if not part:
+                break
+            result.append(part)
+            self._position += len(part)
+            size -= len(part)
+
+        return b"".join(result)
+
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_decompressed(stream, **kwargs):
+    """
+    Wrap stream to SeekableDecompressor if it contains compressed data.
+    :kwargs: passed to SeekableDecompressor.
+    :returns: stream itself if it is not compressed.
+    """
+    format_ = detect_compression(stream)
+    if format_ is None:
+        return stream
+    return SeekableDecompressor(stream, format_, **kwargs)
@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, Iterator, List, Set, Tuple
+import json
+import os
+import random
+import zlib
+
+from .batch import DEFAULT_MEMORY_BUDGET, compare_pairs
+from .elfcmp import ComparableElf
+from .similarity import ROLLING_WINDOW
+from .structs import BlockType, ElfDiff
+
+
+# Mersenne prime for universal hashing in MinHash.
+_PRIME = (1 << 61) - 1
+
+
+def content_chunks(data: bytes, chunk_size: int = 64) -> Iterator[bytes]:
+    """
+    Split data into content defined chunks of chunk_size bytes in average.
+    Chunk ends where rolling hash of last bytes (same as ssdeep one, see
+    similarity.FuzzyHasher) hits chunk_size - 1 modulo chunk_size, so
+    boundaries depend only on nearby bytes and inserted or removed bytes
+    change only chunks around them. Chunks are cut at 4 * chunk_size to
+    limit runs of bytes which never give a boundary.
+    """
+    window = [0] * ROLLING_WINDOW
+    r1 = r2 = r3 = 0
+    start = 0
+    max_size = 4 * chunk_size
+
+    for n, c in enumerate(data):
+        r2 = r2 - r1 + ROLLING_WINDOW * c
+        r1 = r1 + c - window[n % ROLLING_WINDOW]
+        window[n % ROLLING_WINDOW] = c
+        r3 = ((r3 << 5) & 0xFFFFFFFF) ^ c
+        rolling = (r1 + r2 + r3) & 0xFFFFFFFF
+
+        if (rolling % chunk_size == chunk_size - 1
+            or n + 1 - start >= max_size):
+            yield data[start:n + 1]
+            start = n + 1
+
+    if start < len(data):
+        yield data[start:]
+
+
+def elf_shingles(elf: ComparableElf, chunk_size: int = 64) -> Set[int]:
+    """
+    Split data of every section into content defined chunks (see
+    content_chunks()) and hash them with section name. Moved sections and
+    code shifted inside section still give same shingles.
+    :returns: set of 32-bit shingle hashes.
+    """
+    result = set()
+
+    for block in elf.used_blocks:
+        if block.block_type != BlockType.SECTION:
+            continue
+
+        seed = zlib.crc32(block.object_.name.encode("utf-8", "replace"))
+
+        for chunk in content_chunks(block.data(), chunk_size):
+            result.add(zlib.crc32(chunk, seed))
+
+    return result
+
+
+class MinHasher:
+    """
+    Makes MinHash signatures of sets of integers.
+    Probability of equal values at same index of two signatures is
+    Jaccard similarity of sets.
+
+    :num_perm: count of hash functions (signature length)
+    :seed: seed of hash functions, must be same for compared signatures
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        self.seed = seed
+        rnd = random.Random(seed)
+        self.params = [
+            (rnd.randrange(1, _PRIME), rnd.randrange(0, _PRIME))
+            for _ in range(num_perm)]
+
+
+    def signature(self, shingles: Set[int]) -> List[int]:
+        """ MinHash signature of set, empty set gives all max values. """
+        if not shingles:
+            return [_PRIME] * self.num_perm
+
+        values = list(shingles)
+        return [
+            min([(a * x + b) % _PRIME for x in values])
+            for a, b in self.params]
+
+
+def estimate_similarity(
+    signature_1: List[int], signature_2: List[int]) -> float:
+    """ Estimated Jaccard similarity of sets by their MinHash signatures. """
+    same = sum(1 for v1, v2 in zip(signature_1, signature_2) if v1 == v2)
+    return same / len(signature_1)
+
+
+class LshIndex:
+    """
+    Locality sensitive hashing index of MinHash signatures. Signature is split
+    to bands of rows, files with equal band go to same bucket and become
+    candidate pairs. Pairs with similarity s are found with probability
+    1 - (1 - s^rows)^bands, so only near duplicates are compared fully.
+    Index can be updated with add() and remove() and saved to JSON file.
+
+    :minhasher: MinHasher used for signatures
+    :bands: count of bands, must divide minhasher.num_perm
+    :chunk_size: average size of shingle, see elf_shingles()
+    :signatures: dictionary {key: signature}
+    """
+
+    def __init__(
+        self, num_perm: int = 128, bands: int = 32, seed: int = 1,
+        chunk_size: int = 64):
+
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.minhasher = MinHasher(num_perm, seed)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.chunk_size = chunk_size
+        self.signatures = {}  # type: Dict[str, List[int]]
+        self._buckets = [{} for _ in range(bands)]
+
+
+    def _band_keys(self, signature: List[int]) -> Iterator[Tuple[int, tuple]]:
+        rows = self.rows
+        for band in range(self.bands):
+            yield band, tuple(signature[band * rows:(band + 1) * rows])
+
+
+    def add(self, key: str, signature: List[int]):
+        """ Add (or replace) signature under key. """
+        if key in self.signatures:
+            self.remove(key)
+
+        self.signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, set()).add(key)
+
+
+    def add_elf(self, key: str, elf: ComparableElf) -> List[int]:
+        """ Compute signature of elf and add it. """
+        signature = self.minhasher.signature(
+            elf_shingles(elf, self.chunk_size))
+        self.add(key, signature)
+        return signature
+
+
+    def add_file(self, key: str, path: str) -> List[int]:
+        """ Compute signature of ELF file and add it. """
+        with open(path, "rb") as f:
+            return self.add_elf(key, ComparableElf(f))
+
+
+    def remove(self, key: str):
+        signature = self.signatures.pop(key)
+        for band, band_key in self._band_keys(signature):
+            bucket = self._buckets[band][band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band][band_key]
+
+
+    def candidates(self, signature: List[int]) -> Set[str]:
+        """ Keys of signatures sharing at least one band with signature. """
+        result = set()
+        for band, band_key in self._band_keys(signature):
+            result.update(self._buckets[band].get(band_key, ()))
+        return result
+
+
+    def candidate_pairs(self, threshold: float = 0.0) -> Set[Tuple[str, str]]:
+        """
+        Pairs of keys sharing at least one bucket.
+        :threshold: minimal estimated similarity of pair
+        :returns: set of sorted tuples (key_1, key_2).
+        """
+        result = set()
+
+        for buckets in self._buckets:
+            for bucket in buckets.values():
+                if len(bucket) < 2:
+                    continue
+                keys = sorted(bucket)
+                for i, key_1 in enumerate(keys):
+                    for key_2 in keys[i + 1:]:
+                        result.add((key_1, key_2))
+
+        if threshold > 0:
+            result = {
+                pair for pair in result
+                if self.similarity(*pair) >= threshold}
+
+        return result
+
+
+    def similarity(self, key_1: str, key_2: str) -> float:
+        """ Estimated similarity of two indexed files. """
+        return estimate_similarity(
+            self.signatures[key_1], self.signatures[key_2])
+
+
+    def save(self, path: str):
+        """ Save index to JSON file. Buckets are rebuilt on load. """
+        data = {
+            "num_perm": self.minhasher.num_perm,
+            "bands": self.bands,
+            "seed": self.minhasher.seed,
+            "chunk_size": self.chunk_size,
+            "signatures": self.signatures,
+            }
+
+        # Write to temporary file first, so index is never broken.
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+
+
+    @classmethod
+    def load(cls, path: str) -> "LshIndex":
+        """ Load index saved by save(). """
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        index = cls(
+            data["num_perm"], data["bands"], data["seed"], data["chunk_size"])
+        for key, signature in data["signatures"].items():
+            index.add(key, signature)
+
+        return index
+
+
+def compare_candidates(
+    index: LshIndex, paths: Dict[str, str], threshold: float = 0.0,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+    **kwargs) -> Iterator[Tuple[str, str, ElfDiff]]:
+    """
+    Run full compare only for candidate pairs of index. Files of many
+    pairs are kept open while they fit to memory_budget (see batch.py).
+    :paths: dictionary {key: path to ELF file}
+    :threshold: minimal estimated similarity of pair
+    :kwargs: passed to ComparableElf.compare_to()
+    :returns: iterator of tuples (key_1, key_2, ElfDiff).
+    """
+    pairs = sorted(index.candidate_pairs(threshold))
+    results = compare_pairs(
+        ((paths[key_1], paths[key_2]) for key_1, key_2 in pairs),
+        memory_budget, **kwargs)
+
+    for (key_1, key_2), (_, _, diff) in zip(pairs, results):
+        yield key_1, key_2, diff
@@ -0,0 +1,400 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare daemon: keeps parsed ComparableElf objects in LRU cache and
+serves compare requests on Unix socket. Protocol is one JSON request line
+and one JSON response line per connection, see client.py.
+
+Run: python3 -m elfcmp.daemon SOCKET
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+import argparse
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+from .elfcmp import ComparableElf
+from .rules import Rules
+from .structs import BlockType
+
+
+class _SharedFile(io.RawIOBase):
+    """
+    Read only file which can be read by many threads at once: every thread
+    has own position and data is read by os.pread(), so concurrent seeks
+    and reads do not interfere.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._fd = os.open(path, os.O_RDONLY)
+        self._size = os.fstat(self._fd).st_size
+        self._local = threading.local()
+
+
+    def readable(self) -> bool:
+        return True
+
+
+    def seekable(self) -> bool:
+        return True
+
+
+    def tell(self) -> int:
+        return getattr(self._local, "position", 0)
+
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("Negative seek position: {}".format(offset))
+        self._local.position = offset
+        return offset
+
+
+    def readinto(self, buffer) -> int:
+        position = self.tell()
+        data = os.pread(self._fd, len(buffer), position)
+        buffer[:len(data)] = data
+        self._local.position = position + len(data)
+        return len(data)
+
+
+    def fileno(self) -> int:
+        return self._fd
+
+
+    def close(self):
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+
+class _CacheEntry:
+    """
+    Cached parsed file. Metadata of entry.elf is shared read only by
+    requests, every compare runs on its own ComparableElf.view().
+
+    :signature: (st_mtime_ns, st_size, st_ino) of file when it was parsed
+    :concurrent: file is read by os.pread(), so compares can run at once,
+        compressed files are read by SeekableDecompressor with shared state
+    :lock: serializes compares of not concurrent entry and computing of
+        digests
+    :users: count of threads using entry, evicted entry is closed when it
+        drops to zero
+    :digests: cache of section digests {name: digest}
+    """
+
+    def __init__(self, path: str, signature: Tuple[int, int, int]):
+        self.path = path
+        self.signature = signature
+        self.file = _SharedFile(path)
+        try:
+            self.elf = ComparableElf(self.file, compact=True)
+        except Exception:
+            self.file.close()
+            raise
+        self.concurrent = self.elf.stream is self.file
+        self.size = self.elf.metadata_size()
+        self.lock = threading.Lock()
+        self.users = 0
+        self.evicted = False
+        self.digests = None
+
+
+    def section_digests(self) -> Dict[str, str]:
+        """ Digests of sections data, computed once. """
+        with self.lock:
+            if self.digests is None:
+                self.digests = {
+                    block.name(): block.digest()
+                    for block in self.elf.used_blocks
+                    if block.block_type == BlockType.SECTION}
+            return self.digests
+
+
+    def close(self):
+        self.file.close()
+
+
+def _signature(path: str) -> Tuple[int, int, int]:
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+class ElfCache:
+    """
+    Thread safe LRU cache of parsed files bounded by count of files and by
+    sum of their metadata sizes (see ComparableElf.metadata_size()). Files
+    are parsed in compact mode (see compact.py). Entry is parsed again if
+    mtime, size or inode of file were changed.
+
+    :max_entries: maximal count of cached files (and open descriptors)
+    :max_bytes: maximal sum of cached files metadata sizes
+    """
+
+    def __init__(
+        self, max_entries: int = 64, max_bytes: int = 256 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+
+    def _acquire(self, path: str) -> _CacheEntry:
+        """ Get up to date entry and register its user. """
+        path = os.path.abspath(path)
+        signature = _signature(path)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(path)
+                entry.users += 1
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Parse without cache lock, other requests are served meanwhile.
+        new_entry = _CacheEntry(path, signature)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.signature == signature:
+                # Parsed by another thread meanwhile.
+                new_entry.close()
+                self._entries.move_to_end(path)
+            else:
+                if entry is not None:
+                    self._remove(entry)
+                entry = new_entry
+                self._entries[path] = entry
+                self._size += entry.size
+                self._shrink(keep=entry)
+
+            entry.users += 1
+            return entry
+
+
+    def _release(self, entry: _CacheEntry):
+        with self._lock:
+            entry.users -= 1
+            if entry.evicted and entry.users == 0:
+                entry.close()
+
+
+    def _remove(self, entry: _CacheEntry):
+        """ Remove entry from cache, call under cache lock. """
+        del self._entries[entry.path]
+        self._size -= entry.size
+        entry.evicted = True
+        if entry.users == 0:
+            entry.close()
+
+
+    def _shrink(self, keep: _CacheEntry):
+        """ Evict least recently used entries over limits. """
+        while (len(self._entries) > 1
+            and (len(self._entries) > self.max_entries
+                or self._size > self.max_bytes)):
+            oldest = next(iter(self._entries.values()))
+            if oldest is keep:
+                break
+            self._remove(oldest)
+
+
+    @contextmanager
+    def open(self, *paths: str) -> Iterator[List[_CacheEntry]]:
+        """
+        Context manager giving cache entries of files, parsed
+        ComparableElf is in entry.elf, it must not be changed, compare its
+        view(). Entries are not locked, only not concurrent ones (see
+        _CacheEntry) are. Locks are taken in order of paths, so concurrent
+        requests with same files never deadlock. Same path gives same entry.
+        """
+        entries = {}
+        locked = []
+
+        try:
+            for path in paths:
+                path = os.path.abspath(path)
+                if path not in entries:
+                    entries[path] = self._acquire(path)
+
+            for path in sorted(entries):
+                if not entries[path].concurrent:
+                    entries[path].lock.acquire()
+                    locked.append(entries[path])
+
+            yield [entries[os.path.abspath(p)] for p in paths]
+
+        finally:
+            for entry in locked:
+                entry.lock.release()
+            for entry in entries.values():
+                self._release(entry)
+
+
+    def clear(self):
+        with self._lock:
+            for entry in list(self._entries.values()):
+                self._remove(entry)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                }
+
+
+class CompareServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Threaded Unix socket server of compare requests. Requests are JSON
+    objects with "command" key:
+        compare: "left", "right" paths, optional "rules" (see
+            Rules.from_dict()) and "similarity"; result is ElfDiff.to_dict()
+            and "text" of ElfDiff
+        digests: "path"; result is {section name: sha256 digest}
+        stats: cache statistics
+    Response is {"ok": true, "result": ...} or {"ok": false, "error": text}.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, cache: ElfCache = None):
+        self.cache = cache if cache is not None else ElfCache()
+        super().__init__(socket_path, _RequestHandler)
+
+
+    def handle_command(self, request: dict):
+        command = request.get("command")
+
+        if command == "compare":
+            rules = None
+            if request.get("rules") is not None:
+                rules = Rules.from_dict(request["rules"])
+
+            with self.cache.open(request["left"], request["right"]) \
+            as (left, right):
+                # Cached objects are shared, compare state is kept in views.
+                diff = left.elf.view().compare_to(
+                    right.elf.view(), rules, bool(request.get("similarity")))
+                # Serialize while entries are in use, diff refers to them.
+                result = diff.to_dict()
+                result["text"] = str(diff)
+                return result
+
+        if command == "digests":
+            with self.cache.open(request["path"]) as (entry,):
+                return dict(entry.section_digests())
+
+        if command == "stats":
+            return self.cache.stats()
+
+        raise ValueError("Unknown command: {}".format(command))
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            response = {
+                "ok": True, "result": self.server.handle_command(request)}
+        except Exception as e:
+            response = {"ok": False, "error": "{}: {}".format(
+                type(e).__name__, e)}
+
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+def _remove_stale_socket(socket_path: str):
+    """
+    Remove socket left by stopped daemon. Path which is not a socket or
+    socket of running daemon is not removed.
+    """
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(
+            "Path exists and is not a socket: {}".format(socket_path))
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+            return
+
+    raise FileExistsError(
+        "Another daemon is listening on socket: {}".format(socket_path))
+
+
+def serve(socket_path: str, cache: ElfCache = None):
+    """ Serve requests on Unix socket until interrupted. """
+    _remove_stale_socket(socket_path)
+
+    with CompareServer(socket_path, cache) as server:
+        try:
+            server.serve_forever()
+        finally:
+            server.cache.clear()
+            os.unlink(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ELF compare daemon.")
+    parser.add_argument("socket", help="path to Unix socket")
+    parser.add_argument(
+        "--max-entries", type=int, default=64,
+        help="maximal count of cached files")
+    parser.add_argument(
+        "--max-bytes", type=int, default=256 * 1024 ** 2,
+        help="maximal memory of cached files metadata")
+    args = parser.parse_args()
+
+    try:
+        serve(args.socket, ElfCache(args.max_entries, args.max_bytes))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,626 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from itertools import zip_longest
+from typing import Dict, List, Tuple
+import hashlib
+
+from .elfcmp import ComparableElf
+
+
+DW_AT_name = 0x03
+DW_AT_stmt_list = 0x10
+
+# DWARF 5 unit types with extra header fields.
+DW_UT_type = 0x02
+DW_UT_skeleton = 0x04
+DW_UT_split_compile = 0x05
+DW_UT_split_type = 0x06
+
+DW_FORM_addr = 0x01
+DW_FORM_block2 = 0x03
+DW_FORM_block4 = 0x04
+DW_FORM_string = 0x08
+DW_FORM_block = 0x09
+DW_FORM_block1 = 0x0a
+DW_FORM_sdata = 0x0d
+DW_FORM_strp = 0x0e
+DW_FORM_ref_addr = 0x10
+DW_FORM_indirect = 0x16
+DW_FORM_sec_offset = 0x17
+DW_FORM_exprloc = 0x18
+DW_FORM_strp_sup = 0x1d
+DW_FORM_line_strp = 0x1f
+DW_FORM_implicit_const = 0x21
+
+# Forms of fixed size.
+_FIXED_FORM_SIZES = {
+    0x05: 2, 0x06: 4, 0x07: 8, 0x0b: 1, 0x0c: 1, 0x11: 1, 0x12: 2,
+    0x13: 4, 0x14: 8, 0x19: 0, 0x1c: 4, 0x1e: 16, 0x20: 8, 0x21: 0,
+    0x24: 8, 0x25: 1, 0x26: 2, 0x27: 3, 0x28: 4, 0x29: 1, 0x2a: 2,
+    0x2b: 3, 0x2c: 4,
+    }
+
+# Forms of unsigned LEB128 values.
+_ULEB_FORMS = {0x0f, 0x15, 0x1a, 0x1b, 0x22, 0x23}
+
+# Forms of offsets to string sections.
+_STRING_FORMS = {DW_FORM_strp, DW_FORM_line_strp, DW_FORM_strp_sup}
+
+# Forms of offsets to other sections, their values are not hashed.
+_OFFSET_FORMS = {DW_FORM_sec_offset, DW_FORM_ref_addr}
+
+# pyelftools forms of references, they change when DIEs are moved.
+_REFERENCE_FORMS = {
+    "DW_FORM_ref1", "DW_FORM_ref2", "DW_FORM_ref4", "DW_FORM_ref8",
+    "DW_FORM_ref_udata", "DW_FORM_ref_addr", "DW_FORM_sec_offset",
+    }
+
+
+def _uleb(data: bytes, pos: int) -> Tuple[int, int]:
+    """ Read unsigned LEB128. :returns: tuple (value, next position). """
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _sleb(data: bytes, pos: int) -> Tuple[int, int]:
+    """ Read signed LEB128. :returns: tuple (value, next position). """
+    start = pos
+    value, pos = _uleb(data, pos)
+    bits = 7 * (pos - start)
+    if value & (1 << (bits - 1)):
+        value -= 1 << bits
+    return value, pos
+
+
+def _string(data: bytes, offset: int) -> bytes:
+    """ NUL-terminated string at offset of string section. """
+    end = data.find(b"\0", offset)
+    return data[offset:end] if end >= 0 else data[offset:]
+
+
+class Unit:
+    """
+    Unit of .debug_info or .debug_line found by its header.
+
+    :offset: offset of unit in section
+    :size: size of unit with header
+    :version: DWARF version
+    :offset_size: 4 for 32-bit DWARF, 8 for 64-bit DWARF
+    :header_size: size of header, for .debug_line units only fields up to
+        version are counted
+    :unit_type: DW_UT_* for DWARF 5 .debug_info units, 1 (DW_UT_compile)
+        for older ones, None for .debug_line units
+    :address_size: size of addresses, None for .debug_line units
+    :abbrev_offset: offset of abbreviations in .debug_abbrev, None for
+        .debug_line units
+    """
+
+    def __init__(
+        self, offset: int, size: int, version: int, offset_size: int,
+        header_size: int, unit_type: int = None, address_size: int = None,
+        abbrev_offset: int = None):
+
+        self.offset = offset
+        self.size = size
+        self.version = version
+        self.offset_size = offset_size
+        self.header_size = header_size
+        self.unit_type = unit_type
+        self.address_size = address_size
+        self.abbrev_offset = abbrev_offset
+
+
+def split_units(
+    data: bytes, little_endian: bool = True, info: bool = True) -> List[Unit]:
+    """
+    Split section to units reading only their headers.
+    :info: data is .debug_info, otherwise .debug_line
+    """
+    byteorder = "little" if little_endian else "big"
+
+    def uint(pos, size):
+        return int.from_bytes(data[pos:pos + size], byteorder)
+
+    result = []
+    pos = 0
+
+    while pos + 4 <= len(data):
+        length = uint(pos, 4)
+        offset_size = 4
+        start = pos + 4
+        if length == 0xffffffff:
+            length = uint(pos + 4, 8)
+            offset_size = 8
+            start = pos + 12
+
+        end = start + length
+        # Zero padding or truncated section.
+        if length == 0 or end > len(data):
+            break
+
+        version = uint(start, 2)
+        unit = Unit(pos, end - pos, version, offset_size, start + 2 - pos)
+
+        if info and version >= 5:
+            unit.unit_type = data[start + 2]
+            unit.address_size = data[start + 3]
+            unit.abbrev_offset = uint(start + 4, offset_size)
+            header_end = start + 4 + offset_size
+            if unit.unit_type in (DW_UT_type, DW_UT_split_type):
+                header_end += 8 + offset_size
+            elif unit.unit_type in (DW_UT_skeleton, DW_UT_split_compile):
+                header_end += 8
+            unit.header_size = header_end - pos
+
+        elif info:
+            unit.unit_type = 1
+            unit.abbrev_offset = uint(start + 2, offset_size)
+            unit.address_size = data[start + 2 + offset_size]
+            unit.header_size = start + 3 + offset_size - pos
+
+        result.append(unit)
+        pos = end
+
+    return result
+
+
+def parse_abbrevs(data: bytes, offset: int) -> Dict[int, tuple]:
+    """
+    Parse abbreviations table at offset of .debug_abbrev.
+    :returns: dictionary {code: (tag, has children, list of (attribute,
+        form, implicit constant))}.
+    """
+    result = {}
+    pos = offset
+
+    while pos < len(data):
+        code, pos = _uleb(data, pos)
+        if code == 0:
+            break
+        tag, pos = _uleb(data, pos)
+        has_children = data[pos]
+        pos += 1
+
+        attributes = []
+        while True:
+            attribute, pos = _uleb(data, pos)
+            form, pos = _uleb(data, pos)
+            if attribute == 0 and form == 0:
+                break
+            constant = None
+            if form == DW_FORM_implicit_const:
+                constant, pos = _sleb(data, pos)
+            attributes.append((attribute, form, constant))
+
+        result[code] = (tag, has_children, attributes)
+
+    return result
+
+
+class _Scanner:
+    """
+    Reads attribute values of data and feeds them to hash. Offsets into
+    string sections are replaced with strings, offsets into other
+    sections are skipped, other bytes are hashed as is.
+    """
+
+    def __init__(
+        self, data: bytes, pos: int, hash_, strings: Dict[int, bytes],
+        offset_size: int, address_size: int, byteorder: str):
+
+        self.data = data
+        self.pos = pos
+        self.run = pos
+        self.hash = hash_
+        self.strings = strings
+        self.offset_size = offset_size
+        self.address_size = address_size
+        self.byteorder = byteorder
+
+
+    def flush(self):
+        """ Hash bytes read since last flush. """
+        if self.run < self.pos:
+            self.hash.update(self.data[self.run:self.pos])
+        self.run = self.pos
+
+
+    def uleb(self) -> int:
+        value, self.pos = _uleb(self.data, self.pos)
+        return value
+
+
+    def uint(self, size: int) -> int:
+        value = int.from_bytes(
+            self.data[self.pos:self.pos + size], self.byteorder)
+        self.pos += size
+        return value
+
+
+    def form(self, form: int):
+        """
+        Read value of form.
+        :returns: string for string forms, number for offsets and
+            constants of fixed size, None for others.
+        """
+        data = self.data
+
+        if form in _FIXED_FORM_SIZES:
+            return self.uint(_FIXED_FORM_SIZES[form])
+
+        if form in _STRING_FORMS:
+            self.flush()
+            value = _string(
+                self.strings.get(form, b""), self.uint(self.offset_size))
+            self.hash.update(value + b"\0")
+            self.run = self.pos
+            return value
+
+        if form in _OFFSET_FORMS:
+            self.flush()
+            value = self.uint(self.offset_size)
+            self.run = self.pos
+            return value
+
+        if form in _ULEB_FORMS:
+            return self.uleb()
+
+        if form == DW_FORM_addr:
+            return self.uint(self.address_size)
+
+        if form == DW_FORM_string:
+            end = data.index(b"\0", self.pos)
+            value = data[self.pos:end]
+            self.pos = end + 1
+            return value
+
+        if form == DW_FORM_sdata:
+            value, self.pos = _sleb(data, self.pos)
+            return value
+
+        if form in (DW_FORM_block, DW_FORM_exprloc):
+            size = self.uleb()
+        elif form == DW_FORM_block1:
+            size = self.uint(1)
+        elif form == DW_FORM_block2:
+            size = self.uint(2)
+        elif form == DW_FORM_block4:
+            size = self.uint(4)
+        elif form == DW_FORM_indirect:
+            return self.form(self.uleb())
+        else:
+            raise ValueError("Unknown DWARF form: {}".format(hex(form)))
+        self.pos += size
+        return None
+
+
+class CompileUnit:
+    """
+    Compilation unit found by read_units().
+
+    :name: DW_AT_name of unit DIE, "#N" suffix is added to repeated names
+    :offset: offset of unit in .debug_info
+    :info_digest: digest of unit DIEs with normalized offsets
+    :line_digest: digest of unit line program, None if there is no one
+    :parsed: False if DIEs are not read, info_digest is digest of raw
+        unit then
+    """
+
+    def __init__(
+        self, name: str, offset: int, info_digest: str,
+        line_digest: str = None, parsed: bool = True):
+
+        self.name = name
+        self.offset = offset
+        self.info_digest = info_digest
+        self.line_digest = line_digest
+        self.parsed = parsed
+
+
+def _section_data(elf: ComparableElf, name: str) -> bytes:
+    for section in elf.sections:
+        if section.name == name:
+            return section.data()
+    return b""
+
+
+def _hash_unit(
+    data: bytes, unit: Unit, abbrevs: Dict[int, tuple],
+    strings: Dict[int, bytes], byteorder: str, top: dict) -> str:
+    """
+    Hash DIEs of unit, attributes are read by abbreviations without
+    building DIE tree. Abbreviation codes are replaced with hashes of
+    their declarations, so only declarations used by unit are hashed.
+    :param top: dictionary to put DW_AT_name and DW_AT_stmt_list of unit
+        DIE to, they are put as soon as read.
+    :returns: hex digest.
+    """
+    hash_ = hashlib.blake2b(digest_size=16)
+    hash_.update(bytes([unit.version, unit.unit_type, unit.address_size]))
+
+    scanner = _Scanner(
+        data, unit.offset + unit.header_size, hash_, strings,
+        unit.offset_size, unit.address_size, byteorder)
+    end = unit.offset + unit.size
+    declarations = {0: b"\0"}
+    first = True
+
+    while scanner.pos < end:
+        scanner.flush()
+        code = scanner.uleb()
+        scanner.run = scanner.pos
+        if code not in declarations:
+            declarations[code] = hashlib.blake2b(
+                repr(abbrevs[code]).encode("utf-8"), digest_size=8).digest()
+        hash_.update(declarations[code])
+        if code == 0:
+            continue
+
+        _, _, attributes = abbrevs[code]
+        for attribute, form, _ in attributes:
+            value = scanner.form(form)
+            if first and attribute in (DW_AT_name, DW_AT_stmt_list):
+                top[attribute] = value
+        first = False
+
+    scanner.flush()
+    return hash_.hexdigest()
+
+
+def _hash_line_program(
+    data: bytes, unit: Unit, strings: Dict[int, bytes],
+    byteorder: str) -> str:
+    """
+    Hash line program. Directory and file tables of DWARF 5 are read by
+    their entry formats to replace string offsets with strings.
+    """
+    hash_ = hashlib.blake2b(digest_size=16)
+    start = unit.offset + unit.header_size - 2
+    end = unit.offset + unit.size
+
+    if unit.version < 5:
+        hash_.update(data[start:end])
+        return hash_.hexdigest()
+
+    address_size = data[start + 2]
+    scanner = _Scanner(
+        data, start, hash_, strings, unit.offset_size, address_size,
+        byteorder)
+    # version, address_size, segment_selector_size
+    scanner.pos += 4
+    scanner.flush()
+    # header_length depends on lengths of strings, skip it.
+    scanner.uint(unit.offset_size)
+    scanner.run = scanner.pos
+    # minimum_instruction_length ... line_range
+    scanner.pos += 5
+    opcode_base = scanner.uint(1)
+    scanner.pos += opcode_base - 1
+
+    for _ in range(2):
+        # Directories, then file names.
+        formats = []
+        for _ in range(scanner.uint(1)):
+            content_type = scanner.uleb()
+            formats.append((content_type, scanner.uleb()))
+        for _ in range(scanner.uleb()):
+            for _, form in formats:
+                scanner.form(form)
+
+    scanner.pos = end
+    scanner.flush()
+    return hash_.hexdigest()
+
+
+def read_units(elf: ComparableElf) -> Dict[str, CompileUnit]:
+    """
+    Find compilation units of .debug_info and their line programs in
+    .debug_line. Units are found by headers, unit DIEs are read by
+    abbreviations only to hash them and to get names.
+    :returns: dictionary {name: CompileUnit}.
+    """
+    byteorder = "little" if elf.little_endian else "big"
+    info = _section_data(elf, ".debug_info")
+    abbrev = _section_data(elf, ".debug_abbrev")
+    line = _section_data(elf, ".debug_line")
+    strings = {
+        DW_FORM_strp: _section_data(elf, ".debug_str"),
+        DW_FORM_line_strp: _section_data(elf, ".debug_line_str"),
+        }
+
+    line_programs = {
+        unit.offset: unit
+        for unit in split_units(line, elf.little_endian, info=False)}
+    abbrevs_cache = {}
+    result = {}
+
+    for unit in split_units(info, elf.little_endian):
+        if unit.abbrev_offset not in abbrevs_cache:
+            abbrevs_cache[unit.abbrev_offset] = parse_abbrevs(
+                abbrev, unit.abbrev_offset)
+        abbrevs = abbrevs_cache[unit.abbrev_offset]
+
+        top = {}
+        parsed = True
+        try:
+            digest = _hash_unit(info, unit, abbrevs, strings, byteorder, top)
+        except (KeyError, IndexError, ValueError):
+            # Unknown form or broken unit, it is hashed as is.
+            digest = hashlib.blake2b(
+                info[unit.offset:unit.offset + unit.size],
+                digest_size=16).hexdigest()
+            parsed = False
+
+        # Units without names are matched by order like not used blocks.
+        name = top.get(DW_AT_name)
+        stmt_list = top.get(DW_AT_stmt_list)
+        if isinstance(name, bytes):
+            name = name.decode("utf-8", "replace")
+        else:
+            name = "<unnamed unit>" if parsed else "<unparsed unit>"
+        unique_name = name
+        index = 1
+        while unique_name in result:
+            unique_name = "{}#{}".format(name, index)
+            index += 1
+
+        line_digest = None
+        if stmt_list in line_programs:
+            line_digest = _hash_line_program(
+                line, line_programs[stmt_list], strings, byteorder)
+
+        result[unique_name] = CompileUnit(
+            unique_name, unit.offset, digest, line_digest, parsed)
+
+    return result
+
+
+class DebugInfoDiff:
+    """
+    Result of compare_debug_info().
+
+    :added: set of names of units of second file only
+    :removed: set of names of units of first file only
+    :changed: dictionary {name: set of changed parts: "info", "line"}
+    :offsets: dictionary {name: (offset in first file, offset in second
+        file)} of changed units, see diff_unit_dies()
+    :unparsed: set of names of units not parsed in any file, they are
+        compared as raw bytes
+    """
+
+    def __init__(self):
+        self.added = set()
+        self.removed = set()
+        self.changed = {}
+        self.offsets = {}
+        self.unparsed = set()
+
+
+    def has_changes(self) -> bool:
+        """ Check if any changes were found. """
+        return bool(self.added or self.removed or self.changed)
+
+
+    def __str__(self):
+        result = []
+
+        for name in sorted(self.removed):
+            result.append("Removed unit: {}".format(name))
+
+        for name in sorted(self.added):
+            result.append("Added unit: {}".format(name))
+
+        for name, parts in sorted(self.changed.items()):
+            result.append("Changed unit: {} ({})".format(
+                name, ", ".join(sorted(parts))))
+
+        for name in sorted(self.unparsed):
+            result.append("Unparsed unit: {}".format(name))
+
+        return "\n".join(result)
+
+
+def compare_debug_info(
+    left: ComparableElf, right: ComparableElf) -> DebugInfoDiff:
+    """
+    Compare compilation units of files by digests (see read_units()).
+    Use diff_unit_dies() for DIE level differences of changed units.
+    """
+    units_1 = read_units(left)
+    units_2 = read_units(right)
+    result = DebugInfoDiff()
+    result.removed = units_1.keys() - units_2.keys()
+    result.added = units_2.keys() - units_1.keys()
+
+    result.unparsed = {
+        name for units in (units_1, units_2)
+        for name, unit in units.items() if not unit.parsed}
+
+    for name in units_1.keys() & units_2.keys():
+        parts = set()
+        if units_1[name].info_digest != units_2[name].info_digest:
+            parts.add("info")
+        if units_1[name].line_digest != units_2[name].line_digest:
+            parts.add("line")
+        if parts:
+            result.changed[name] = parts
+            result.offsets[name] = (units_1[name].offset, units_2[name].offset)
+
+    return result
+
+
+def _die_name(die) -> str:
+    name = die.attributes.get("DW_AT_name")
+    if name is None:
+        return die.tag
+    value = name.value
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "replace")
+    return "{} {}".format(die.tag, value)
+
+
+def _die_attributes(die) -> dict:
+    """ Attributes of DIE without references, they change with layout. """
+    return {
+        name: attribute.value for name, attribute in die.attributes.items()
+        if attribute.form not in _REFERENCE_FORMS}
+
+
+def diff_unit_dies(
+    left: ComparableElf, right: ComparableElf, left_offset: int,
+    right_offset: int, max_differences: int = 20) -> List[str]:
+    """
+    DIE level differences of units at offsets in .debug_info (see
+    DebugInfoDiff.offsets), DIEs are parsed by pyelftools for these units
+    only. DIEs are compared in order, compare stops on first different
+    tag, since DIE trees differ after it.
+    :returns: list of descriptions of differences.
+    """
+    unit_1 = left.get_dwarf_info().get_CU_at(left_offset)
+    unit_2 = right.get_dwarf_info().get_CU_at(right_offset)
+    result = []
+
+    for die_1, die_2 in zip_longest(unit_1.iter_DIEs(), unit_2.iter_DIEs()):
+        if len(result) >= max_differences:
+            break
+
+        if die_1 is None or die_2 is None or die_1.tag != die_2.tag:
+            result.append("DIE {} -> {}".format(
+                _die_name(die_1) if die_1 is not None else None,
+                _die_name(die_2) if die_2 is not None else None))
+            break
+
+        attributes_1 = _die_attributes(die_1)
+        attributes_2 = _die_attributes(die_2)
+        for attribute in sorted(attributes_1.keys() | attributes_2.keys()):
+            value_1 = attributes_1.get(attribute)
+            value_2 = attributes_2.get(attribute)
+            if value_1 != value_2:
+                result.append("{}: {}: {!r} -> {!r}".format(
+                    _die_name(die_1), attribute, value_1, value_2))
+
+    return result[:max_differences]
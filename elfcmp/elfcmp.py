@@ -17,14 +17,21 @@
 # You should have received a copy of the GNU General Public License
 # along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Any, Tuple, List, Dict, Union, Optional
+from typing import Any, Tuple, List, Dict, Set, Union, Optional, Iterator
+import copy
 import io
+import itertools
 import sys
 
 from elftools.elf.elffile import ELFFile
 from elftools.elf.sections import Section
 from elftools.elf.segments import Segment
 
+from .compact import *
+from .fastheaders import read_sections, read_segments
+from .compressed import open_decompressed
+from .rules import Level, Rules
+from .similarity import similarity as data_similarity
 from .structs import *
 from .utils import *
 
@@ -51,6 +58,21 @@ def _group_segments(
     return result
         
 
+def _dict_diff_events(
+    dict_diff: DictDiff, left_new: EventType, right_new: EventType,
+    modified: EventType) -> Iterator[DiffEvent]:
+    """ Events of DictDiff changes with given types. """
+    levels = dict_diff.levels
+
+    for event_type, keys in (
+        (left_new, dict_diff.left_new), (right_new, dict_diff.right_new)):
+        for key in sorted(keys, key=str):
+            yield DiffEvent(event_type, key, level=levels.get(key))
+
+    for key, value in dict_diff.modified.items():
+        yield DiffEvent(modified, key, value, levels.get(key))
+
+
 class ComparableElf(ELFFile):
     """
     Elf file that can be compared with another one via compare_to() method.
@@ -58,11 +80,25 @@ class ComparableElf(ELFFile):
         to store ei_ident so it is harder to compare.
     :other: ComparableElf compared with self by compare_to().
     :compare_result: ElfDiff - last result of compare_to().
+
+    Stream may contain gzip, xz or bz2 compressed ELF file, it is
+    decompressed on the fly by SeekableDecompressor (see compressed.py).
+
+    Sections and segments are CompactSection and CompactSegment (see
+    compact.py) read by fastheaders.py, full pyelftools objects are made on
+    demand by get_section(section.index) and get_segment(index).
+
+    :compact: share parsers of ELF structures with other files of same
+        kind (see share_structs()), what takes few times less memory.
     """
 
-    def __init__(self, stream):
-        super(ComparableElf, self).__init__(stream)
+    def __init__(self, stream, compact: bool = False):
+        super(ComparableElf, self).__init__(open_decompressed(stream))
+        self.compact = compact
         self.other = None
+        self.rules = Rules()
+        self.similarity = False
+        self.equal_ranges = []
         self.read_metadata()
         self.compare_result = ElfDiff()
 
@@ -79,12 +115,47 @@ class ComparableElf(ELFFile):
             k: v for (k, v) in self.header.items() if k != "e_ident" }
         self.header_raw.update(
             {k: v for (k, v) in self.header["e_ident"].items()})
-        self.sections = [*self.iter_sections()]
-        self.segments = [*self.iter_segments()]
+        if self.compact:
+            share_structs(self)
+        # Header tables are decoded by struct, pyelftools objects are made
+        # on demand by get_section() and get_segment().
+        self.sections = read_sections(self)
+        self.segments = read_segments(self)
         self.used_blocks = self._get_used_blocks()
         self.not_used_blocks = self._get_not_used_blocks()
 
 
+    def view(self) -> "ComparableElf":
+        """
+        Copy sharing read metadata (headers, sections, blocks) with this
+        instance, but with own compare state (rules, other, compare_result),
+        so many compares of one parsed file can run at once, see daemon.py.
+        Stream is shared too, concurrent compares need stream which is safe
+        for concurrent reads.
+        """
+        result = copy.copy(self)
+        result.other = None
+        result.rules = Rules()
+        result.similarity = False
+        result.equal_ranges = []
+        result.compare_result = ElfDiff()
+        return result
+
+
+    def metadata_size(self) -> int:
+        """
+        Rough estimate of memory used by metadata in bytes, see
+        estimate_size() in compact.py. Parsers are shared in compact mode,
+        so they are not counted.
+        """
+        size = sys.getsizeof(self.header_raw) + estimate_size(
+            self.sections + self.segments
+            + self.used_blocks + self.not_used_blocks)
+        if not self.compact:
+            size += PARSERS_SIZE
+        return size
+
+
     def file_size(self):
         """ Returns size of file in bytes. """
         # Faster alternative, but not sure it works for all streams.
@@ -103,18 +174,70 @@ class ComparableElf(ELFFile):
         Compare segments. First group them by type in dictionary.
         Then compare groups of same type in left and rigth ELF files.
         Data is not compared since it is compared in sections and blocks.
+        Segments of ignored types (see rules.py) are skipped.
         """
-        left_segments = _group_segments(self.segments)
-        right_segments = _group_segments(self.other.segments)
-
-        self.compare_result.compared_segments = compare_dict(
+        rules = self.rules
+        left_segments = _group_segments(self._not_ignored_segments())
+        right_segments = _group_segments(self.other._not_ignored_segments())
+
+        # Drop ignored header fields from every segment header.
+        for segments in (left_segments, right_segments):
+            for group in segments.values():
+                for offset in group:
+                    group[offset] = rules.filter_dict(
+                        "segment_header_keys", group[offset])
+
+        result = compare_dict(
             left_segments, right_segments, deep=True, include_same=False
             )
+        result.levels = rules.key_levels(
+            "segment_types", result.changed_keys())
+
+        self.compare_result.compared_segments = result
+
+
+    def _not_ignored_segments(self) -> List[Segment]:
+        """ Segments which types are not ignored by rules. """
+        return [
+            s for s in self.segments
+            if self.rules.level("segment_types", s["p_type"]) != Level.IGNORED
+            ]
+
+
+    def _known_equal(
+        self, offset_1: int, offset_2: int, size_1: int, size_2: int) -> bool:
+        """
+        Check if data at offsets is known to be equal in both files
+        without reading it, see equal_ranges in compare_to().
+        """
+        return (
+            offset_1 == offset_2 and size_1 == size_2
+            and interval_covers(
+                self.equal_ranges, offset_1, offset_1 + size_1))
+
+
+    def _section_level(self, section: Section) -> Level:
+        """ Level of section differences according to rules. """
+        return self.rules.section_level(section.name, section["sh_type"])
         
 
-    def _compare_sections(self):
+    def _compare_sections(self, names: Set[str] = None):
         """
         Compare sections by name, header and data content.
+        :names: compare only common sections with these names, unique
+            sections are found anyway.
+        """
+        sections_1, sections_2 = self._compare_sections_names()
+        self.compare_result.compared_sections.modified = dict(
+            self._iter_sections_diffs(sections_1, sections_2, names))
+
+
+    def _compare_sections_names(self) -> Tuple[Dict[str, Section], ...]:
+        """
+        Find unique sections and store them to
+        compare_result.compared_sections, modified sections are not filled.
+        :returns: tuple of not ignored sections dictionaries {name: Section}
+            of both files.
         """
         # Make dictionaries of sections {name: Section} to compare.
         # TODO: 
@@ -125,25 +248,65 @@ class ComparableElf(ELFFile):
         #   Drawback of this method: new section in the beginning will give
         #   false positive diffs on all other sections. Like this:
         #   new-1, 1-2, 2-3, etc.
-        sections_dict_1 = {s.name : s for s in self.sections}
-        sections_dict_2 = {s.name : s for s in self.other.sections}
+        # Ignored sections are dropped here, before any data is read.
+        sections_dict_1 = {
+            s.name : s for s in self.sections
+            if self._section_level(s) != Level.IGNORED}
+        sections_dict_2 = {
+            s.name : s for s in self.other.sections
+            if self.other._section_level(s) != Level.IGNORED}
 
         # Compare by name to find unique sections.
         compared_section_names = compare_dict(
             sections_dict_1, sections_dict_2, 
             include_modified=False, deep=True)
 
+        levels = {
+            name: self._section_level(sections_dict_1[name])
+            for name in compared_section_names.left_new}
+        levels.update({
+            name: self.other._section_level(sections_dict_2[name])
+            for name in compared_section_names.right_new})
+
+        self.compare_result.compared_sections = AllSectionsDiff(
+            left_new = compared_section_names.left_new,
+            right_new = compared_section_names.right_new,
+            modified = {},
+            levels = levels
+            )
+
+        return sections_dict_1, sections_dict_2
+
+
+    def _iter_sections_diffs(
+        self, sections_dict_1: Dict[str, Section],
+        sections_dict_2: Dict[str, Section],
+        names: Set[str] = None) -> Iterator[Tuple[str, SectionDiff]]:
+        """
+        Compare common sections one by one, see _compare_sections().
+        :returns: iterator of (name, SectionDiff) of modified sections.
+        """
+        rules = self.rules
+
         # Compare sections with same names (common sections).
-        common_section_names = compared_section_names.common_keys
-        modified_sections = dict()
+        common_section_names = sections_dict_1.keys() & sections_dict_2.keys()
+        if names is not None:
+            common_section_names = common_section_names & set(names)
 
         for section_name in common_section_names:
 
             section_1 = sections_dict_1[section_name]
             section_2 = sections_dict_2[section_name]
 
-            header_1 = section_1.header
-            header_2 = section_2.header
+            # Section level is higher of both sides (types may differ).
+            level = max(
+                self._section_level(section_1),
+                self.other._section_level(section_2))
+
+            header_1 = rules.filter_dict(
+                "section_header_keys", section_1.header)
+            header_2 = rules.filter_dict(
+                "section_header_keys", section_2.header)
 
             # Section has dictionary-like interface for header. 
             compared_headers = compare_dict(
@@ -152,8 +315,18 @@ class ComparableElf(ELFFile):
             # We are not interested in offset of name.
             compared_headers.modified.pop("sh_name", None)
 
-            data_1 = section_1.data()
-            data_2 = section_2.data()
+            # Header fields without own rule get level of section.
+            compared_headers.levels = {
+                key: rules.matchers["section_header_keys"].match(key) or level
+                for key in compared_headers.changed_keys()}
+
+            if self._known_equal(
+                section_1["sh_offset"], section_2["sh_offset"],
+                section_1["sh_size"], section_2["sh_size"]):
+                data_1 = data_2 = b""
+            else:
+                data_1 = section_1.data()
+                data_2 = section_2.data()
 
             len_1 = len(data_1)
             len_2 = len(data_2)
@@ -167,16 +340,17 @@ class ComparableElf(ELFFile):
                 diff_index
                 )
 
-            if compared_section.has_changes():
-                modified_sections[section_name] = compared_section
+            # Data is already in memory, hash it without second read.
+            if self.similarity and diff_index != -1:
+                compared_section.similarity = data_similarity(data_1, data_2)
 
-        result = AllSectionsDiff(
-            left_new = compared_section_names.left_new,
-            right_new = compared_section_names.right_new,
-            modified = modified_sections
-            )
-
-        self.compare_result.compared_sections = result
+            if compared_section.has_changes():
+                if compared_section.data_sizes or diff_index != -1:
+                    compared_section.level = level
+                else:
+                    compared_section.level = max(
+                        compared_headers.levels.values())
+                yield section_name, compared_section
 
 
     def _get_used_blocks(self) -> List[Block]:
@@ -295,34 +469,25 @@ class ComparableElf(ELFFile):
         Also compare free blocks not occuped by anything = not_used_blocks.
         Also check for used_blocks overlaps (2 blocks intersected).
         """
-        result = AllBlocksDiff()
+        self._compare_blocks_layout()
+        self.compare_result.compared_blocks.diffs_in_not_used = list(
+            self._iter_blocks_diffs())
 
-        not_used_blocks_counts = (
-            len(self.not_used_blocks), len(self.other.not_used_blocks))
-        
-        # Compare not used blocks only if counts are equal. 
-        # Hard to say if there are any same or diff block otherwise.
-        # Blocks should already be sorted by offset here.
-        if not_used_blocks_counts[0] == not_used_blocks_counts[1]:
-
-            for block_1, block_2 \
-            in zip(self.not_used_blocks, self.other.not_used_blocks):
 
-                block_diff = NotUsedBlockDiff()
-
-                if block_1.size != block_2.size:
-                    block_diff.data_sizes = (block_1.size, block_2.size)
-
-                # We dont care about offset value, just data.
-                block_diff.data_diff_offset = locate_array_diff(
-                    block_1.data(), block_2.data())
+    def _compare_blocks_layout(self):
+        """
+        Compare counts of not used blocks and find overlaps, store them to
+        compare_result.compared_blocks. Blocks data is not read.
+        """
+        level = self.rules.level("block_types", BlockType.NOT_USED.name)
+        result = AllBlocksDiff(level=level)
 
-                if block_diff.has_changes():
-                    block_diff.left_block = block_1
-                    block_diff.right_block = block_2
-                    result.diffs_in_not_used.append(block_diff)
+        not_used_blocks_counts = (
+            len(self.not_used_blocks), len(self.other.not_used_blocks))
 
-        else: # Diff in counts of not used blocks. Else None.
+        # Counts are compared only for not ignored blocks.
+        if (level != Level.IGNORED
+            and not_used_blocks_counts[0] != not_used_blocks_counts[1]):
             result.counts_of_not_used = not_used_blocks_counts
 
         result.left_overlaps_in_used = self._check_overlapped_blocks(
@@ -334,24 +499,223 @@ class ComparableElf(ELFFile):
         self.compare_result.compared_blocks = result
 
 
-    def compare_to(self, other: "ComparableElf") -> ElfDiff:
+    def _iter_blocks_diffs(self) -> Iterator[NotUsedBlockDiff]:
+        """
+        Compare not used blocks one by one, see _compare_blocks().
+        :returns: iterator of NotUsedBlockDiff of different blocks.
+        """
+        level = self.compare_result.compared_blocks.level
+        
+        # Compare not used blocks only if counts are equal. 
+        # Hard to say if there are any same or diff block otherwise.
+        # Blocks should already be sorted by offset here.
+        # Ignored by rules blocks are not read at all.
+        if (level == Level.IGNORED
+            or len(self.not_used_blocks) != len(self.other.not_used_blocks)):
+            return
+
+        for block_1, block_2 \
+        in zip(self.not_used_blocks, self.other.not_used_blocks):
+
+            block_diff = NotUsedBlockDiff(level=level)
+
+            if block_1.size != block_2.size:
+                block_diff.data_sizes = (block_1.size, block_2.size)
+
+            # We dont care about offset value, just data.
+            if self._known_equal(
+                block_1.start_offset, block_2.start_offset,
+                block_1.size, block_2.size):
+                data_1 = data_2 = b""
+            else:
+                data_1 = block_1.data()
+                data_2 = block_2.data()
+            block_diff.data_diff_offset = locate_array_diff(data_1, data_2)
+
+            if self.similarity and block_diff.data_diff_offset != -1:
+                block_diff.similarity = data_similarity(data_1, data_2)
+
+            if block_diff.has_changes():
+                block_diff.left_block = block_1
+                block_diff.right_block = block_2
+                yield block_diff
+
+
+    def compare_to(
+        self, other: "ComparableElf", rules: Rules = None,
+        similarity: bool = False,
+        equal_ranges: List[Tuple[int, int]] = None) -> ElfDiff:
         """
         Compare this instance to another.
+        :rules: ignore and severity rules (see rules.py), by default
+            nothing is ignored and every difference has ERROR level.
+        :similarity: compute similarity scores (see similarity.py) for
+            sections and not used blocks with different data. Slow for
+            big sections, since hashing is done in pure Python.
+        :equal_ranges: sorted intervals (start, end) of file offsets where
+            both files are known to have same bytes (see stream.py). Data
+            with same offset and size inside them is not read.
         :returns: ElfDiff object.
         """
-        self.other = other
-        self.compare_result = ElfDiff()
-        result = self.compare_result
-        result.left_elf = self
-        result.right_elf = other
-
-        # ELFFile has dictionary-like interface for ELF header. 
-        # Use header_raw with extracted ei_ident, for easy compare.
-        result.compared_elf_headers = compare_dict(
-            self.header_raw, self.other.header_raw, include_same=False)
+        self._start_compare(other, rules, similarity, equal_ranges)
 
+        self._compare_headers()
         self._compare_segments()
         self._compare_sections()
         self._compare_blocks()
 
+        return self.compare_result
+
+
+    def iter_compare(
+        self, other: "ComparableElf", rules: Rules = None,
+        similarity: bool = False,
+        equal_ranges: List[Tuple[int, int]] = None,
+        max_events: int = None) -> Iterator[DiffEvent]:
+        """
+        Compare this instance to another like compare_to(), but give
+        differences as soon as they are found. Sections and not used blocks
+        are compared one by one, so compare stops when iteration stops and
+        rest of data is not read. ElfDiff.from_events() builds ElfDiff of
+        all events.
+        :max_events: stop after this count of events, None means no limit
+        :returns: iterator of DiffEvent.
+        """
+        return itertools.islice(
+            self._iter_events(other, rules, similarity, equal_ranges),
+            max_events)
+
+
+    def _iter_events(
+        self, other: "ComparableElf", rules: Rules = None,
+        similarity: bool = False,
+        equal_ranges: List[Tuple[int, int]] = None) -> Iterator[DiffEvent]:
+        """ Run compare phases, see iter_compare(). """
+        self._start_compare(other, rules, similarity, equal_ranges)
+        result = self.compare_result
+
+        self._compare_headers()
+        yield from _dict_diff_events(
+            result.compared_elf_headers, EventType.HEADER_LEFT_NEW,
+            EventType.HEADER_RIGHT_NEW, EventType.HEADER_MODIFIED)
+
+        self._compare_segments()
+        yield from _dict_diff_events(
+            result.compared_segments, EventType.SEGMENT_LEFT_NEW,
+            EventType.SEGMENT_RIGHT_NEW, EventType.SEGMENT_MODIFIED)
+
+        sections_1, sections_2 = self._compare_sections_names()
+        sections = result.compared_sections
+        for event_type, names in (
+            (EventType.SECTION_LEFT_NEW, sections.left_new),
+            (EventType.SECTION_RIGHT_NEW, sections.right_new)):
+            for name in sorted(names):
+                yield DiffEvent(
+                    event_type, name, level=sections.levels.get(name))
+
+        for name, section_diff in self._iter_sections_diffs(
+            sections_1, sections_2):
+            sections.modified[name] = section_diff
+            yield DiffEvent(
+                EventType.SECTION_MODIFIED, name, section_diff,
+                section_diff.level)
+
+        self._compare_blocks_layout()
+        blocks = result.compared_blocks
+        for event_type, overlaps in (
+            (EventType.LEFT_OVERLAP, blocks.left_overlaps_in_used),
+            (EventType.RIGHT_OVERLAP, blocks.right_overlaps_in_used)):
+            for overlap in overlaps:
+                yield DiffEvent(event_type, value=overlap, level=blocks.level)
+
+        if blocks.counts_of_not_used is not None:
+            yield DiffEvent(
+                EventType.NOT_USED_COUNTS, value=blocks.counts_of_not_used,
+                level=blocks.level)
+
+        for block_diff in self._iter_blocks_diffs():
+            blocks.diffs_in_not_used.append(block_diff)
+            yield DiffEvent(
+                EventType.NOT_USED_MODIFIED, value=block_diff,
+                level=block_diff.level)
+
+
+    def recompare(
+        self, other: "ComparableElf", previous: ElfDiff,
+        phases: Set[str], section_names: Set[str] = None,
+        rules: Rules = None, similarity: bool = False) -> ElfDiff:
+        """
+        Run only some compare phases again, other parts of result are taken
+        from previous result of same files with same rules (see watch.py).
+        :phases: set of phases to run: "headers", "segments", "sections",
+            "blocks"
+        :section_names: names of sections to compare in "sections" phase,
+            None means all. Previous results of other sections are kept,
+            unique sections are always found again.
+        :returns: ElfDiff object.
+        """
+        self._start_compare(other, rules, similarity)
+        result = self.compare_result
+
+        if "headers" in phases:
+            self._compare_headers()
+        else:
+            result.compared_elf_headers = previous.compared_elf_headers
+
+        if "segments" in phases:
+            self._compare_segments()
+        else:
+            result.compared_segments = previous.compared_segments
+
+        if "sections" not in phases:
+            result.compared_sections = previous.compared_sections
+        elif section_names is None:
+            self._compare_sections()
+        else:
+            self._compare_sections(section_names)
+            sections = result.compared_sections
+            common = (
+                {s.name for s in self.sections}
+                & {s.name for s in other.sections})
+            previous_modified = previous.compared_sections.modified or {}
+            for name, diff in previous_modified.items():
+                if name not in section_names and name in common:
+                    sections.modified[name] = diff
+
+        if "blocks" in phases:
+            self._compare_blocks()
+        else:
+            # Blocks are bound to new files.
+            result.compared_blocks = AllBlocksDiff.from_dict(
+                previous.compared_blocks.to_dict(), self, other)
+
         return result
+
+
+    def _start_compare(
+        self, other: "ComparableElf", rules: Rules = None,
+        similarity: bool = False,
+        equal_ranges: List[Tuple[int, int]] = None):
+        """ Set compare options and make new result. """
+        self.rules = rules if rules is not None else Rules()
+        other.rules = self.rules
+        self.similarity = similarity
+        self.equal_ranges = equal_ranges or []
+        self.other = other
+        self.compare_result = ElfDiff()
+        self.compare_result.left_elf = self
+        self.compare_result.right_elf = other
+
+
+    def _compare_headers(self):
+        """ Compare ELF headers. """
+        # ELFFile has dictionary-like interface for ELF header. 
+        # Use header_raw with extracted ei_ident, for easy compare.
+        result = compare_dict(
+            self.rules.filter_dict("header_keys", self.header_raw),
+            self.rules.filter_dict("header_keys", self.other.header_raw),
+            include_same=False)
+        result.levels = self.rules.key_levels(
+            "header_keys", result.changed_keys())
+
+        self.compare_result.compared_elf_headers = result
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, List
+import io
+import struct
+
+from elftools.common.exceptions import ELFParseError
+from elftools.elf.elffile import ELFFile
+
+from .compact import *
+
+
+# Struct formats of headers in SECTION_HEADER_KEYS order.
+_SECTION_FORMATS = {32: "IIIIIIIIII", 64: "IIQQQQIIQQ"}
+
+# Struct formats of program headers with order of fields in them.
+_SEGMENT_FORMATS = {
+    32: ("IIIIIIII", (
+        "p_type", "p_offset", "p_vaddr", "p_paddr", "p_filesz", "p_memsz",
+        "p_flags", "p_align")),
+    64: ("IIQQQQQQ", (
+        "p_type", "p_flags", "p_offset", "p_vaddr", "p_paddr", "p_filesz",
+        "p_memsz", "p_align")),
+    }
+
+
+def _decoding(struct_, field: str) -> Dict[int, str]:
+    """ Enum values {number: name} of field of pyelftools struct. """
+    for subcon in struct_.subcons:
+        if subcon.name == field:
+            return getattr(subcon, "decoding", {})
+    return {}
+
+
+def _read_table(
+    elf: ELFFile, offset: int, entry_size: int, count: int,
+    format_: str) -> List[tuple]:
+    """ Read table by one call and unpack entries of entry_size bytes. """
+    format_ = ("<" if elf.little_endian else ">") + format_
+    padding = entry_size - struct.calcsize(format_)
+    if padding < 0:
+        raise ValueError("Too small table entry size: {}".format(entry_size))
+    if padding:
+        format_ += "{}x".format(padding)
+
+    elf.stream.seek(offset, io.SEEK_SET)
+    data = elf.stream.read(entry_size * count)
+    # Same error as pyelftools gives for truncated file.
+    if len(data) < entry_size * count:
+        raise ELFParseError(
+            "Reading table at offset {} past EOF".format(offset))
+    return list(struct.iter_unpack(format_, data))
+
+
+def _read_names(elf: ELFFile, headers: List[tuple]) -> List[str]:
+    """ Names of sections from section names string table read once. """
+    index = elf.get_shstrndx()
+    if not 0 < index < len(headers):
+        return [""] * len(headers)
+
+    offset_index = SECTION_HEADER_KEYS.index("sh_offset")
+    size_index = SECTION_HEADER_KEYS.index("sh_size")
+    elf.stream.seek(headers[index][offset_index], io.SEEK_SET)
+    table = elf.stream.read(headers[index][size_index])
+
+    result = []
+    for header in headers:
+        start = header[0]
+        end = table.find(b"\0", start)
+        name = table[start:end] if end >= 0 else table[start:]
+        result.append(name.decode("utf-8", errors="replace"))
+    return result
+
+
+def read_sections(elf: ELFFile) -> List:
+    """
+    Read section header table by one call and decode it by
+    struct.iter_unpack(), names are read from one copy of section names
+    string table. Values are same as pyelftools gives: types are decoded
+    by enums of file parsers, so machine specific types are decoded too.
+    Full pyelftools section is elf.get_section(section.index).
+    :returns: list of CompactSection, compressed sections are pyelftools
+        objects (see compact_section()).
+    """
+    count = elf.num_sections()
+    if count == 0:
+        return []
+
+    headers = _read_table(
+        elf, elf["e_shoff"], elf["e_shentsize"], count,
+        _SECTION_FORMATS[elf.elfclass])
+    names = _read_names(elf, headers)
+    types = _decoding(elf.structs.Elf_Shdr, "sh_type")
+    type_index = SECTION_HEADER_KEYS.index("sh_type")
+    flags_index = SECTION_HEADER_KEYS.index("sh_flags")
+
+    result = []
+    for index, (header, name) in enumerate(zip(headers, names)):
+        if header[flags_index] & SHF_COMPRESSED:
+            result.append(elf.get_section(index))
+            continue
+
+        values = list(header)
+        values[type_index] = types.get(values[type_index], values[type_index])
+        result.append(CompactSection(name, tuple(values), elf.stream, index))
+
+    return result
+
+
+def read_segments(elf: ELFFile) -> List[CompactSegment]:
+    """ Read program header table by one call. """
+    count = elf.num_segments()
+    if count == 0:
+        return []
+
+    format_, keys = _SEGMENT_FORMATS[elf.elfclass]
+    headers = _read_table(
+        elf, elf["e_phoff"], elf["e_phentsize"], count, format_)
+    types = _decoding(elf.structs.Elf_Phdr, "p_type")
+
+    # Reorder fields to SEGMENT_HEADER_KEYS.
+    order = [keys.index(key) for key in SEGMENT_HEADER_KEYS]
+    type_index = SEGMENT_HEADER_KEYS.index("p_type")
+
+    result = []
+    for header in headers:
+        values = [header[i] for i in order]
+        values[type_index] = types.get(values[type_index], values[type_index])
+        result.append(CompactSegment(tuple(values)))
+
+    return result
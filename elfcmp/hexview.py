@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Iterator, List, Tuple
+import io
+import os
+
+from .structs import *
+
+
+def read_window(stream, offset: int, size: int) -> bytes:
+    """
+    Read bytes at offset without changing stream position: os.pread() for
+    real files, seek and restore for other streams.
+    """
+    if size <= 0:
+        return b""
+
+    # Only files are checked, fileno() of some streams has side effects
+    # (SpooledTemporaryFile moves data to disk).
+    raw = getattr(stream, "raw", stream)
+    if hasattr(os, "pread") and isinstance(raw, io.FileIO):
+        # Flush not written data of buffered writers, if any.
+        if stream.writable():
+            stream.flush()
+        return os.pread(raw.fileno(), size, offset)
+
+    saved_position = stream.tell()
+    try:
+        stream.seek(offset, io.SEEK_SET)
+        return stream.read(size)
+    finally:
+        stream.seek(saved_position, io.SEEK_SET)
+
+
+def read_windows(
+    stream, windows: List[Tuple[int, int]],
+    max_gap: int = 4096) -> List[bytes]:
+    """
+    Read many windows (offset, size) of stream. Windows closer than max_gap
+    bytes to each other are read by one call.
+    :returns: list of bytes in order of windows.
+    """
+    result = [b""] * len(windows)
+    order = sorted(range(len(windows)), key=lambda i: windows[i][0])
+
+    i = 0
+    while i < len(order):
+        # Collect group of close windows.
+        group = [order[i]]
+        start = windows[order[i]][0]
+        end = start + windows[order[i]][1]
+        i += 1
+
+        while i < len(order) and windows[order[i]][0] <= end + max_gap:
+            offset, size = windows[order[i]]
+            end = max(end, offset + size)
+            group.append(order[i])
+            i += 1
+
+        data = read_window(stream, start, end - start)
+        for index in group:
+            offset, size = windows[index]
+            result[index] = data[offset - start:offset - start + size]
+
+    return result
+
+
+def sections_by_name(elf) -> dict:
+    """ Sections of elf by names, first one of same named sections. """
+    result = {}
+    for section in elf.sections:
+        result.setdefault(section.name, section)
+    return result
+
+
+def file_size(section) -> int:
+    """ Size of section data in file, 0 for SHT_NOBITS. """
+    if section["sh_type"] == "SHT_NOBITS":
+        return 0
+    return section["sh_size"]
+
+
+def _ascii(data: bytes) -> str:
+    return "".join(chr(b) if 0x20 <= b < 0x7F else "." for b in data)
+
+
+def iter_rows(
+    left: bytes, right: bytes, start: int,
+    width: int = 16) -> Iterator[Tuple[int, bytes, bytes, List[int]]]:
+    """
+    Rows of side by side views of two byte arrays.
+    :start: offset of first byte
+    :returns: iterator of tuples (offset, left row, right row, indexes of
+        different bytes in rows), bytes missing in one row are different.
+    """
+    for row in range(0, max(len(left), len(right)), width):
+        left_row = left[row:row + width]
+        right_row = right[row:row + width]
+        different = [
+            i for i in range(max(len(left_row), len(right_row)))
+            if i >= len(left_row) or i >= len(right_row)
+                or left_row[i] != right_row[i]]
+        yield start + row, left_row, right_row, different
+
+
+def render_side_by_side(
+    left: bytes, right: bytes, start: int, width: int = 16) -> str:
+    """
+    Render hex and ASCII dumps of two byte arrays side by side.
+    Lines with differences are marked with "*", different bytes with "^"
+    in line below.
+    :start: offset of first byte, printed on lines
+    """
+    lines = []
+    hex_width = width * 3
+
+    for offset, left_row, right_row, different in iter_rows(
+        left, right, start, width):
+
+        lines.append("{} {}  {:<{w}}|{:<{a}}|  {:<{w}}|{:<{a}}|".format(
+            "*" if different else " ",
+            format(offset, "08X"),
+            " ".join(format(b, "02X") for b in left_row), _ascii(left_row),
+            " ".join(format(b, "02X") for b in right_row), _ascii(right_row),
+            w=hex_width, a=width))
+
+        if different:
+            marks = "".join(
+                "^^ " if i in different else "   "
+                for i in range(max(len(left_row), len(right_row))))
+            lines.append(" " * 12 + marks.rstrip())
+
+    return "\n".join(lines)
+
+
+class DiffWindow:
+    """
+    Window of context around reported difference.
+
+    :title: description of difference (section name or blocks)
+    :start: offset of window from the beginning of compared data
+    :left_offset: offset of compared data in left file
+    :right_offset: offset of compared data in right file
+    :left_size: count of window bytes in left data (clipped by data size)
+    :right_size: count of window bytes in right data
+    """
+
+    def __init__(
+        self, title: str, start: int, left_offset: int, right_offset: int,
+        left_size: int, right_size: int):
+
+        self.title = title
+        self.start = start
+        self.left_offset = left_offset
+        self.right_offset = right_offset
+        self.left_size = left_size
+        self.right_size = right_size
+
+
+def diff_window(
+    title: str, diff_offset: int, context: int,
+    left_offset: int, left_data_size: int,
+    right_offset: int, right_data_size: int) -> DiffWindow:
+    """
+    Window of context bytes before and after diff_offset, clipped to
+    compared data, so bytes of neighbouring data are never shown.
+    """
+    start = max(0, diff_offset - context)
+    end = diff_offset + context
+    return DiffWindow(
+        title, start, left_offset, right_offset,
+        max(0, min(end, left_data_size) - start),
+        max(0, min(end, right_data_size) - start))
+
+
+def diff_windows(diff: ElfDiff, context: int = 16) -> List[DiffWindow]:
+    """
+    Windows of context bytes before and after first data differences of
+    sections (SectionDiff) and not used blocks (NotUsedBlockDiff).
+    """
+    result = []
+    modified = diff.compared_sections.modified or {}
+
+    if modified:
+        left_sections = sections_by_name(diff.left_elf)
+        right_sections = sections_by_name(diff.right_elf)
+
+    for name in sorted(modified):
+        section_diff = modified[name]
+        if section_diff.data_diff_offset == -1:
+            continue
+
+        left = left_sections[name]
+        right = right_sections[name]
+        result.append(diff_window(
+            "Section {}".format(name), section_diff.data_diff_offset, context,
+            left["sh_offset"], file_size(left),
+            right["sh_offset"], file_size(right)))
+
+    for block_diff in diff.compared_blocks.diffs_in_not_used:
+        if block_diff.data_diff_offset == -1:
+            continue
+
+        left, right = block_diff.left_block, block_diff.right_block
+        result.append(diff_window(
+            "Blocks {} {}".format(left, right),
+            block_diff.data_diff_offset, context,
+            left.start_offset, left.size, right.start_offset, right.size))
+
+    return result
+
+
+def read_diff_windows(
+    diff: ElfDiff, windows: List[DiffWindow]) -> List[Tuple[bytes, bytes]]:
+    """
+    Read windows from files of diff by read_windows().
+    :returns: list of tuples (left bytes, right bytes) in order of windows.
+    """
+    left_data = read_windows(
+        diff.left_elf.stream,
+        [(w.left_offset + w.start, w.left_size) for w in windows])
+    right_data = read_windows(
+        diff.right_elf.stream,
+        [(w.right_offset + w.start, w.right_size) for w in windows])
+    return list(zip(left_data, right_data))
+
+
+def hex_context(diff: ElfDiff, context: int = 16, width: int = 16) -> str:
+    """
+    Side by side hex and ASCII views around every reported difference.
+    Only windows are read from files, without moving streams positions,
+    close windows are read by single call.
+    :context: count of bytes before and after difference
+    """
+    windows = diff_windows(diff, context)
+
+    result = []
+    for window, (left, right) in zip(
+        windows, read_diff_windows(diff, windows)):
+        result.append("{}:\n{}".format(
+            window.title,
+            render_side_by_side(left, right, window.start, width)))
+
+    return "\n\n".join(result)
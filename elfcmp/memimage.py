@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import List, Tuple
+import bisect
+import io
+import mmap
+
+from .elfcmp import ComparableElf
+from .sampling import DEFAULT_PAGE_SIZE
+from .utils import *
+
+
+def _split_segment(segment: tuple, start: int, end: int) -> List[tuple]:
+    """ Parts of segment (p_vaddr, p_memsz, ...) out of [start, end). """
+    address, memsz, offset, filesz = segment
+    result = []
+    if address < start:
+        size = min(memsz, start - address)
+        result.append((address, size, offset, min(filesz, size)))
+    if address + memsz > end:
+        skip = max(0, end - address)
+        result.append((
+            address + skip, memsz - skip, offset + skip,
+            max(0, filesz - skip)))
+    return result
+
+
+def _load_segments(elf: ComparableElf) -> List[tuple]:
+    """
+    Not empty PT_LOAD segments as (p_vaddr, p_memsz, p_offset, p_filesz)
+    sorted by address. Overlapping segments are resolved like loader maps
+    them: later segment replaces addresses of earlier ones.
+    """
+    result = []
+    for s in elf.segments:
+        if s["p_type"] != "PT_LOAD" or s["p_memsz"] == 0:
+            continue
+        segment = (s["p_vaddr"], s["p_memsz"], s["p_offset"], s["p_filesz"])
+        start, end = segment[0], segment[0] + segment[1]
+        parts = []
+        for other in result:
+            if other[0] < end and start < other[0] + other[1]:
+                parts.extend(_split_segment(other, start, end))
+            else:
+                parts.append(other)
+        parts.append(segment)
+        result = parts
+    return sorted(result)
+
+
+class MemoryImage:
+    """
+    Virtual address view of file as loaded to memory by PT_LOAD segments:
+    file bytes are mapped at p_vaddr, the rest of p_memsz (BSS) is zero
+    filled. Image is never built in memory: real files are mapped by mmap
+    and read without copies, other streams are read by pages.
+    Use as context manager or call close().
+
+    :segments: sorted by address list of (p_vaddr, p_memsz, p_offset,
+        p_filesz) of not empty PT_LOAD segments, parts of segments
+        overlapped by later ones are removed
+    """
+
+    def __init__(self, elf: ComparableElf):
+        self.elf = elf
+        self.segments = _load_segments(elf)
+        self._addresses = [segment[0] for segment in self.segments]
+        self._map = None
+
+        # Only files are mapped, like in hexview.read_window().
+        raw = getattr(elf.stream, "raw", elf.stream)
+        if isinstance(raw, io.FileIO):
+            try:
+                self._map = mmap.mmap(
+                    raw.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Views returned by read() are still alive, mapping is
+                # closed when they are released.
+                pass
+            self._map = None
+
+
+    def ranges(self) -> List[Tuple[int, int]]:
+        """ Sorted not intersected address ranges [start, end) of image. """
+        return merge_intervals(
+            [(address, address + size) for address, size, _, _
+                in self.segments])
+
+
+    def _segment(self, address: int):
+        """ Segment containing address or None. """
+        index = bisect.bisect_right(self._addresses, address) - 1
+        if index >= 0:
+            segment = self.segments[index]
+            if address < segment[0] + segment[1]:
+                return segment
+        return None
+
+
+    def _read_file(self, offset: int, size: int):
+        """ File bytes, zero padded if file is truncated. """
+        if self._map is not None:
+            data = memoryview(self._map)[offset:offset + size]
+        else:
+            self.elf.stream.seek(offset)
+            data = self.elf.stream.read(size)
+        if len(data) < size:
+            data = bytes(data) + bytes(size - len(data))
+        return data
+
+
+    def is_zero_fill(self, address: int, size: int) -> bool:
+        """ Check if range is inside BSS part of one segment. """
+        segment = self._segment(address)
+        if segment is None:
+            return False
+        start, memsz, _, filesz = segment
+        return (
+            address >= start + filesz and address + size <= start + memsz)
+
+
+    def read(self, address: int, size: int):
+        """
+        Bytes of image at address, range must be inside image. File bytes
+        of one segment are returned as memoryview of mapped file.
+        """
+        parts = []
+        end = address + size
+
+        while address < end:
+            segment = self._segment(address)
+            if segment is None:
+                raise ValueError("Address is not mapped: {}".format(
+                    format(address, "02X")))
+
+            start, memsz, offset, filesz = segment
+            part_end = min(end, start + memsz)
+            file_end = min(part_end, start + filesz)
+
+            if address < file_end:
+                parts.append(self._read_file(
+                    offset + address - start, file_end - address))
+                address = file_end
+            if address < part_end:
+                parts.append(bytes(part_end - address))
+                address = part_end
+
+        if len(parts) == 1:
+            return parts[0]
+        return b"".join(parts)
+
+
+class ImageDiff:
+    """
+    Result of compare_images().
+
+    :left_only: address ranges [start, end) mapped in first image only
+    :right_only: address ranges mapped in second image only
+    :different: address ranges of different pages of both images
+    :pages_compared: count of compared pages, zero filled pages of both
+        images are not compared
+    """
+
+    def __init__(self):
+        self.left_only = []
+        self.right_only = []
+        self.different = []
+        self.pages_compared = 0
+
+
+    def has_changes(self) -> bool:
+        """ Check if any changes were found. """
+        return bool(self.left_only or self.right_only or self.different)
+
+
+    def __str__(self):
+        def ranges(intervals):
+            return ", ".join(
+                "{}-{}".format(format(start, "02X"), format(end - 1, "02X"))
+                for start, end in intervals)
+
+        result = []
+
+        if self.left_only:
+            result.append("Left only: {}".format(ranges(self.left_only)))
+
+        if self.right_only:
+            result.append("Right only: {}".format(ranges(self.right_only)))
+
+        if self.different:
+            result.append("Different: {}".format(ranges(self.different)))
+
+        return "\n".join(result)
+
+
+def _intersect(
+    intervals_1: List[Tuple[int, int]],
+    intervals_2: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """ Intersection of sorted not intersected intervals. """
+    result = []
+    i = j = 0
+
+    while i < len(intervals_1) and j < len(intervals_2):
+        start = max(intervals_1[i][0], intervals_2[j][0])
+        end = min(intervals_1[i][1], intervals_2[j][1])
+        if start < end:
+            result.append((start, end))
+        if intervals_1[i][1] < intervals_2[j][1]:
+            i += 1
+        else:
+            j += 1
+
+    return result
+
+
+def _subtract(
+    intervals_1: List[Tuple[int, int]],
+    intervals_2: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """ Parts of intervals_1 not covered by intervals_2, both sorted. """
+    result = []
+
+    for start, end in intervals_1:
+        for start_2, end_2 in intervals_2:
+            if end_2 <= start or start_2 >= end:
+                continue
+            if start_2 > start:
+                result.append((start, start_2))
+            start = max(start, end_2)
+        if start < end:
+            result.append((start, end))
+
+    return result
+
+
+def compare_images(
+    left: ComparableElf, right: ComparableElf,
+    page_size: int = DEFAULT_PAGE_SIZE) -> ImageDiff:
+    """
+    Compare memory images of files (see MemoryImage) page by page, pages
+    are aligned to page_size in address space. Only two pages are held in
+    memory at once.
+    """
+    result = ImageDiff()
+
+    with MemoryImage(left) as image_1, MemoryImage(right) as image_2:
+        ranges_1 = image_1.ranges()
+        ranges_2 = image_2.ranges()
+        result.left_only = _subtract(ranges_1, ranges_2)
+        result.right_only = _subtract(ranges_2, ranges_1)
+        different = []
+
+        for start, end in _intersect(ranges_1, ranges_2):
+            address = start
+            while address < end:
+                page_end = min(end, (address // page_size + 1) * page_size)
+                size = page_end - address
+
+                if not (image_1.is_zero_fill(address, size)
+                    and image_2.is_zero_fill(address, size)):
+                    result.pages_compared += 1
+                    if image_1.read(address, size) != image_2.read(
+                        address, size):
+                        different.append((address, page_end))
+
+                address = page_end
+
+        result.different = merge_intervals(different)
+
+    return result
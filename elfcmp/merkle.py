@@ -0,0 +1,392 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import os
+import struct
+import tempfile
+
+from .elfcmp import ComparableElf
+from .sampling import DEFAULT_PAGE_SIZE, named_blocks
+from .structs import Block
+from .utils import *
+
+
+# Version of sidecar format.
+FORMAT_VERSION = 2
+
+SIDECAR_MAGIC = b"ELFCMPMT"
+
+DIGEST_SIZE = 16
+
+SIDECAR_SUFFIX = ".merkle"
+
+
+# Sidecar header: magic, version, page size, file mtime_ns, file size,
+# trees count.
+_HEADER = struct.Struct("<8sIIqQI")
+
+# Tree header: name length, start offset, size, levels count, followed by
+# name, sizes of levels and levels.
+_TREE_HEADER = struct.Struct("<HQQI")
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+class MerkleTree:
+    """
+    Hash tree of block pages. Level 0 are digests of pages, every next
+    level node is digest of two nodes below, last level is root.
+
+    :start_offset, size: block position in file
+    :levels: list of levels, every level is concatenation of digests
+    """
+
+    def __init__(self, start_offset: int, size: int, levels: List[bytes]):
+        self.start_offset = start_offset
+        self.size = size
+        self.levels = levels
+
+
+    @classmethod
+    def from_pages(
+        cls, start_offset: int, size: int,
+        pages: Iterable[bytes]) -> "MerkleTree":
+        """ Build tree of data pages. """
+        level = b"".join(_digest(page) for page in pages)
+        levels = [level]
+
+        while len(level) > DIGEST_SIZE:
+            level = b"".join(
+                _digest(level[i:i + 2 * DIGEST_SIZE])
+                for i in range(0, len(level), 2 * DIGEST_SIZE))
+            levels.append(level)
+
+        return cls(start_offset, size, levels)
+
+
+    @classmethod
+    def from_block(
+        cls, block: Block, page_size: int = DEFAULT_PAGE_SIZE) -> "MerkleTree":
+        """ Build tree of block read by chunks of whole pages. """
+        chunk_size = max(1, (1024 * 1024) // page_size) * page_size
+
+        def pages():
+            for chunk in block.iter_data(chunk_size):
+                for i in range(0, len(chunk), page_size):
+                    yield chunk[i:i + page_size]
+
+        return cls.from_pages(block.start_offset, block.size, pages())
+
+
+    def node(self, level: int, index: int) -> Optional[bytes]:
+        """ Digest of node, None if there is no such node. """
+        nodes = self.levels[level] if level < len(self.levels) else b""
+        return nodes[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE] or None
+
+
+    def count(self, level: int) -> int:
+        """ Count of nodes on level. """
+        if level >= len(self.levels):
+            return 0
+        return len(self.levels[level]) // DIGEST_SIZE
+
+
+    def pack(self, name: str) -> bytes:
+        """ Binary record of tree with name, see unpack(). """
+        name = name.encode("utf-8")
+        return b"".join([
+            _TREE_HEADER.pack(
+                len(name), self.start_offset, self.size, len(self.levels)),
+            name,
+            struct.pack(
+                "<{}Q".format(len(self.levels)),
+                *(len(level) for level in self.levels)),
+            *self.levels])
+
+
+    @classmethod
+    def unpack(cls, data: bytes, offset: int) -> Tuple[str, "MerkleTree", int]:
+        """
+        Read tree record of pack() at offset of data.
+        :returns: tuple (name, tree, offset of next record).
+        """
+        name_size, start_offset, size, count = _TREE_HEADER.unpack_from(
+            data, offset)
+        offset += _TREE_HEADER.size
+        name = data[offset:offset + name_size].decode("utf-8")
+        offset += name_size
+        sizes = struct.unpack_from("<{}Q".format(count), data, offset)
+        offset += 8 * count
+
+        levels = []
+        for level_size in sizes:
+            if offset + level_size > len(data):
+                raise ValueError("Truncated sidecar")
+            levels.append(data[offset:offset + level_size])
+            offset += level_size
+
+        return name, cls(start_offset, size, levels), offset
+
+
+def diff_pages(
+    tree_1: MerkleTree, tree_2: MerkleTree) -> Tuple[List[int], int]:
+    """
+    Find different pages by descending trees from top: only children of
+    different nodes are compared. Trees of different sizes are compared
+    from top level of lower tree, nodes missing in one tree differ.
+    :returns: tuple (sorted list of indexes of different pages, count of
+        compared nodes).
+    """
+    level = min(len(tree_1.levels), len(tree_2.levels)) - 1
+    indexes = range(max(tree_1.count(level), tree_2.count(level)))
+    compared = 0
+
+    while True:
+        different = []
+        for index in indexes:
+            compared += 1
+            if tree_1.node(level, index) != tree_2.node(level, index):
+                different.append(index)
+
+        if level == 0:
+            return different, compared
+
+        level -= 1
+        count = max(tree_1.count(level), tree_2.count(level))
+        indexes = [
+            child for index in different
+            for child in (2 * index, 2 * index + 1) if child < count]
+
+
+class Sidecar:
+    """
+    Merkle trees of all used and not used blocks of file (see
+    sampling.named_blocks()), stored in binary file near it. Sidecar is bound
+    to file size and modification time, changed file makes it stale.
+
+    :page_size: size of tree leaves pages
+    :signature: (st_mtime_ns, st_size) of file
+    :trees: dictionary {block name: MerkleTree}
+    """
+
+    def __init__(
+        self, page_size: int, signature: Tuple[int, int],
+        trees: Dict[str, MerkleTree]):
+
+        self.page_size = page_size
+        self.signature = signature
+        self.trees = trees
+
+
+    @staticmethod
+    def file_signature(path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+    @classmethod
+    def build(
+        cls, path: str, elf: ComparableElf,
+        page_size: int = DEFAULT_PAGE_SIZE) -> "Sidecar":
+        """ Build trees of file at path opened as elf, file is read once. """
+        signature = cls.file_signature(path)
+        trees = {
+            name: MerkleTree.from_block(block, page_size)
+            for name, block in named_blocks(elf).items()}
+        return cls(page_size, signature, trees)
+
+
+    def save(self, sidecar_path: str):
+        """
+        Write sidecar atomically. Digests are stored as binary levels,
+        not encoded, so loading is a single read.
+        """
+        header = _HEADER.pack(
+            SIDECAR_MAGIC, FORMAT_VERSION, self.page_size, *self.signature,
+            len(self.trees))
+
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(sidecar_path)),
+            suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                for name, tree in self.trees.items():
+                    f.write(tree.pack(name))
+            os.replace(temp_path, sidecar_path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+
+    @classmethod
+    def load(cls, path: str, sidecar_path: str = None) -> Optional["Sidecar"]:
+        """
+        Read sidecar of file at path.
+        :returns: Sidecar or None if it is missing, stale or of other format.
+        """
+        sidecar_path = sidecar_path or path + SIDECAR_SUFFIX
+        try:
+            with open(sidecar_path, "rb") as f:
+                data = f.read()
+            signature = cls.file_signature(path)
+            magic, version, page_size, mtime_ns, size, count = (
+                _HEADER.unpack_from(data))
+        except (OSError, struct.error):
+            return None
+
+        if (magic != SIDECAR_MAGIC or version != FORMAT_VERSION
+            or (mtime_ns, size) != signature):
+            return None
+
+        trees = {}
+        offset = _HEADER.size
+        try:
+            for _ in range(count):
+                name, tree, offset = MerkleTree.unpack(data, offset)
+                trees[name] = tree
+        except (struct.error, ValueError):
+            return None
+
+        return cls(page_size, signature, trees)
+
+
+    @classmethod
+    def load_or_build(
+        cls, path: str, elf: ComparableElf,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        sidecar_path: str = None) -> "Sidecar":
+        """
+        Read sidecar of file, or build and save it if it is missing, stale
+        or has other page size. Sidecar is not saved if its directory is not
+        writable.
+        """
+        sidecar_path = sidecar_path or path + SIDECAR_SUFFIX
+        result = cls.load(path, sidecar_path)
+        if result is not None and result.page_size == page_size:
+            return result
+
+        result = cls.build(path, elf, page_size)
+        try:
+            result.save(sidecar_path)
+        except OSError:
+            pass
+        return result
+
+
+class TreesDiff:
+    """
+    Result of compare_trees().
+
+    :left_new: set of names of blocks of first file only
+    :right_new: set of names of blocks of second file only
+    :data_diff_offsets: dictionary {name: offset of first different byte
+        in block, see locate_array_diff()} of different blocks
+    :pages: dictionary {name: list of offsets of different pages in block}
+    :nodes_compared: count of compared tree nodes
+    :bytes_read: bytes of files data read
+    """
+
+    def __init__(self):
+        self.left_new = set()
+        self.right_new = set()
+        self.data_diff_offsets = {}
+        self.pages = {}
+        self.nodes_compared = 0
+        self.bytes_read = 0
+
+
+    def has_changes(self) -> bool:
+        """ Check if any changes were found. """
+        return bool(self.left_new or self.right_new or self.data_diff_offsets)
+
+
+    def __str__(self):
+        result = []
+
+        if self.left_new:
+            result.append("Left new blocks: {}".format(sorted(self.left_new)))
+
+        if self.right_new:
+            result.append("Right new blocks: {}".format(
+                sorted(self.right_new)))
+
+        for name, offset in sorted(self.data_diff_offsets.items()):
+            result.append(
+                "Block {}: first data diff at {}, different pages {}".format(
+                    name, format(offset, "02X"), len(self.pages[name])))
+
+        result.append("Compared {} nodes, read {} bytes".format(
+            self.nodes_compared, self.bytes_read))
+
+        return "\n".join(result)
+
+
+def _read(stream, offset: int, size: int) -> bytes:
+    stream.seek(offset)
+    return stream.read(size)
+
+
+def compare_trees(
+    left: ComparableElf, right: ComparableElf, left_sidecar: Sidecar,
+    right_sidecar: Sidecar) -> TreesDiff:
+    """
+    Compare files by their sidecars. Trees of blocks with same names are
+    descended (see diff_pages()) and only first different page of every
+    block is read from both files to find first different byte.
+    """
+    if left_sidecar.page_size != right_sidecar.page_size:
+        raise ValueError("Sidecars have different page sizes: {}, {}".format(
+            left_sidecar.page_size, right_sidecar.page_size))
+
+    page_size = left_sidecar.page_size
+    trees_1 = left_sidecar.trees
+    trees_2 = right_sidecar.trees
+    result = TreesDiff()
+    result.left_new = trees_1.keys() - trees_2.keys()
+    result.right_new = trees_2.keys() - trees_1.keys()
+
+    for name in sorted(trees_1.keys() & trees_2.keys()):
+        tree_1 = trees_1[name]
+        tree_2 = trees_2[name]
+
+        pages, compared = diff_pages(tree_1, tree_2)
+        result.nodes_compared += compared
+        # Pages of blocks of different sizes always differ at the end.
+        if not pages:
+            continue
+
+        offset = pages[0] * page_size
+        data_1 = _read(
+            left.stream, tree_1.start_offset + offset,
+            max(0, min(page_size, tree_1.size - offset)))
+        data_2 = _read(
+            right.stream, tree_2.start_offset + offset,
+            max(0, min(page_size, tree_2.size - offset)))
+        result.bytes_read += len(data_1) + len(data_2)
+
+        result.data_diff_offsets[name] = (
+            offset + locate_array_diff(data_1, data_2))
+        result.pages[name] = [page * page_size for page in pages]
+
+    return result
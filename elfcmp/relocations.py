@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from typing import Dict, List, Tuple
+import bisect
+import struct
+
+from elftools.elf.sections import Section
+
+from .elfcmp import ComparableElf
+from .utils import *
+
+
+# Relocation entry with resolved symbol name.
+# :offset: offset of patched bytes from the beginning of target section
+# :type: relocation type number (r_type)
+# :symbol: symbol name, section name for section symbols, "" for none
+# :addend: explicit addend for RELA, None for REL
+Relocation = namedtuple("Relocation", ("offset", "type", "symbol", "addend"))
+
+
+# Count of patched bytes by relocation type for machines where it is not
+# equal to address size. Types missing here patch address size bytes.
+_X86_64_WIDTHS = {
+    0: 0, 2: 4, 3: 4, 4: 4, 5: 0, 9: 4, 10: 4, 11: 4, 12: 2, 13: 2, 14: 1,
+    15: 1, 19: 4, 20: 4, 21: 4, 22: 4, 23: 4, 26: 4, 32: 4, 34: 4, 35: 0,
+    36: 16, 41: 4, 42: 4, 43: 4,
+    }
+_I386_WIDTHS = {0: 0, 5: 0, 20: 2, 21: 2, 22: 1, 23: 1}
+_ARM_WIDTHS = {0: 0, 5: 2, 8: 1, 20: 0}
+# AArch64 instructions are 4 bytes, data relocations are listed.
+_AARCH64_WIDTHS = {
+    0: 0, 256: 0, 257: 8, 258: 4, 259: 2, 260: 8, 261: 4, 262: 2,
+    1024: 0, 1025: 8, 1026: 8, 1027: 8, 1028: 8, 1029: 8, 1030: 8,
+    1031: 16, 1032: 8,
+    }
+
+relocation_widths = {
+    "EM_X86_64": (_X86_64_WIDTHS, 8),
+    "EM_386": (_I386_WIDTHS, 4),
+    "EM_ARM": (_ARM_WIDTHS, 4),
+    "EM_AARCH64": (_AARCH64_WIDTHS, 4),
+    }
+
+
+def _relocation_width(elf: ComparableElf):
+    """ :returns: function r_type -> count of patched bytes. """
+    widths, default = relocation_widths.get(
+        elf["e_machine"], ({0: 0}, elf.elfclass // 8))
+    return lambda type_: widths.get(type_, default)
+
+
+def _section_symbol_names(elf: ComparableElf, symtab: Section) -> List[str]:
+    """
+    Names of all symbols of symbol table decoded by one read.
+    Section symbols get names of their sections.
+    """
+    endian = "<" if elf.little_endian else ">"
+    if elf.elfclass == 32:
+        # st_name, st_value, st_size, st_info, st_other, st_shndx
+        format_ = endian + "IIIBBH"
+        name_index, info_index, shndx_index = 0, 3, 5
+    else:
+        # st_name, st_info, st_other, st_shndx, st_value, st_size
+        format_ = endian + "IBBHQQ"
+        name_index, info_index, shndx_index = 0, 1, 3
+
+    data = symtab.data()
+    entry_size = struct.calcsize(format_)
+    data = data[:len(data) - len(data) % entry_size]
+    strtab = elf.get_section(symtab["sh_link"]).data()
+    section_names = [s.name for s in elf.sections]
+
+    result = []
+    for entry in struct.iter_unpack(format_, data):
+        # STT_SECTION = 3.
+        shndx = entry[shndx_index]
+        if entry[info_index] & 0xF == 3 and shndx < len(section_names):
+            result.append(section_names[shndx])
+            continue
+
+        start = entry[name_index]
+        end = strtab.find(b"\0", start)
+        name = strtab[start:end] if end >= 0 else strtab[start:]
+        result.append(name.decode("utf-8", "replace"))
+
+    return result
+
+
+def decode_relocations(
+    elf: ComparableElf
+    ) -> Dict[str, Tuple[List[Relocation], List[Tuple[int, int]]]]:
+    """
+    Decode all SHT_REL and SHT_RELA sections in bulk with struct.iter_unpack.
+    Offsets are converted to target section relative ones: in relocatable
+    files r_offset is already relative, in others it is virtual address.
+    :returns: dictionary {target section name: (sorted relocations,
+        sorted merged intervals (start, end) of patched bytes)}.
+    """
+    endian = "<" if elf.little_endian else ">"
+    is_relocatable = elf["e_type"] == "ET_REL"
+    width = _relocation_width(elf)
+    symbol_names = {}
+    result = {}
+
+    for section in elf.sections:
+        type_ = section["sh_type"]
+        if type_ not in ("SHT_REL", "SHT_RELA") or section["sh_size"] == 0:
+            continue
+
+        is_rela = type_ == "SHT_RELA"
+        if elf.elfclass == 32:
+            format_ = endian + ("IIi" if is_rela else "II")
+            sym_shift, type_mask = 8, 0xFF
+        else:
+            format_ = endian + ("QQq" if is_rela else "QQ")
+            sym_shift, type_mask = 32, 0xFFFFFFFF
+
+        # Target section is in sh_info, dynamic relocations (sh_info = 0)
+        # are mapped to sections by addresses.
+        target_index = section["sh_info"]
+        if 0 < target_index < elf.num_sections():
+            targets = [elf.get_section(target_index)]
+        else:
+            targets = sorted(
+                (s for s in elf.sections
+                    if s["sh_flags"] & 2 and s["sh_size"] > 0),  # SHF_ALLOC
+                key=lambda s: s["sh_addr"])
+        starts = [s["sh_addr"] for s in targets]
+
+        link = section["sh_link"]
+        if link and link not in symbol_names:
+            symbol_names[link] = _section_symbol_names(
+                elf, elf.get_section(link))
+        names = symbol_names.get(link, [])
+
+        data = section.data()
+        entry_size = struct.calcsize(format_)
+        data = data[:len(data) - len(data) % entry_size]
+
+        for entry in struct.iter_unpack(format_, data):
+            offset, info = entry[0], entry[1]
+            symbol_index = info >> sym_shift
+            relocation_type = info & type_mask
+
+            target = targets[0]
+            if not is_relocatable:
+                target = _find_target(targets, starts, offset)
+                if target is None:
+                    continue
+                offset -= target["sh_addr"]
+
+            symbol = names[symbol_index] if symbol_index < len(names) else ""
+            relocations, intervals = result.setdefault(target.name, ([], []))
+            relocations.append(Relocation(
+                offset, relocation_type, symbol,
+                entry[2] if is_rela else None))
+            intervals.append((offset, offset + width(relocation_type)))
+
+    for name, (relocations, intervals) in result.items():
+        relocations.sort(key=lambda r: (r.offset, r.type))
+        result[name] = (relocations, merge_intervals(intervals))
+
+    return result
+
+
+def _find_target(
+    sections: List[Section], starts: List[int], address: int):
+    """
+    Section containing virtual address.
+    :sections: sections sorted by sh_addr
+    :starts: sh_addr of sections
+    """
+    index = bisect.bisect_right(starts, address) - 1
+    if index >= 0:
+        section = sections[index]
+        if address < section["sh_addr"] + section["sh_size"]:
+            return section
+    return None
+
+
+class RelocatedSectionDiff:
+    """
+    Result of relocation aware compare of one section.
+
+    :unexplained: list of intervals (start, end) of different bytes not
+        covered by relocations of any file
+    :masked_size: count of bytes covered by relocations
+    :left_new: relocations of left file only (by offset and type)
+    :right_new: relocations of right file only
+    :modified: list of tuples (left, right) of relocations with same offset
+        and type, but different symbol or addend
+    """
+
+    def __init__(self):
+        self.unexplained = []
+        self.masked_size = 0
+        self.left_new = []
+        self.right_new = []
+        self.modified = []
+
+
+    def has_changes(self) -> bool:
+        """ Check if any changes were found. """
+        return bool(
+            self.unexplained or self.left_new or self.right_new
+            or self.modified)
+
+
+    def __str__(self):
+        result = []
+
+        if self.unexplained:
+            result.append("Unexplained data diffs: {}".format(", ".join(
+                "[{}-{}]".format(format(s, "02X"), format(e - 1, "02X"))
+                for s, e in self.unexplained)))
+
+        if self.left_new:
+            result.append("Left new relocations: {}".format(len(self.left_new)))
+
+        if self.right_new:
+            result.append(
+                "Right new relocations: {}".format(len(self.right_new)))
+
+        if self.modified:
+            result.append(
+                "Modified relocations: {}".format(len(self.modified)))
+
+        return "\n".join(result)
+
+
+def merge_relocations(
+    left: List[Relocation], right: List[Relocation],
+    result: RelocatedSectionDiff):
+    """
+    Diff sorted relocation lists by one merge pass. Entries are matched by
+    offset and type, matched entries are modified if symbol or addend differ.
+    """
+    i = j = 0
+
+    while i < len(left) and j < len(right):
+        left_key = left[i][:2]
+        right_key = right[j][:2]
+
+        if left_key == right_key:
+            if left[i] != right[j]:
+                result.modified.append((left[i], right[j]))
+            i += 1
+            j += 1
+        elif left_key < right_key:
+            result.left_new.append(left[i])
+            i += 1
+        else:
+            result.right_new.append(right[j])
+            j += 1
+
+    result.left_new.extend(left[i:])
+    result.right_new.extend(right[j:])
+
+
+def compare_relocations(
+    left: ComparableElf,
+    right: ComparableElf) -> Dict[str, RelocatedSectionDiff]:
+    """
+    Compare data of common sections with bytes patched by relocations of
+    any file excluded, and diff relocation entries themselves.
+    Work is O(n log n) of relocations count, because of sorting.
+    :returns: dictionary {section name: RelocatedSectionDiff} of
+        sections with changes.
+    """
+    left_relocations = decode_relocations(left)
+    right_relocations = decode_relocations(right)
+
+    left_sections = {s.name: s for s in left.sections}
+    right_sections = {s.name: s for s in right.sections}
+    result = {}
+
+    for name in left_sections.keys() & right_sections.keys():
+        section_1 = left_sections[name]
+        section_2 = right_sections[name]
+        if "SHT_NOBITS" in (section_1["sh_type"], section_2["sh_type"]):
+            continue
+
+        relocations_1, intervals_1 = left_relocations.get(name, ([], []))
+        relocations_2, intervals_2 = right_relocations.get(name, ([], []))
+
+        diff = RelocatedSectionDiff()
+        merge_relocations(relocations_1, relocations_2, diff)
+
+        data_1 = section_1.data()
+        data_2 = section_2.data()
+        common_size = min(len(data_1), len(data_2))
+        masks = merge_intervals(intervals_1 + intervals_2)
+        diff.masked_size = sum(
+            min(e, common_size) - s for s, e in masks if s < common_size)
+
+        for start, end in iter_unmasked(0, common_size, masks):
+            diff.unexplained.extend(
+                locate_diff_ranges(data_1, data_2, start, end))
+
+        if len(data_1) != len(data_2):
+            diff.unexplained.append(
+                (common_size, max(len(data_1), len(data_2))))
+
+        diff.unexplained = merge_intervals(diff.unexplained)
+
+        if diff.has_changes():
+            result[name] = diff
+
+    return result
@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from html import escape
+from typing import Iterator, List, TextIO, Tuple
+import os
+
+from .hexview import (
+    DiffWindow, diff_window, file_size, iter_rows, read_diff_windows,
+    sections_by_name)
+from .structs import *
+from .utils import *
+
+
+_STYLE = """
+body { font-family: sans-serif; }
+table { border-collapse: collapse; margin: 4px 0; }
+td, th { border: 1px solid #999; padding: 2px 6px; text-align: left; }
+pre.hex { font-family: monospace; background: #f4f4f4; padding: 4px; }
+span.diff { background: #fbb; }
+div.nav { margin: 8px 0; }
+"""
+
+
+def _format_value(value) -> str:
+    if is_integer(value):
+        return format(value, numbers_format)
+    return str(value)
+
+
+def _chunks(items: List, size: int) -> Iterator[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class HtmlReport:
+    """
+    HTML report of ElfDiff. Report is written to directory page by page
+    directly to files, nothing is rendered in memory as a whole.
+    Sections and not used blocks lists are split to pages of page_size
+    items. Hex views around first differences are rendered when their page
+    is written, only hex_window bytes are read from each file, so ELF
+    streams must still be open.
+
+    :diff: ElfDiff to report
+    :page_size: count of items on page
+    :hex_window: count of bytes in hex views
+    """
+
+    def __init__(
+        self, diff: ElfDiff, page_size: int = 100, hex_window: int = 64):
+        self.diff = diff
+        self.page_size = page_size
+        self.hex_window = hex_window
+        self._left_sections = sections_by_name(diff.left_elf)
+        self._right_sections = sections_by_name(diff.right_elf)
+
+
+    def write(self, out_dir: str) -> str:
+        """
+        Write report pages to directory.
+        :returns: path to index.html.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+
+        modified = sorted((self.diff.compared_sections.modified or {}).items())
+        blocks = self.diff.compared_blocks.diffs_in_not_used
+
+        section_pages = self._write_pages(
+            out_dir, "sections", "Modified sections",
+            list(_chunks(modified, self.page_size)), self._write_section)
+
+        block_pages = self._write_pages(
+            out_dir, "blocks", "Different not used blocks",
+            list(_chunks(blocks, self.page_size)), self._write_block)
+
+        index_path = os.path.join(out_dir, "index.html")
+        with open(index_path, "w") as out:
+            self._write_index(out, section_pages, block_pages)
+
+        return index_path
+
+
+    def _write_pages(
+        self, out_dir: str, prefix: str, title: str, pages: List[List],
+        write_item) -> List[str]:
+        names = [
+            "{}_{}.html".format(prefix, i + 1) for i in range(len(pages))]
+
+        for i, items in enumerate(pages):
+            with open(os.path.join(out_dir, names[i]), "w") as out:
+                self._write_head(
+                    out, "{} {}/{}".format(title, i + 1, len(pages)))
+                self._write_nav(out, names, i)
+                for item in items:
+                    write_item(out, item)
+                self._write_nav(out, names, i)
+                self._write_tail(out)
+
+        return names
+
+
+    def _write_head(self, out: TextIO, title: str):
+        out.write(
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            "<title>{0}</title><style>{1}</style></head>\n"
+            "<body><h1>{0}</h1>\n".format(escape(title), _STYLE))
+
+
+    def _write_tail(self, out: TextIO):
+        out.write("</body></html>\n")
+
+
+    def _write_nav(self, out: TextIO, names: List[str], current: int):
+        out.write("<div class=\"nav\"><a href=\"index.html\">index</a>")
+        if current > 0:
+            out.write(" <a href=\"{}\">prev</a>".format(names[current - 1]))
+        if current + 1 < len(names):
+            out.write(" <a href=\"{}\">next</a>".format(names[current + 1]))
+        out.write("</div>\n")
+
+
+    def _write_dict_diff(self, out: TextIO, dict_diff: DictDiff):
+        """
+        Table of DictDiff, nested DictDiffs are written as nested tables.
+        """
+        if dict_diff is None or not dict_diff.has_changes():
+            out.write("<p>No changes.</p>\n")
+            return
+
+        out.write("<table>\n")
+        if dict_diff.left_new:
+            out.write("<tr><th>Left new</th><td colspan=\"2\">{}</td></tr>\n"
+                .format(escape(", ".join(map(str, dict_diff.left_new)))))
+        if dict_diff.right_new:
+            out.write("<tr><th>Right new</th><td colspan=\"2\">{}</td></tr>\n"
+                .format(escape(", ".join(map(str, dict_diff.right_new)))))
+
+        for key, value in dict_diff.modified.items():
+            out.write("<tr><th>{}</th>".format(escape(str(key))))
+            if isinstance(value, tuple):
+                out.write("<td>{}</td><td>{}</td></tr>\n".format(
+                    escape(_format_value(value[0])),
+                    escape(_format_value(value[1]))))
+            else:
+                out.write("<td colspan=\"2\">")
+                self._write_dict_diff(out, value)
+                out.write("</td></tr>\n")
+
+        out.write("</table>\n")
+
+
+    def _write_hex(self, out: TextIO, window: DiffWindow):
+        """ Side by side hex view of window (see diff_window()). """
+        [(left, right)] = read_diff_windows(self.diff, [window])
+        rows = list(iter_rows(left, right, window.start))
+
+        out.write("<table><tr><th>Left</th><th>Right</th></tr><tr>")
+        # Rows are (offset, left bytes, right bytes, different indexes).
+        for side in (1, 2):
+            out.write("<td><pre class=\"hex\">")
+            for row in rows:
+                offset, different = row[0], row[3]
+                out.write(format(offset, "08X") + " ")
+                for i, byte in enumerate(row[side]):
+                    byte = format(byte, "02X")
+                    if i in different:
+                        byte = "<span class=\"diff\">{}</span>".format(byte)
+                    out.write(" " + byte)
+                out.write("\n")
+            out.write("</pre></td>")
+        out.write("</tr></table>\n")
+
+
+    def _write_section(self, out: TextIO, item: Tuple[str, SectionDiff]):
+        name, section_diff = item
+        out.write("<h2>Section {}</h2>\n".format(escape(name)))
+
+        if section_diff.headers is not None:
+            self._write_dict_diff(out, section_diff.headers)
+
+        if section_diff.data_sizes is not None:
+            out.write("<p>Data sizes: {}, {}</p>\n".format(
+                *map(_format_value, section_diff.data_sizes)))
+
+        if section_diff.similarity is not None:
+            out.write("<p>Similarity: {}%</p>\n".format(
+                section_diff.similarity))
+
+        if section_diff.data_diff_offset != -1:
+            out.write("<p>First data diff at: {}</p>\n".format(
+                _format_value(section_diff.data_diff_offset)))
+
+            left = self._left_sections.get(name)
+            right = self._right_sections.get(name)
+            if left is not None and right is not None:
+                self._write_hex(out, diff_window(
+                    "Section {}".format(name), section_diff.data_diff_offset,
+                    self.hex_window // 2, left["sh_offset"], file_size(left),
+                    right["sh_offset"], file_size(right)))
+
+
+    def _write_block(self, out: TextIO, block_diff: NotUsedBlockDiff):
+        left, right = block_diff.left_block, block_diff.right_block
+        out.write("<h2>{} / {}</h2>\n".format(
+            escape(str(left)), escape(str(right))))
+
+        if block_diff.data_sizes is not None:
+            out.write("<p>Data sizes: {}, {}</p>\n".format(
+                *map(_format_value, block_diff.data_sizes)))
+
+        if block_diff.data_diff_offset != -1:
+            out.write("<p>First data diff at: {}</p>\n".format(
+                _format_value(block_diff.data_diff_offset)))
+            self._write_hex(out, diff_window(
+                "Blocks {} {}".format(left, right),
+                block_diff.data_diff_offset, self.hex_window // 2,
+                left.start_offset, left.size, right.start_offset, right.size))
+
+
+    def _write_links(self, out: TextIO, title: str, names: List[str]):
+        if not names:
+            return
+        out.write("<h2>{}</h2>\n<p>".format(escape(title)))
+        for i, name in enumerate(names):
+            out.write(" <a href=\"{}\">{}</a>".format(name, i + 1))
+        out.write("</p>\n")
+
+
+    def _write_index(
+        self, out: TextIO, section_pages: List[str], block_pages: List[str]):
+        diff = self.diff
+        self._write_head(out, "ELF compare report")
+
+        out.write("<h2>ELF header</h2>\n")
+        self._write_dict_diff(out, diff.compared_elf_headers)
+
+        out.write("<h2>Segments</h2>\n")
+        self._write_dict_diff(out, diff.compared_segments)
+
+        sections = diff.compared_sections
+        out.write("<h2>Sections</h2>\n<table>\n")
+        for title, names in (
+            ("Left new", sections.left_new), ("Right new", sections.right_new)):
+            if names:
+                out.write("<tr><th>{}</th><td>{}</td></tr>\n".format(
+                    title, escape(", ".join(sorted(names)))))
+        out.write("<tr><th>Modified</th><td>{}</td></tr>\n</table>\n".format(
+            len(sections.modified or {})))
+        self._write_links(out, "Modified sections pages", section_pages)
+
+        blocks = diff.compared_blocks
+        out.write("<h2>Blocks</h2>\n<table>\n")
+        if blocks.counts_of_not_used is not None:
+            out.write("<tr><th>Counts of not used</th><td>{}, {}</td></tr>\n"
+                .format(*blocks.counts_of_not_used))
+        for title, overlaps in (
+            ("Left overlaps", blocks.left_overlaps_in_used),
+            ("Right overlaps", blocks.right_overlaps_in_used)):
+            for block_1, block_2 in overlaps:
+                out.write("<tr><th>{}</th><td>{} / {}</td></tr>\n".format(
+                    title, escape(str(block_1)), escape(str(block_2))))
+        out.write(
+            "<tr><th>Different not used</th><td>{}</td></tr>\n</table>\n"
+            .format(len(blocks.diffs_in_not_used)))
+        self._write_links(out, "Not used blocks pages", block_pages)
+
+        self._write_tail(out)
+
+
+def write_html_report(
+    diff: ElfDiff, out_dir: str, page_size: int = 100,
+    hex_window: int = 64) -> str:
+    """
+    Write HTML report of diff to directory, see HtmlReport.
+    :returns: path to index.html.
+    """
+    return HtmlReport(diff, page_size, hex_window).write(out_dir)
@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Iterable, Iterator, List, Tuple
+import bisect
+import fnmatch
+import io
+import mmap
+import struct
+
+from .elfcmp import ComparableElf
+from .structs import Block, BlockType
+from .utils import *
+
+
+# Note type of build-id in notes with name "GNU".
+NT_GNU_BUILD_ID = 3
+
+
+class UnexplainedRange:
+    """
+    Range of different bytes not covered by masks.
+
+    :name: name of block (section name or BlockType name, see Block.name())
+    :start: first different byte offset from the beginning of block
+    :end: next to the last different byte offset from the beginning of block
+    :left_offset: offset of block in left file
+    :right_offset: offset of block in right file, None if there is no pair
+    """
+
+    def __init__(
+        self, name: str, start: int, end: int,
+        left_offset: int, right_offset: int = None):
+
+        self.name = name
+        self.start = start
+        self.end = end
+        self.left_offset = left_offset
+        self.right_offset = right_offset
+
+
+    def __str__(self):
+        return "{}:[{}-{}]".format(
+            self.name,
+            format(self.start, "02X"), format(self.end - 1, "02X"))
+
+
+    def __repr__(self):
+        return str(self)
+
+
+class VerificationResult:
+    """
+    Result of reproducible build verification.
+
+    :unexplained: list of UnexplainedRange - differences not covered by masks
+    :left_masks: masked intervals (start, end) of left file
+    :right_masks: masked intervals (start, end) of right file
+    """
+
+    def __init__(
+        self,
+        unexplained: List[UnexplainedRange] = None,
+        left_masks: List[Tuple[int, int]] = None,
+        right_masks: List[Tuple[int, int]] = None):
+
+        self.unexplained = unexplained if unexplained is not None else []
+        self.left_masks = left_masks if left_masks is not None else []
+        self.right_masks = right_masks if right_masks is not None else []
+
+
+    def passed(self) -> bool:
+        """ True if all differences are explained by masks. """
+        return not self.unexplained
+
+
+    def __str__(self):
+        if self.passed():
+            return "PASSED"
+        return "FAILED\n{}".format(
+            "\n".join("\t{}".format(r) for r in self.unexplained))
+
+
+def _note_masks(elf: ComparableElf, section) -> List[Tuple[int, int]]:
+    """ Masks of build-id descriptors in SHT_NOTE section. """
+    result = []
+    endian = "<" if elf.little_endian else ">"
+    block = Block(
+        section["sh_offset"], section["sh_size"], BlockType.SECTION, elf,
+        section)
+    data = block.data()
+    offset = 0
+
+    # Note header: namesz, descsz, type, then name and descriptor aligned
+    # to 4 bytes. ELFCLASS64 uses same 4 bytes words in practice.
+    while offset + 12 <= len(data):
+        namesz, descsz, type_ = struct.unpack_from(endian + "III", data, offset)
+        name_start = offset + 12
+        desc_start = name_start + ((namesz + 3) & ~3)
+        desc_end = desc_start + descsz
+
+        if desc_end > len(data):
+            break
+
+        name = data[name_start:name_start + namesz].rstrip(b"\0")
+        if name == b"GNU" and type_ == NT_GNU_BUILD_ID:
+            result.append(
+                (block.start_offset + desc_start,
+                    block.start_offset + desc_end))
+
+        offset = desc_start + ((descsz + 3) & ~3)
+
+    return result
+
+
+def compute_masks(
+    elf: ComparableElf,
+    mask_sections: Iterable[str] = ()) -> List[Tuple[int, int]]:
+    """
+    Find known non-deterministic regions of file:
+    build-id descriptors in notes, CRC in .gnu_debuglink and whole sections
+    with names matched to mask_sections patterns (see fnmatch). ELF has
+    no standard timestamp field, so sections with embedded timestamps
+    should be listed in mask_sections.
+    :returns: sorted intervals (start, end) of file offsets.
+    """
+    result = []
+    mask_sections = list(mask_sections)
+
+    for section in elf.sections:
+        if section["sh_type"] in ("SHT_NOBITS", "SHT_NULL"):
+            continue
+
+        start = section["sh_offset"]
+        end = start + section["sh_size"]
+
+        if any(fnmatch.fnmatchcase(section.name, p) for p in mask_sections):
+            result.append((start, end))
+
+        elif section["sh_type"] == "SHT_NOTE":
+            result.extend(_note_masks(elf, section))
+
+        elif section.name == ".gnu_debuglink" and end - start >= 4:
+            # File name, padding and 4 bytes of CRC in the end.
+            result.append((end - 4, end))
+
+    return merge_intervals(result)
+
+
+def _pair_blocks(
+    left: ComparableElf, right: ComparableElf
+    ) -> Iterator[Tuple[Block, Block]]:
+    """
+    Pair blocks of files: headers by type, sections by name and not used
+    blocks by order. Block without pair gets None.
+    """
+    def used_key(block: Block):
+        return (block.block_type, block.name())
+
+    right_used = {used_key(b): b for b in right.used_blocks}
+    seen = set()
+
+    for block in left.used_blocks:
+        key = used_key(block)
+        seen.add(key)
+        yield block, right_used.get(key)
+
+    for block in right.used_blocks:
+        if used_key(block) not in seen:
+            yield None, block
+
+    for i in range(max(len(left.not_used_blocks), len(right.not_used_blocks))):
+        yield (
+            left.not_used_blocks[i] if i < len(left.not_used_blocks) else None,
+            right.not_used_blocks[i] if i < len(right.not_used_blocks)
+                else None)
+
+
+class _FileView:
+    """
+    Zero copy view of elf file data: memoryview of mmap for real files
+    (like in hexview.read_window()), otherwise memoryview of block data read
+    from stream. Use as context manager or call close().
+    """
+
+    def __init__(self, elf: ComparableElf):
+        self.elf = elf
+        self._mmap = None
+        self._view = None
+
+        # Only files are mapped, fileno() of some streams has side effects
+        # (SpooledTemporaryFile moves data to disk).
+        raw = getattr(elf.stream, "raw", elf.stream)
+        if isinstance(raw, io.FileIO):
+            try:
+                self._mmap = mmap.mmap(
+                    raw.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+            except (OSError, ValueError):
+                pass
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def block(self, block: Block) -> memoryview:
+        """ View of block data, release it before close(). """
+        if self._view is not None:
+            return self._view[block.start_offset:block.end_offset()]
+        return memoryview(block.data())
+
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class _Masks:
+    """
+    Sorted not intersected masks of file with fast lookup of masks of
+    block by bisect.
+    """
+
+    def __init__(self, masks: List[Tuple[int, int]]):
+        self.masks = masks
+        self.starts = [start for start, _ in masks]
+        self.ends = [end for _, end in masks]
+
+
+    def of_block(self, block: Block) -> List[Tuple[int, int]]:
+        """ Masks intersected with block, in block relative offsets. """
+        first = bisect.bisect_right(self.ends, block.start_offset)
+        last = bisect.bisect_left(self.starts, block.end_offset())
+        return [
+            (start - block.start_offset, end - block.start_offset)
+            for start, end in self.masks[first:last]]
+
+
+def verify_reproducible(
+    left: ComparableElf, right: ComparableElf,
+    mask_sections: Iterable[str] = ()) -> VerificationResult:
+    """
+    Compare all blocks of files byte to byte except masked regions
+    (see compute_masks()). Masks are applied on the fly: data is never
+    copied or patched, only unmasked slices of memoryviews are compared.
+    :returns: VerificationResult.
+    """
+    mask_sections = list(mask_sections)
+    result = VerificationResult(
+        left_masks=compute_masks(left, mask_sections),
+        right_masks=compute_masks(right, mask_sections))
+    left_masks = _Masks(result.left_masks)
+    right_masks = _Masks(result.right_masks)
+
+    with _FileView(left) as left_view, _FileView(right) as right_view:
+        for left_block, right_block in _pair_blocks(left, right):
+
+            if left_block is None or right_block is None:
+                block = left_block or right_block
+                result.unexplained.append(UnexplainedRange(
+                    block.name(), 0, block.size,
+                    left_block.start_offset if left_block else None,
+                    right_block.start_offset if right_block else None))
+                continue
+
+            if left_block.size == 0 and right_block.size == 0:
+                continue
+
+            # Masks of both files in block relative offsets.
+            masks = merge_intervals(
+                left_masks.of_block(left_block)
+                + right_masks.of_block(right_block))
+            ranges = []
+
+            with left_view.block(left_block) as data_1, \
+                right_view.block(right_block) as data_2:
+
+                common_size = min(len(data_1), len(data_2))
+                for start, end in iter_unmasked(0, common_size, masks):
+                    ranges.extend(
+                        locate_diff_ranges(data_1, data_2, start, end))
+
+                # Tail of longer block.
+                longest = max(len(data_1), len(data_2))
+                ranges.extend(iter_unmasked(common_size, longest, masks))
+
+            for start, end in merge_intervals(ranges):
+                result.unexplained.append(UnexplainedRange(
+                    left_block.name(), start, end,
+                    left_block.start_offset, right_block.start_offset))
+
+    return result
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from enum import IntEnum
+from typing import Dict, List, Tuple, Union, Optional
+import fnmatch
+import json
+import re
+
+
+class Level(IntEnum):
+    """ Severity level of found difference. """
+    IGNORED = 0
+    INFO    = 1
+    WARNING = 2
+    ERROR   = 3
+
+
+def parse_level(value: Union[int, str, Level]) -> Level:
+    """ Convert level from rules file (name like "warning" or int). """
+    if isinstance(value, str):
+        return Level[value.upper()]
+    return Level(value)
+
+
+class Matcher:
+    """
+    Set of shell-like patterns (see fnmatch) with levels compiled into
+    one regular expression. First matched pattern wins. Results are cached
+    by matched value, because same names are matched again and again.
+
+    :patterns: list of tuples (pattern, Level)
+    """
+
+    def __init__(self, patterns: List[Tuple[str, Level]] = None):
+        self.patterns = patterns or []
+        self._levels = [level for _, level in self.patterns]
+        self._cache = {}
+
+        if self.patterns:
+            self._regex = re.compile("|".join(
+                "(?P<r{}>{})".format(i, fnmatch.translate(pattern))
+                for i, (pattern, _) in enumerate(self.patterns)))
+        else:
+            self._regex = None
+
+
+    def match(self, value) -> Optional[Level]:
+        """
+        :returns: level of first pattern matched to value, None if no one.
+        """
+        if self._regex is None or value is None:
+            return None
+
+        try:
+            return self._cache[value]
+        except KeyError:
+            pass
+
+        found = self._regex.match(str(value))
+        level = (
+            self._levels[int(found.lastgroup[1:])] if found else None)
+        self._cache[value] = level
+        return level
+
+
+class Rules:
+    """
+    Ignore and severity rules. Rules are checked before any data is read,
+    so ignored sections, segments and blocks cost nothing.
+
+    :default_level: level of differences not matched by any rule
+    :matchers: dictionary {category: Matcher}, categories are:
+        header_keys - ELF header fields (e_flags, EI_OSABI, ...);
+        section_names - section names (.comment, .note.*, ...);
+        section_types - section types (SHT_NOTE, ...);
+        section_header_keys - section header fields (sh_addr, ...);
+        segment_types - segment types (PT_NOTE, ...);
+        segment_header_keys - segment header fields (p_align, ...);
+        block_types - BlockType names (NOT_USED, ...).
+
+    Rules file is JSON like this:
+        {
+            "default_level": "error",
+            "section_names": {".comment": "ignored", ".note.*": "info"},
+            "section_types": {"SHT_NOTE": "warning"},
+            "header_keys": {"e_shoff": "info"}
+        }
+    Patterns are checked in file order.
+    """
+
+    categories = (
+        "header_keys", "section_names", "section_types",
+        "section_header_keys", "segment_types", "segment_header_keys",
+        "block_types")
+
+    def __init__(
+        self,
+        default_level: Level = Level.ERROR,
+        rules: Dict[str, Dict[str, Union[int, str, Level]]] = None):
+        """
+        :default_level: level of differences not matched by any rule
+        :rules: dictionary {category: {pattern: level}}, see class docstring
+        """
+        self.default_level = parse_level(default_level)
+        self.matchers = {}
+
+        rules = rules or {}
+        for category in rules:
+            if category not in Rules.categories:
+                raise ValueError("Unknown rules category: {}".format(category))
+
+        for category in Rules.categories:
+            self.matchers[category] = Matcher([
+                (pattern, parse_level(level))
+                for pattern, level in rules.get(category, {}).items()])
+
+
+    @classmethod
+    def from_dict(cls, settings: dict) -> "Rules":
+        """ Make rules from dictionary in rules file format. """
+        settings = dict(settings)
+        default_level = settings.pop("default_level", Level.ERROR)
+        return cls(default_level, settings)
+
+
+    def to_dict(self) -> dict:
+        """ Rules in rules file format, levels are integers. """
+        result = {"default_level": int(self.default_level)}
+        for category in Rules.categories:
+            patterns = self.matchers[category].patterns
+            if patterns:
+                result[category] = {
+                    pattern: int(level) for pattern, level in patterns}
+        return result
+
+
+    @classmethod
+    def from_file(cls, path: str) -> "Rules":
+        """ Load rules from JSON file, see class docstring. """
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+    def level(self, category: str, value) -> Level:
+        """ Level of value in category, default_level if not matched. """
+        level = self.matchers[category].match(value)
+        return self.default_level if level is None else level
+
+
+    def section_level(self, name: str, type_: str) -> Level:
+        """ Level of section, name rules have priority over type rules. """
+        level = self.matchers["section_names"].match(name)
+        if level is None:
+            level = self.matchers["section_types"].match(type_)
+        return self.default_level if level is None else level
+
+
+    def key_levels(self, category: str, keys) -> Dict[str, Level]:
+        """ Levels of keys (dictionary fields) in category. """
+        return {key: self.level(category, key) for key in keys}
+
+
+    def filter_dict(self, category: str, dict_: dict) -> dict:
+        """ Copy of dictionary without ignored keys. """
+        return {
+            k: v for (k, v) in dict_.items()
+            if self.level(category, k) != Level.IGNORED}
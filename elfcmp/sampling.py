@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, List
+import hashlib
+import math
+import random
+
+from .elfcmp import ComparableElf
+from .structs import Block, BlockType
+from .utils import *
+
+
+DEFAULT_PAGE_SIZE = 4096
+
+# Default fraction of pages of every block to read.
+DEFAULT_SAMPLE_RATE = 0.01
+
+
+class SampledDiff:
+    """
+    Result of sampled compare, see compare_sampled().
+
+    :left_new: set of names of blocks of first file only
+    :right_new: set of names of blocks of second file only
+    :resized: dictionary {name: (left size, right size)} of common blocks
+        with different sizes, their data is not sampled
+    :different: dictionary {name: list of offsets of different sampled
+        pages in block}
+    :pages: dictionary {name: (sampled pages count, pages count)} of
+        sampled blocks
+    :bytes_read: bytes read from both files
+    :total_bytes: size of sampled blocks in both files
+    """
+
+    def __init__(self):
+        self.left_new = set()
+        self.right_new = set()
+        self.resized = {}
+        self.different = {}
+        self.pages = {}
+        self.bytes_read = 0
+        self.total_bytes = 0
+
+
+    def has_changes(self) -> bool:
+        """ Check if any changes were found. """
+        return bool(
+            self.left_new or self.right_new or self.resized or self.different)
+
+
+    def changed_blocks(self) -> List[str]:
+        """ Names of common blocks known to differ. """
+        return sorted(self.resized.keys() | self.different.keys())
+
+
+    def confidence(self, changed_pages: int = 1) -> float:
+        """
+        Probability to find change of changed_pages pages at random places
+        of any one sampled block, that is for worst sampled block.
+        """
+        result = 1.0
+
+        for sampled, count in self.pages.values():
+            changed = min(changed_pages, count)
+            # Probability that all sampled pages miss changed ones.
+            missed = 1.0
+            for i in range(sampled):
+                if count - changed - i <= 0:
+                    missed = 0.0
+                    break
+                missed *= (count - changed - i) / (count - i)
+            result = min(result, 1.0 - missed)
+
+        return result
+
+
+    def __str__(self):
+        result = []
+
+        if self.left_new:
+            result.append("Left new blocks: {}".format(sorted(self.left_new)))
+
+        if self.right_new:
+            result.append("Right new blocks: {}".format(
+                sorted(self.right_new)))
+
+        for name, (size_1, size_2) in sorted(self.resized.items()):
+            result.append("Block {}: sizes {},{}".format(
+                name, format(size_1, "02X"), format(size_2, "02X")))
+
+        for name, offsets in sorted(self.different.items()):
+            result.append("Block {}: different pages at {}".format(
+                name, ", ".join(format(o, "02X") for o in offsets)))
+
+        result.append(
+            "Read {} of {} bytes, confidence {:.1%}".format(
+                self.bytes_read, self.total_bytes, self.confidence()))
+
+        return "\n".join(result)
+
+
+def named_blocks(elf: ComparableElf) -> Dict[str, Block]:
+    """
+    Used and not used blocks of file by names: section name or type name
+    for used blocks, "NOT_USED:index" for not used ones.
+    """
+    result = {block.name(): block for block in elf.used_blocks}
+    for index, block in enumerate(elf.not_used_blocks):
+        result["{}:{}".format(BlockType.NOT_USED.name, index)] = block
+    return result
+
+
+def sample_pages(
+    name: str, size: int, page_size: int = DEFAULT_PAGE_SIZE,
+    rate: float = DEFAULT_SAMPLE_RATE, min_pages: int = 2) -> List[int]:
+    """
+    Deterministic sample of page indexes of block: first and last pages and
+    random ones seeded by name and size, so same blocks of different files
+    get same sample.
+    :returns: sorted list of page indexes.
+    """
+    count = math.ceil(size / page_size)
+    sampled = min(count, max(min_pages, math.ceil(count * rate)))
+    if sampled >= count:
+        return list(range(count))
+
+    result = {0, count - 1}
+    rnd = random.Random("{}:{}".format(name, size))
+    result.update(rnd.sample(range(1, count - 1), max(0, sampled - 2)))
+    return sorted(result)
+
+
+def _page_digest(block: Block, offset: int, size: int) -> bytes:
+    block.elf.stream.seek(block.start_offset + offset)
+    return hashlib.blake2b(
+        block.elf.stream.read(size), digest_size=16).digest()
+
+
+def compare_sampled(
+    left: ComparableElf, right: ComparableElf,
+    page_size: int = DEFAULT_PAGE_SIZE, rate: float = DEFAULT_SAMPLE_RATE,
+    min_pages: int = 2) -> SampledDiff:
+    """
+    Approximate compare of files: block layout is taken from metadata,
+    which is already read, and only sample of pages of every common block
+    of same size is read and hashed (see sample_pages()). Found differences
+    are certain, equality is probable, see SampledDiff.confidence().
+    Use compare_blocks() to compare changed blocks fully.
+    :rate: fraction of pages of every block to read
+    :min_pages: minimal count of pages to read in every block
+    """
+    result = SampledDiff()
+    blocks_1 = named_blocks(left)
+    blocks_2 = named_blocks(right)
+
+    result.left_new = blocks_1.keys() - blocks_2.keys()
+    result.right_new = blocks_2.keys() - blocks_1.keys()
+
+    for name in sorted(blocks_1.keys() & blocks_2.keys()):
+        block_1 = blocks_1[name]
+        block_2 = blocks_2[name]
+
+        if block_1.size != block_2.size:
+            result.resized[name] = (block_1.size, block_2.size)
+            continue
+
+        # Empty blocks of same size are equal, nothing to sample.
+        if block_1.size == 0:
+            continue
+
+        pages = sample_pages(name, block_1.size, page_size, rate, min_pages)
+        result.pages[name] = (len(pages), math.ceil(block_1.size / page_size))
+        result.total_bytes += 2 * block_1.size
+
+        for page in pages:
+            offset = page * page_size
+            size = min(page_size, block_1.size - offset)
+            result.bytes_read += 2 * size
+
+            if (_page_digest(block_1, offset, size)
+                != _page_digest(block_2, offset, size)):
+                result.different.setdefault(name, []).append(offset)
+
+    return result
+
+
+def compare_blocks(
+    left: ComparableElf, right: ComparableElf, names: List[str],
+    chunk_size: int = 1024 * 1024) -> Dict[str, int]:
+    """
+    Full compare of blocks with given names (see SampledDiff.changed_blocks())
+    read by chunks.
+    :returns: dictionary {name: offset of first different byte in block,
+        see locate_array_diff()}.
+    """
+    blocks_1 = named_blocks(left)
+    blocks_2 = named_blocks(right)
+    result = {}
+
+    for name in names:
+        offset = 0
+        diff_offset = -1
+
+        for chunk_1, chunk_2 in zip(
+            blocks_1[name].iter_data(chunk_size),
+            blocks_2[name].iter_data(chunk_size)):
+
+            diff_offset = locate_array_diff(chunk_1, chunk_2)
+            if diff_offset != -1:
+                diff_offset += offset
+                break
+            offset += len(chunk_1)
+
+        if diff_offset == -1 and blocks_1[name].size != blocks_2[name].size:
+            diff_offset = min(blocks_1[name].size, blocks_2[name].size)
+
+        result[name] = diff_offset
+
+    return result
@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, List, Optional
+import json
+
+from .structs import BlockType
+from .utils import ByteArray
+
+
+# Context triggered piecewise hashes (CTPH) in ssdeep format
+# "blocksize:signature1:signature2" and similarity scores 0-100 for them.
+
+ROLLING_WINDOW = 7
+MIN_BLOCKSIZE = 3
+SPAMSUM_LENGTH = 64
+HASH_PRIME = 0x01000193
+HASH_INIT = 0x28021967
+B64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+
+def guess_block_size(total_size: int) -> int:
+    """ Block size ssdeep starts with for data of given size. """
+    block_size = MIN_BLOCKSIZE
+    while block_size * SPAMSUM_LENGTH < total_size:
+        block_size *= 2
+    return block_size
+
+
+class _BlockHashState:
+    """ Piecewise hashes for one block size (and doubled one). """
+    __slots__ = ("block_size", "h1", "h2", "sig1", "sig2")
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self.h1 = HASH_INIT
+        self.h2 = HASH_INIT
+        self.sig1 = []
+        self.sig2 = []
+
+
+class FuzzyHasher:
+    """
+    Streaming CTPH hasher. Feed data with update(), get result with digest().
+
+    ssdeep picks block size by total size and restarts with halved block size
+    if signature is too short. Restart is impossible for stream, so states
+    for guessed block size and two smaller ones are computed in one pass.
+
+    :total_size: expected size of hashed data, used to guess block size
+    """
+
+    def __init__(self, total_size: int):
+        block_size = guess_block_size(total_size)
+        self.states = []
+        while len(self.states) < 3 and block_size >= MIN_BLOCKSIZE:
+            self.states.append(_BlockHashState(block_size))
+            block_size //= 2
+
+        self.window = [0] * ROLLING_WINDOW
+        self.r1 = self.r2 = self.r3 = 0
+        self.position = 0
+
+
+    def update(self, data: ByteArray):
+        """ Hash next part of data. """
+        window = self.window
+        r1, r2, r3, n = self.r1, self.r2, self.r3, self.position
+        states = self.states
+        sig1_max = SPAMSUM_LENGTH - 1
+        sig2_max = SPAMSUM_LENGTH // 2 - 1
+
+        for c in data:
+            # Rolling hash over last ROLLING_WINDOW bytes.
+            r2 = r2 - r1 + ROLLING_WINDOW * c
+            r1 = r1 + c - window[n % ROLLING_WINDOW]
+            window[n % ROLLING_WINDOW] = c
+            n += 1
+            r3 = ((r3 << 5) & 0xFFFFFFFF) ^ c
+            rolling = (r1 + r2 + r3) & 0xFFFFFFFF
+
+            for state in states:
+                state.h1 = ((state.h1 * HASH_PRIME) & 0xFFFFFFFF) ^ c
+                state.h2 = ((state.h2 * HASH_PRIME) & 0xFFFFFFFF) ^ c
+                bs = state.block_size
+
+                if rolling % bs == bs - 1:
+                    if len(state.sig1) < sig1_max:
+                        state.sig1.append(B64[state.h1 % 64])
+                        state.h1 = HASH_INIT
+
+                    if rolling % (bs * 2) == bs * 2 - 1:
+                        if len(state.sig2) < sig2_max:
+                            state.sig2.append(B64[state.h2 % 64])
+                            state.h2 = HASH_INIT
+
+        self.r1, self.r2, self.r3, self.position = r1, r2, r3, n
+
+
+    def digest(self) -> str:
+        """ Hash in ssdeep format "blocksize:signature1:signature2". """
+        rolling = (self.r1 + self.r2 + self.r3) & 0xFFFFFFFF
+        result = None
+
+        for state in self.states:
+            sig1 = "".join(state.sig1)
+            sig2 = "".join(state.sig2)
+            if rolling != 0:
+                sig1 += B64[state.h1 % 64]
+                sig2 += B64[state.h2 % 64]
+            result = "{}:{}:{}".format(state.block_size, sig1, sig2)
+
+            # Long enough signature, no need in smaller block size.
+            if len(sig1) >= SPAMSUM_LENGTH // 2:
+                break
+
+        return result
+
+
+def fuzzy_hash(data: ByteArray) -> str:
+    """ CTPH of whole byte array. """
+    hasher = FuzzyHasher(len(data))
+    hasher.update(data)
+    return hasher.digest()
+
+
+def _eliminate_sequences(s: str) -> str:
+    """ Cut runs of same character to 3 characters. """
+    result = []
+    for i, c in enumerate(s):
+        if i < 3 or not (c == s[i - 1] == s[i - 2] == s[i - 3]):
+            result.append(c)
+    return "".join(result)
+
+
+def _has_common_substring(s1: str, s2: str) -> bool:
+    """ Check if strings have common part of ROLLING_WINDOW length. """
+    parts = {
+        s1[i:i + ROLLING_WINDOW]
+        for i in range(len(s1) - ROLLING_WINDOW + 1)}
+    return any(
+        s2[i:i + ROLLING_WINDOW] in parts
+        for i in range(len(s2) - ROLLING_WINDOW + 1))
+
+
+def _edit_distance(s1: str, s2: str) -> int:
+    """ Edit distance with insert/remove cost 1 and replace cost 2. """
+    previous = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1, 1):
+        current = [i]
+        for j, c2 in enumerate(s2, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (0 if c1 == c2 else 2)))
+        previous = current
+    return previous[-1]
+
+
+def _score_strings(s1: str, s2: str, block_size: int) -> int:
+    if len(s1) > SPAMSUM_LENGTH or len(s2) > SPAMSUM_LENGTH:
+        return 0
+
+    if not _has_common_substring(s1, s2):
+        return 0
+
+    score = _edit_distance(s1, s2) * SPAMSUM_LENGTH // (len(s1) + len(s2))
+    score = 100 * score // SPAMSUM_LENGTH
+    if score >= 100:
+        return 0
+    score = 100 - score
+
+    # Small block sizes can not give too high score on short signatures.
+    if block_size < (99 + ROLLING_WINDOW) // ROLLING_WINDOW * MIN_BLOCKSIZE:
+        score = min(
+            score, block_size // MIN_BLOCKSIZE * min(len(s1), len(s2)))
+
+    return score
+
+
+def compare_hashes(hash_1: str, hash_2: str) -> int:
+    """
+    Similarity of two CTPH in ssdeep way.
+    :returns: score from 0 (nothing in common) to 100 (same).
+    """
+    bs_1, sig1_1, sig2_1 = hash_1.split(":", 2)
+    bs_2, sig1_2, sig2_2 = hash_2.split(":", 2)
+    bs_1, bs_2 = int(bs_1), int(bs_2)
+
+    if bs_1 != bs_2 and bs_1 != bs_2 * 2 and bs_2 != bs_1 * 2:
+        return 0
+
+    sig1_1, sig2_1 = _eliminate_sequences(sig1_1), _eliminate_sequences(sig2_1)
+    sig1_2, sig2_2 = _eliminate_sequences(sig1_2), _eliminate_sequences(sig2_2)
+
+    if bs_1 == bs_2 and sig1_1 == sig1_2:
+        return 100
+
+    if bs_1 == bs_2:
+        return max(
+            _score_strings(sig1_1, sig1_2, bs_1),
+            _score_strings(sig2_1, sig2_2, bs_1 * 2))
+    elif bs_1 == bs_2 * 2:
+        return _score_strings(sig1_1, sig2_2, bs_1)
+    else:
+        return _score_strings(sig2_1, sig1_2, bs_2)
+
+
+def similarity(data_1: ByteArray, data_2: ByteArray) -> int:
+    """ Similarity score 0-100 of two byte arrays. """
+    if data_1 == data_2:
+        return 100
+    return compare_hashes(fuzzy_hash(data_1), fuzzy_hash(data_2))
+
+
+class ElfSignatures:
+    """
+    Stored CTPH of ELF file parts. Allows to get similarity scores later
+    without original file.
+
+    :sections: dictionary {section name: CTPH}
+    :not_used_blocks: list of CTPH of not used blocks in order of offsets
+    """
+
+    def __init__(
+        self,
+        sections: Dict[str, str] = None,
+        not_used_blocks: List[str] = None):
+
+        self.sections = sections if sections is not None else {}
+        self.not_used_blocks = (
+            not_used_blocks if not_used_blocks is not None else [])
+
+
+    @classmethod
+    def from_elf(cls, elf: "ComparableElf") -> "ElfSignatures":
+        """ Hash every section and not used block of elf, one read each. """
+        sections = {}
+        not_used_blocks = []
+
+        for block in elf.used_blocks:
+            if block.block_type == BlockType.SECTION:
+                sections[block.object_.name] = fuzzy_hash(block.data())
+
+        for block in elf.not_used_blocks:
+            not_used_blocks.append(fuzzy_hash(block.data()))
+
+        return cls(sections, not_used_blocks)
+
+
+    def compare(self, other: "ElfSignatures") -> Dict[str, int]:
+        """
+        Similarity of common sections.
+        :returns: dictionary {section name: score}.
+        """
+        return {
+            name: compare_hashes(self.sections[name], other.sections[name])
+            for name in self.sections.keys() & other.sections.keys()}
+
+
+    def to_dict(self) -> dict:
+        return {
+            "sections": self.sections,
+            "not_used_blocks": self.not_used_blocks,
+            }
+
+
+    @classmethod
+    def from_dict(cls, dict_: dict) -> "ElfSignatures":
+        return cls(dict_["sections"], dict_["not_used_blocks"])
+
+
+    def save(self, path: str):
+        """ Save signatures to JSON file. """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+    @classmethod
+    def load(cls, path: str) -> "ElfSignatures":
+        """ Load signatures from JSON file made by save(). """
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
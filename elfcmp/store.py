@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from typing import Iterable, Iterator, List
+import hashlib
+import os
+import sqlite3
+
+from elftools.common.exceptions import ELFError
+
+from .elfcmp import ComparableElf
+from .structs import BlockType
+
+
+# Stored block (section, header, not used block) of indexed file.
+BlockRecord = namedtuple(
+    "BlockRecord", ("path", "name", "block_type", "offset", "size", "digest"))
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    block_type TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_digest ON blocks(digest);
+CREATE INDEX IF NOT EXISTS blocks_file ON blocks(file_id);
+CREATE INDEX IF NOT EXISTS files_digest ON files(digest);
+"""
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ SHA-256 hex digest of whole file. """
+    hash_ = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hash_.update(chunk)
+    return hash_.hexdigest()
+
+
+def is_elf_file(path: str) -> bool:
+    """ Check ELF magic number of file. """
+    try:
+        with open(path, "rb") as f:
+            return f.read(4) == b"\x7fELF"
+    except OSError:
+        return False
+
+
+class SectionStore:
+    """
+    Content addressed store of ELF blocks in sqlite database. For each
+    indexed file it keeps digests, names, sizes and offsets of all used and
+    not used blocks (see ComparableElf.read_metadata()), so question
+    "which files have exactly this section?" is answered by index lookup.
+
+    :path: path to database file, ":memory:" for temporary store
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(_SCHEMA)
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _add(self, path: str):
+        """
+        Index one file, caller is responsible for transaction. File is
+        parsed and hashed before database is changed, so file which can not
+        be parsed leaves no record and is tried again by next ingest.
+        """
+        stat = os.stat(path)
+        digest = file_digest(path)
+        with open(path, "rb") as f:
+            elf = ComparableElf(f)
+            blocks = [
+                (block.name(), block.block_type.name, block.start_offset,
+                    block.size, block.digest())
+                for block in elf.used_blocks + elf.not_used_blocks]
+
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM files WHERE path = ?", (path,))
+        cursor.execute(
+            "INSERT INTO files (path, size, mtime_ns, digest) "
+            "VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, digest))
+        file_id = cursor.lastrowid
+
+        cursor.executemany(
+            "INSERT INTO blocks "
+            "(file_id, name, block_type, offset, size, digest) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(file_id, *block) for block in blocks])
+
+
+    def ingest(
+        self, paths: Iterable[str], batch_size: int = 100,
+        skip_unchanged: bool = True) -> int:
+        """
+        Index files. Files are committed by batches, one transaction each.
+        :skip_unchanged: do not index again files with same size and mtime
+        :returns: count of indexed files.
+        """
+        count = 0
+        batch = 0
+        connection = self.connection
+
+        try:
+            for path in paths:
+                path = os.path.abspath(path)
+
+                if skip_unchanged and self._is_unchanged(path):
+                    continue
+
+                try:
+                    self._add(path)
+                except ELFError:
+                    # Stale record of file which became broken is removed.
+                    connection.execute(
+                        "DELETE FROM files WHERE path = ?", (path,))
+                    continue
+
+                count += 1
+                batch += 1
+                if batch >= batch_size:
+                    connection.commit()
+                    batch = 0
+
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+        return count
+
+
+    def ingest_tree(self, root: str, batch_size: int = 100) -> int:
+        """ Index all ELF files in directory tree. """
+        return self.ingest(
+            (path for path in _walk_files(root) if is_elf_file(path)),
+            batch_size)
+
+
+    def _is_unchanged(self, path: str) -> bool:
+        row = self.connection.execute(
+            "SELECT size, mtime_ns FROM files WHERE path = ?",
+            (path,)).fetchone()
+        if row is None:
+            return False
+        stat = os.stat(path)
+        return row == (stat.st_size, stat.st_mtime_ns)
+
+
+    def lookup(self, digest: str) -> List[BlockRecord]:
+        """ All stored blocks with data digest. """
+        rows = self.connection.execute(
+            "SELECT files.path, blocks.name, blocks.block_type, "
+            "blocks.offset, blocks.size, blocks.digest "
+            "FROM blocks JOIN files ON files.id = blocks.file_id "
+            "WHERE blocks.digest = ? ORDER BY files.path",
+            (digest,))
+        return [BlockRecord(*row) for row in rows]
+
+
+    def lookup_section(
+        self, elf: ComparableElf, name: str) -> List[BlockRecord]:
+        """ Stored blocks with same data as section of elf. """
+        for block in elf.used_blocks:
+            if block.block_type == BlockType.SECTION and block.name() == name:
+                return self.lookup(block.digest())
+        return []
+
+
+    def lookup_file(self, digest: str) -> List[str]:
+        """ Paths of stored files with whole file digest. """
+        rows = self.connection.execute(
+            "SELECT path FROM files WHERE digest = ? ORDER BY path", (digest,))
+        return [row[0] for row in rows]
+
+
+    def blocks(self, path: str) -> List[BlockRecord]:
+        """ Stored blocks of file. """
+        rows = self.connection.execute(
+            "SELECT files.path, blocks.name, blocks.block_type, "
+            "blocks.offset, blocks.size, blocks.digest "
+            "FROM blocks JOIN files ON files.id = blocks.file_id "
+            "WHERE files.path = ? ORDER BY blocks.offset",
+            (os.path.abspath(path),))
+        return [BlockRecord(*row) for row in rows]
+
+
+def _walk_files(root: str) -> Iterator[str]:
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                yield path
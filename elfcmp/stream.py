@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+import io
+import tempfile
+
+from .elfcmp import ComparableElf
+from .utils import *
+
+
+# Default memory limit of one spooled stream, bigger streams go to disk.
+DEFAULT_MAX_MEMORY = 64 * 1024 * 1024
+
+
+def is_seekable(stream) -> bool:
+    try:
+        return stream.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _read_chunk(stream, size: int) -> bytes:
+    """ Read up to size bytes, short reads of pipes are repeated. """
+    parts = []
+    while size > 0:
+        part = stream.read(size)
+        if not part:
+            break
+        parts.append(part)
+        size -= len(part)
+    return b"".join(parts)
+
+
+def spool_pair(
+    stream_1, stream_2, max_memory: int = DEFAULT_MAX_MEMORY,
+    chunk_size: int = 64 * 1024
+    ) -> Tuple[tempfile.SpooledTemporaryFile, tempfile.SpooledTemporaryFile,
+        List[Tuple[int, int]]]:
+    """
+    Read two non-seekable streams once, in order and in lockstep, into
+    seekable spools. Spool keeps up to max_memory bytes in memory and
+    spills to temporary file after that. Chunks with same offset are
+    compared as they stream past, so compare_to() later does not read data
+    known to be equal.
+    :returns: tuple (spool_1, spool_2, equal_ranges), equal_ranges is
+        sorted list of intervals (start, end) of equal bytes. It is empty
+        for compressed streams, since their offsets are not ELF offsets.
+    """
+    spools = (
+        tempfile.SpooledTemporaryFile(max_size=max_memory),
+        tempfile.SpooledTemporaryFile(max_size=max_memory))
+    equal_ranges = []
+    offset = 0
+    heads = []
+
+    try:
+        while True:
+            chunk_1 = _read_chunk(stream_1, chunk_size)
+            chunk_2 = _read_chunk(stream_2, chunk_size)
+            if not chunk_1 and not chunk_2:
+                break
+
+            if offset == 0:
+                heads = [chunk_1, chunk_2]
+
+            spools[0].write(chunk_1)
+            spools[1].write(chunk_2)
+
+            if chunk_1 and chunk_1 == chunk_2:
+                equal_ranges.append((offset, offset + len(chunk_1)))
+            offset += chunk_size
+
+    except Exception:
+        for spool in spools:
+            spool.close()
+        raise
+
+    for spool in spools:
+        spool.seek(0, io.SEEK_SET)
+
+    if not all(head.startswith(b"\x7fELF") for head in heads):
+        equal_ranges = []
+
+    return spools[0], spools[1], merge_intervals(equal_ranges)
+
+
+@contextmanager
+def open_streams(
+    stream_1, stream_2, max_memory: int = DEFAULT_MAX_MEMORY,
+    compact: bool = True, chunk_size: int = 64 * 1024
+    ) -> Iterator[Tuple[ComparableElf, ComparableElf, List[Tuple[int, int]]]]:
+    """
+    Context manager giving ComparableElf objects of two streams and
+    equal_ranges for compare_to(). Seekable streams are used as is,
+    others are spooled by spool_pair(). Spools are closed on exit.
+    """
+    if is_seekable(stream_1) and is_seekable(stream_2):
+        yield (
+            ComparableElf(stream_1, compact=compact),
+            ComparableElf(stream_2, compact=compact),
+            [])
+        return
+
+    spool_1, spool_2, equal_ranges = spool_pair(
+        stream_1, stream_2, max_memory, chunk_size)
+    try:
+        yield (
+            ComparableElf(spool_1, compact=compact),
+            ComparableElf(spool_2, compact=compact),
+            equal_ranges)
+    finally:
+        spool_1.close()
+        spool_2.close()
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Dict, Iterable, Iterator, Set
+import fnmatch
+import re
+
+from .compact import SHF_COMPRESSED
+from .elfcmp import ComparableElf
+from .structs import Block, BlockType
+
+
+# Section contains NUL-terminated strings (.rodata.str*, .comment).
+SHF_STRINGS = 0x20
+
+# Sections which are not string tables, but usually contain strings.
+DEFAULT_DATA_PATTERNS = (".rodata*",)
+
+_PRINTABLE = re.compile(rb"[\x20-\x7e\t\n\r]+")
+
+
+def iter_strings(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Split stream of chunks into NUL-terminated strings in one pass.
+    Parts of string split by chunks are joined once, when its end is found,
+    so long strings cost linear time. Empty strings are skipped.
+    """
+    pending = []
+
+    for chunk in chunks:
+        parts = chunk.split(b"\0")
+        if len(parts) == 1:
+            pending.append(chunk)
+            continue
+
+        pending.append(parts[0])
+        first = b"".join(pending)
+        if first:
+            yield first
+
+        for part in parts[1:-1]:
+            if part:
+                yield part
+
+        pending = [parts[-1]]
+
+    last = b"".join(pending)
+    if last:
+        yield last
+
+
+def _section_block(elf: ComparableElf, section) -> Block:
+    return Block(
+        section["sh_offset"], section["sh_size"], BlockType.SECTION, elf,
+        section)
+
+
+def string_sections(
+    elf: ComparableElf,
+    data_patterns: Iterable[str] = DEFAULT_DATA_PATTERNS) -> Dict[str, bool]:
+    """
+    Find sections with strings: string tables (SHT_STRTAB), sections with
+    SHF_STRINGS flag and sections matched to data_patterns (see fnmatch).
+    :returns: dictionary {section name: True for string tables, False for
+        other matched sections}.
+    """
+    result = {}
+
+    for section in elf.sections:
+        if section["sh_type"] in ("SHT_NOBITS", "SHT_NULL"):
+            continue
+
+        if (section["sh_type"] == "SHT_STRTAB"
+            or section["sh_flags"] & SHF_STRINGS):
+            result[section.name] = True
+
+        elif any(fnmatch.fnmatchcase(section.name, p) for p in data_patterns):
+            result[section.name] = False
+
+    return result
+
+
+def section_strings(
+    elf: ComparableElf, section, is_table: bool = True,
+    min_length: int = 4, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    Strings of section read by chunks. All strings of string tables are
+    returned, for other sections only printable strings of min_length
+    and more characters, like strings utility does.
+    """
+    if section["sh_flags"] & SHF_COMPRESSED:
+        # pyelftools decompresses whole section.
+        chunks = [section.data()]
+    else:
+        chunks = _section_block(elf, section).iter_data(chunk_size)
+
+    for string in iter_strings(chunks):
+        if is_table or (
+            len(string) >= min_length and _PRINTABLE.fullmatch(string)):
+            yield string
+
+
+class StringsDiff:
+    """
+    Strings added to and removed from section.
+
+    :added: set of strings of right section only
+    :removed: set of strings of left section only
+    :common_count: count of unique strings of both sections
+    """
+
+    def __init__(
+        self, added: Set[bytes] = None, removed: Set[bytes] = None,
+        common_count: int = 0):
+
+        self.added = added if added is not None else set()
+        self.removed = removed if removed is not None else set()
+        self.common_count = common_count
+
+
+    def has_changes(self) -> bool:
+        """ Check if any changes were found. """
+        return bool(self.added or self.removed)
+
+
+    def __str__(self):
+        result = []
+
+        for title, strings in (
+            ("Removed", self.removed), ("Added", self.added)):
+            for string in sorted(strings):
+                result.append("{}: {!r}".format(
+                    title, string.decode("utf-8", "backslashreplace")))
+
+        return "\n".join(result)
+
+
+def diff_strings(
+    left: Iterable[bytes], right: Iterable[bytes]) -> StringsDiff:
+    """
+    Diff sets of strings. Left strings are collected to set, so duplicates
+    are stored once. Right strings are streamed: found in left set are
+    moved to common set, so every unique string is stored in one copy
+    and each one costs one hash lookup.
+    """
+    left_only = set(left)
+    common = set()
+    added = set()
+
+    for string in right:
+        if string in left_only:
+            left_only.remove(string)
+            common.add(string)
+        elif string not in common:
+            added.add(string)
+
+    return StringsDiff(added, left_only, len(common))
+
+
+def compare_strings(
+    left: ComparableElf, right: ComparableElf,
+    data_patterns: Iterable[str] = DEFAULT_DATA_PATTERNS,
+    min_length: int = 4) -> Dict[str, StringsDiff]:
+    """
+    Diff strings of common string sections (see string_sections()).
+    :returns: dictionary {section name: StringsDiff} of sections with
+        changes.
+    """
+    data_patterns = list(data_patterns)
+    left_names = string_sections(left, data_patterns)
+    right_names = string_sections(right, data_patterns)
+    left_sections = {s.name: s for s in left.sections}
+    right_sections = {s.name: s for s in right.sections}
+    result = {}
+
+    for name in sorted(left_names.keys() & right_names.keys()):
+        is_table = left_names[name] and right_names[name]
+        diff = diff_strings(
+            section_strings(left, left_sections[name], is_table, min_length),
+            section_strings(
+                right, right_sections[name], is_table, min_length))
+
+        if diff.has_changes():
+            result[name] = diff
+
+    return result
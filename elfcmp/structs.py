@@ -18,7 +18,9 @@
 # along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
 
 from enum import Enum
-from typing import Tuple, List, Dict
+from types import SimpleNamespace
+from typing import Tuple, List, Dict, Optional, Iterable, Iterator
+import hashlib
 
 from elftools.elf.elffile import ELFFile
 from elftools.elf.sections import Section
@@ -44,16 +46,23 @@ class SectionDiff:
     :data_diff_offset: -1 if data arrays are equal; length of the shortest
         array if their common parts are equal, but lengths differ; index of
         first non-equal byte if length are same, but contents are not.
+    :level: severity level of section differences, see rules.py
+    :similarity: similarity score of data 0-100 if data differs and
+        similarity was requested in compare_to(), else None
     """
     def __init__(
         self, 
         headers: DictDiff = None,
         data_sizes: Tuple[int, int] = None,
-        data_diff_offset: int = -1):
+        data_diff_offset: int = -1,
+        level: int = None,
+        similarity: int = None):
 
         self.headers = headers
         self.data_sizes = data_sizes
         self.data_diff_offset = data_diff_offset
+        self.level = level
+        self.similarity = similarity
 
 
     def has_changes(self):
@@ -63,6 +72,26 @@ class SectionDiff:
             and self.data_diff_offset == -1)
 
 
+    def to_dict(self) -> dict:
+        """ JSON compatible dictionary of changes. """
+        return {
+            "headers": self.headers.to_dict() if self.headers else None,
+            "data_sizes": list(self.data_sizes) if self.data_sizes else None,
+            "data_diff_offset": self.data_diff_offset,
+            "level": self.level,
+            "similarity": self.similarity,
+            }
+
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SectionDiff":
+        """ Restore SectionDiff from to_dict() result. """
+        return cls(
+            DictDiff.from_dict(data["headers"]) if data["headers"] else None,
+            tuple(data["data_sizes"]) if data["data_sizes"] else None,
+            data["data_diff_offset"], data["level"], data["similarity"])
+
+
     def __str__(self):
         indent = "\t\t"
         inner_indent = "\t\t\t"
@@ -85,6 +114,9 @@ class SectionDiff:
                 "First data diff at: {}".format(
                     format(self.data_diff_offset, numbers_format)))
 
+        if self.similarity is not None:
+            result.append("Similarity: {}%".format(self.similarity))
+
         result_str = indent if result else ""
         result_str += "\n{}".format(indent).join(result)
 
@@ -99,17 +131,20 @@ class AllSectionsDiff:
     :right_new: set of second file unique sections names 
     :modified: dictionary of common sections (with equal names), 
         values are SectionDiff
+    :levels: dictionary of severity levels {name: level} for new sections
     """
     def __init__(
         self,
         left_new: Set[str] = None,
         right_new: Set[str] = None,
-        modified: Dict[str, SectionDiff] = None
+        modified: Dict[str, SectionDiff] = None,
+        levels: Dict[str, int] = None
         ):
 
         self.left_new = left_new
         self.right_new = right_new
         self.modified = modified
+        self.levels = levels if levels is not None else {}
 
 
     def has_changes(self) -> bool:
@@ -119,6 +154,28 @@ class AllSectionsDiff:
         return self.left_new or self.right_new or self.modified
 
 
+    def to_dict(self) -> dict:
+        """ JSON compatible dictionary of changes. """
+        return {
+            "left_new": sorted(self.left_new or ()),
+            "right_new": sorted(self.right_new or ()),
+            "modified": {
+                name: diff.to_dict()
+                for name, diff in (self.modified or {}).items()},
+            "levels": self.levels,
+            }
+
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AllSectionsDiff":
+        """ Restore AllSectionsDiff from to_dict() result. """
+        return cls(
+            set(data["left_new"]), set(data["right_new"]),
+            {name: SectionDiff.from_dict(diff)
+                for name, diff in data["modified"].items()},
+            dict(data["levels"]))
+
+
     def __str__(self):
         indent = "\t"
         result = []
@@ -197,6 +254,59 @@ class Block:
         return self.elf.stream.read(self.size)
 
 
+    def iter_data(self, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """ Get data decsribed by this block by chunks. """
+        offset = self.start_offset
+        end_offset = self.end_offset()
+
+        while offset < end_offset:
+            self.elf.stream.seek(offset)
+            chunk = self.elf.stream.read(min(chunk_size, end_offset - offset))
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+
+    def digest(self, algorithm: str = "sha256") -> str:
+        """ Hex digest of data, data is read by chunks. """
+        hash_ = hashlib.new(algorithm)
+        for chunk in self.iter_data():
+            hash_.update(chunk)
+        return hash_.hexdigest()
+
+
+    def name(self) -> str:
+        """ Section name for section blocks, type name for others. """
+        if self.block_type == BlockType.SECTION:
+            return self.object_.name
+        return self.block_type.name
+
+
+    def to_dict(self) -> dict:
+        """ JSON compatible description of block, without data. """
+        return {
+            "block_type": self.block_type.name,
+            "name": self.name(),
+            "start_offset": self.start_offset,
+            "size": self.size,
+            }
+
+
+    @classmethod
+    def from_dict(cls, data: dict, elf: ELFFile = None) -> "Block":
+        """
+        Restore Block from to_dict() result. Section blocks get object with
+        name attribute only instead of Section.
+        """
+        block_type = BlockType[data["block_type"]]
+        object_ = None
+        if block_type == BlockType.SECTION:
+            object_ = SimpleNamespace(name=data["name"])
+        return cls(
+            data["start_offset"], data["size"], block_type, elf, object_)
+
+
     def __str__(self) -> str:
         info = ""
 
@@ -222,6 +332,9 @@ class NotUsedBlockDiff(object):
     :data_diff_offset: -1 if data arrays are equal; length of the shortest
         array if their common parts are equal, but lengths differ; index of
         first non-equal byte if length are same, but contents are not.
+    :level: severity level of difference, see rules.py
+    :similarity: similarity score of data 0-100 if data differs and
+        similarity was requested in compare_to(), else None
     """
 
     indent = ""
@@ -231,13 +344,17 @@ class NotUsedBlockDiff(object):
         left_block: Block = None,
         right_block: Block = None,
         data_sizes: Tuple[int, int] = None,
-        data_diff_offset: int = -1
+        data_diff_offset: int = -1,
+        level: int = None,
+        similarity: int = None
         ):
 
         self.left_block = left_block
         self.right_block = right_block
         self.data_sizes = data_sizes
         self.data_diff_offset = data_diff_offset
+        self.level = level
+        self.similarity = similarity
 
 
     def has_changes(self) -> bool:
@@ -247,6 +364,34 @@ class NotUsedBlockDiff(object):
         return self.data_sizes is not None or self.data_diff_offset != -1
 
 
+    def to_dict(self) -> dict:
+        """ JSON compatible dictionary of changes. """
+        return {
+            "left_block": self.left_block.to_dict()
+                if self.left_block else None,
+            "right_block": self.right_block.to_dict()
+                if self.right_block else None,
+            "data_sizes": list(self.data_sizes) if self.data_sizes else None,
+            "data_diff_offset": self.data_diff_offset,
+            "level": self.level,
+            "similarity": self.similarity,
+            }
+
+
+    @classmethod
+    def from_dict(
+        cls, data: dict, left_elf: ELFFile = None,
+        right_elf: ELFFile = None) -> "NotUsedBlockDiff":
+        """ Restore NotUsedBlockDiff from to_dict() result. """
+        return cls(
+            Block.from_dict(data["left_block"], left_elf)
+                if data["left_block"] else None,
+            Block.from_dict(data["right_block"], right_elf)
+                if data["right_block"] else None,
+            tuple(data["data_sizes"]) if data["data_sizes"] else None,
+            data["data_diff_offset"], data["level"], data["similarity"])
+
+
     def __str__(self):
         result = []
 
@@ -264,6 +409,9 @@ class NotUsedBlockDiff(object):
                 "First data diff at: {}".format(
                     format(self.data_diff_offset, numbers_format)))
 
+        if self.similarity is not None:
+            result.append("Similarity: {}%".format(self.similarity))
+
         result_str = NotUsedBlockDiff.indent if result else ""
         result_str += "\n{}".format(NotUsedBlockDiff.indent).join(result)
 
@@ -280,21 +428,24 @@ class AllBlocksDiff(object):
     :counts_of_not_used: tuple of not used blocks counts for both files,
         None if equal.
     :diffs_in_not_used: list of not used blocks with non equal data
+    :level: severity level of blocks differences, see rules.py
     """
     indent = ""
 
     def __init__(
         self,
-        left_overlaps_in_used: List[Tuple[Block]] = [],
-        right_overlaps_in_used: List[Block] = [],
+        left_overlaps_in_used: List[Tuple[Block]] = None,
+        right_overlaps_in_used: List[Block] = None,
         counts_of_not_used: Tuple[int, int] = None,
-        diffs_in_not_used: List[NotUsedBlockDiff] = []
+        diffs_in_not_used: List[NotUsedBlockDiff] = None,
+        level: int = None
         ):
 
-        self.left_overlaps_in_used = left_overlaps_in_used
-        self.right_overlaps_in_used = right_overlaps_in_used
+        self.left_overlaps_in_used = left_overlaps_in_used or []
+        self.right_overlaps_in_used = right_overlaps_in_used or []
         self.counts_of_not_used = counts_of_not_used
-        self.diffs_in_not_used = diffs_in_not_used
+        self.diffs_in_not_used = diffs_in_not_used or []
+        self.level = level
         
         
     def has_changes(self) -> bool:
@@ -306,6 +457,41 @@ class AllBlocksDiff(object):
             or self.diffs_in_not_used)
 
 
+    def to_dict(self) -> dict:
+        """ JSON compatible dictionary of changes. """
+        def overlaps(pairs):
+            return [[b1.to_dict(), b2.to_dict()] for b1, b2 in pairs]
+
+        return {
+            "left_overlaps_in_used": overlaps(self.left_overlaps_in_used),
+            "right_overlaps_in_used": overlaps(self.right_overlaps_in_used),
+            "counts_of_not_used": list(self.counts_of_not_used)
+                if self.counts_of_not_used else None,
+            "diffs_in_not_used": [d.to_dict() for d in self.diffs_in_not_used],
+            "level": self.level,
+            }
+
+
+    @classmethod
+    def from_dict(
+        cls, data: dict, left_elf: ELFFile = None,
+        right_elf: ELFFile = None) -> "AllBlocksDiff":
+        """ Restore AllBlocksDiff from to_dict() result. """
+        def overlaps(pairs, elf):
+            return [
+                (Block.from_dict(b1, elf), Block.from_dict(b2, elf))
+                for b1, b2 in pairs]
+
+        return cls(
+            overlaps(data["left_overlaps_in_used"], left_elf),
+            overlaps(data["right_overlaps_in_used"], right_elf),
+            tuple(data["counts_of_not_used"])
+                if data["counts_of_not_used"] else None,
+            [NotUsedBlockDiff.from_dict(d, left_elf, right_elf)
+                for d in data["diffs_in_not_used"]],
+            data["level"])
+
+
     def __str__(self):
         result = []
 
@@ -345,6 +531,76 @@ class AllBlocksDiff(object):
         return result_str 
 
 
+class EventType(Enum):
+    """ Describes type of DiffEvent. """
+    HEADER_LEFT_NEW      = 0
+    HEADER_RIGHT_NEW     = 1
+    HEADER_MODIFIED      = 2
+    SEGMENT_LEFT_NEW     = 3
+    SEGMENT_RIGHT_NEW    = 4
+    SEGMENT_MODIFIED     = 5
+    SECTION_LEFT_NEW     = 6
+    SECTION_RIGHT_NEW    = 7
+    SECTION_MODIFIED     = 8
+    LEFT_OVERLAP         = 9
+    RIGHT_OVERLAP        = 10
+    NOT_USED_COUNTS      = 11
+    NOT_USED_MODIFIED    = 12
+
+
+class DiffEvent:
+    """
+    One difference found by ComparableElf.iter_compare().
+
+    :event_type: type of difference, see EventType
+    :key: ELF header field, segment type or section name, None for blocks
+    :value: tuple of values (left, right) of header field, DictDiff of
+        segments of type, SectionDiff, tuple of overlapped blocks, tuple of
+        not used blocks counts or NotUsedBlockDiff; None for new keys and
+        sections
+    :level: severity level of difference, see rules.py
+    """
+    def __init__(
+        self, event_type: EventType, key=None, value=None, level: int = None):
+
+        self.event_type = event_type
+        self.key = key
+        self.value = value
+        self.level = level
+
+
+    def __str__(self):
+        result = self.event_type.name
+        if self.key is not None:
+            result += " {}".format(self.key)
+        if isinstance(self.value, (SectionDiff, NotUsedBlockDiff)):
+            result += "\n{}".format(self.value)
+        elif isinstance(self.value, DictDiff):
+            result += "\n{}".format(self.value.to_string(indent="\t"))
+        elif self.value is not None:
+            result += ": {}".format(self.value)
+        return result
+
+
+# Where ElfDiff.from_events() stores events:
+# {EventType: (attribute of ElfDiff, attribute of its part)}.
+_EVENT_TARGETS = {
+    EventType.HEADER_LEFT_NEW: ("compared_elf_headers", "left_new"),
+    EventType.HEADER_RIGHT_NEW: ("compared_elf_headers", "right_new"),
+    EventType.HEADER_MODIFIED: ("compared_elf_headers", "modified"),
+    EventType.SEGMENT_LEFT_NEW: ("compared_segments", "left_new"),
+    EventType.SEGMENT_RIGHT_NEW: ("compared_segments", "right_new"),
+    EventType.SEGMENT_MODIFIED: ("compared_segments", "modified"),
+    EventType.SECTION_LEFT_NEW: ("compared_sections", "left_new"),
+    EventType.SECTION_RIGHT_NEW: ("compared_sections", "right_new"),
+    EventType.SECTION_MODIFIED: ("compared_sections", "modified"),
+    EventType.LEFT_OVERLAP: ("compared_blocks", "left_overlaps_in_used"),
+    EventType.RIGHT_OVERLAP: ("compared_blocks", "right_overlaps_in_used"),
+    EventType.NOT_USED_COUNTS: ("compared_blocks", "counts_of_not_used"),
+    EventType.NOT_USED_MODIFIED: ("compared_blocks", "diffs_in_not_used"),
+    }
+
+
 class ElfDiff:
     """
     Result of ELF files comparison.
@@ -386,6 +642,110 @@ class ElfDiff:
             )
 
 
+    def max_level(self) -> Optional[int]:
+        """
+        Highest severity level of found differences (see rules.py).
+        :returns: None if there are no differences.
+        """
+        levels = []
+
+        for dict_diff in (self.compared_elf_headers, self.compared_segments):
+            levels.extend(
+                dict_diff.levels.get(k) for k in dict_diff.changed_keys())
+
+        sections = self.compared_sections
+        levels.extend(
+            sections.levels.get(name)
+            for name in (sections.left_new or set()) | (sections.right_new or set()))
+        levels.extend(
+            diff.level for diff in (sections.modified or {}).values())
+
+        blocks = self.compared_blocks
+        if blocks.has_changes():
+            levels.append(blocks.level)
+        levels.extend(diff.level for diff in blocks.diffs_in_not_used)
+
+        levels = [level for level in levels if level is not None]
+        return max(levels) if levels else None
+
+
+    def to_dict(self) -> dict:
+        """
+        JSON compatible dictionary of changes. Compared files are not
+        included, blocks are described by offsets and sizes.
+        """
+        return {
+            "compared_elf_headers": self.compared_elf_headers.to_dict(),
+            "compared_segments": self.compared_segments.to_dict(),
+            "compared_sections": self.compared_sections.to_dict(),
+            "compared_blocks": self.compared_blocks.to_dict(),
+            "max_level": self.max_level(),
+            }
+
+
+    @classmethod
+    def from_dict(
+        cls, data: dict, left_elf: "ComparableElf" = None,
+        right_elf: "ComparableElf" = None) -> "ElfDiff":
+        """
+        Restore ElfDiff from to_dict() result. Blocks are bound to left_elf
+        and right_elf, if they are given.
+        """
+        return cls(
+            left_elf, right_elf,
+            DictDiff.from_dict(data["compared_elf_headers"]),
+            DictDiff.from_dict(data["compared_segments"]),
+            AllSectionsDiff.from_dict(data["compared_sections"]),
+            AllBlocksDiff.from_dict(
+                data["compared_blocks"], left_elf, right_elf))
+
+
+    @classmethod
+    def from_events(
+        cls, events: Iterable[DiffEvent], left_elf: "ComparableElf" = None,
+        right_elf: "ComparableElf" = None) -> "ElfDiff":
+        """
+        Build ElfDiff of all events of ComparableElf.iter_compare(). Level
+        of blocks without block events is taken from rules of left_elf.
+        """
+        result = cls(
+            left_elf, right_elf,
+            DictDiff(set(), set(), set(), {}, set()),
+            DictDiff(set(), set(), set(), {}, set()),
+            AllSectionsDiff(set(), set(), {}),
+            AllBlocksDiff())
+
+        for event in events:
+            part_name, attribute = _EVENT_TARGETS[event.event_type]
+            part = getattr(result, part_name)
+            target = getattr(part, attribute)
+
+            if isinstance(target, set):
+                target.add(event.key)
+            elif isinstance(target, dict):
+                target[event.key] = event.value
+            elif isinstance(target, list):
+                target.append(event.value)
+            else:
+                setattr(part, attribute, event.value)
+
+            if part_name == "compared_blocks":
+                part.level = event.level
+            elif event.event_type != EventType.SECTION_MODIFIED:
+                part.levels[event.key] = event.level
+
+        for dict_diff in (
+            result.compared_elf_headers, result.compared_segments):
+            dict_diff.common_keys = set(dict_diff.modified)
+
+        if (result.compared_blocks.level is None and left_elf is not None
+            and left_elf.rules is not None):
+            result.compared_blocks.level = left_elf.rules.level(
+                "block_types", BlockType.NOT_USED.name)
+
+        return result
+
+
     def __str__(self):
         result = []
 
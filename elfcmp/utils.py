@@ -18,8 +18,9 @@
 # along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
 
 from collections.abc import Mapping
+import bisect
 import operator
-from typing import List, Set, Dict, Tuple, Union
+from typing import List, Set, Dict, Tuple, Union, Iterator
 
 ByteArray = Union[bytes, bytearray]
 
@@ -66,6 +67,8 @@ class DictDiff:
     :common_keys: set of keys belong to both dictionaries;
     :modified: dictionary of changes - key : tuple of values (left, right);
     :same: set of keys with equal values 
+    :levels: dictionary of severity levels {key: level} for changed keys,
+        filled by ComparableElf.compare_to() (see rules.py)
     """
     def __init__(
         self,
@@ -73,7 +76,8 @@ class DictDiff:
         right_new:Set = set(),
         common_keys = set(),
         modified:Dict = dict(),
-        same:Set = set()
+        same:Set = set(),
+        levels:Dict = None
         ):
 
         self.left_new = left_new
@@ -81,6 +85,7 @@ class DictDiff:
         self.common_keys = common_keys
         self.modified = modified
         self.same = same
+        self.levels = levels if levels is not None else {}
 
 
     # Uncommenting this lead to double to_string() calls. Dunno why.
@@ -95,6 +100,53 @@ class DictDiff:
         return self.left_new or self.right_new or self.modified
 
 
+    def changed_keys(self) -> Set:
+        """ Keys that are new on any side or modified. """
+        return self.left_new | self.right_new | set(self.modified)
+
+
+    def to_dict(self) -> dict:
+        """
+        JSON compatible dictionary of changes. Keys may be not strings
+        (segments offsets), so modified values and levels are stored as
+        lists of pairs [key, value].
+        """
+        def sort_key(item):
+            return str(item[0])
+
+        return {
+            "left_new": sorted(self.left_new, key=str),
+            "right_new": sorted(self.right_new, key=str),
+            "modified": [
+                [key, value.to_dict() if isinstance(value, DictDiff)
+                    else to_plain(value)]
+                for key, value in sorted(self.modified.items(), key=sort_key)],
+            "levels": [
+                [key, level]
+                for key, level in sorted(self.levels.items(), key=sort_key)],
+            }
+
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DictDiff":
+        """
+        Restore DictDiff from to_dict() result. Common keys are restored
+        as modified ones only, same keys are not stored.
+        """
+        modified = {}
+        for key, value in data["modified"]:
+            if isinstance(value, dict):
+                modified[key] = cls.from_dict(value)
+            else:
+                modified[key] = tuple(value)
+
+        left_new = set(data["left_new"])
+        right_new = set(data["right_new"])
+        return cls(
+            left_new, right_new, set(modified), modified, set(),
+            {key: level for key, level in data["levels"]})
+
+
     def to_string(
         self, 
         indent: str = "",
@@ -157,6 +209,20 @@ class DictDiff:
         return result_str 
 
 
+def to_plain(value):
+    """
+    Convert value of header to JSON compatible one: mappings to
+    dictionaries, tuples to lists, bytes to hex strings.
+    """
+    if isinstance(value, Mapping):
+        return {str(k): to_plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_plain(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return value
+
+
 def compare_dict(
     d1: dict, d2: dict, deep=False,
     include_modified=True, include_same=True, 
@@ -209,3 +275,101 @@ def compare_dict(
                 modified[key] = (value_1, value_2)
 
     return DictDiff(d1_new, d2_new, intersect_keys, modified, same)
+
+
+def merge_intervals(
+    intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Sort intervals [start, end) and merge overlapped and sticked ones.
+    :returns: sorted list of not intersected intervals.
+    """
+    result = []
+
+    for start, end in sorted(intervals):
+        if start >= end:
+            continue
+        if result and start <= result[-1][1]:
+            if end > result[-1][1]:
+                result[-1] = (result[-1][0], end)
+        else:
+            result.append((start, end))
+
+    return result
+
+
+def interval_covers(
+    intervals: List[Tuple[int, int]], start: int, end: int) -> bool:
+    """
+    Check if interval [start, end) is inside one of intervals.
+    :intervals: sorted not intersected intervals, see merge_intervals()
+    """
+    # Last interval starting before or at start.
+    index = bisect.bisect_right(intervals, (start, float("inf"))) - 1
+    return index >= 0 and end <= intervals[index][1]
+
+
+def iter_unmasked(
+    start: int, end: int,
+    masks: List[Tuple[int, int]]) -> Iterator[Tuple[int, int]]:
+    """
+    Split interval [start, end) to parts not covered by masks.
+    :masks: sorted not intersected intervals, see merge_intervals()
+    :returns: iterator of intervals (start, end).
+    """
+    # Skip masks before interval.
+    index = bisect.bisect_right(masks, (start, start))
+    if index and masks[index - 1][1] > start:
+        index -= 1
+
+    position = start
+    for mask_start, mask_end in masks[index:]:
+        if mask_start >= end:
+            break
+        if mask_start > position:
+            yield position, mask_start
+        position = max(position, mask_end)
+
+    if position < end:
+        yield position, end
+
+
+def locate_diff_ranges(
+    data_1: ByteArray, data_2: ByteArray,
+    start: int = 0, end: int = None,
+    chunk_size: int = 4096) -> List[Tuple[int, int]]:
+    """
+    Find all ranges [start, end) where arrays differ. Equal chunks are
+    skipped by comparison of memoryview slices without copying, only
+    different chunks are checked byte by byte.
+    :start, end: compared part of arrays, end is minimal length by default
+    :returns: sorted list of intervals (start, end).
+    """
+    view_1 = memoryview(data_1)
+    view_2 = memoryview(data_2)
+    if end is None:
+        end = min(len(view_1), len(view_2))
+
+    result = []
+    range_start = None
+
+    for chunk_start in range(start, end, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, end)
+
+        if view_1[chunk_start:chunk_end] == view_2[chunk_start:chunk_end]:
+            if range_start is not None:
+                result.append((range_start, chunk_start))
+                range_start = None
+            continue
+
+        for i in range(chunk_start, chunk_end):
+            if view_1[i] != view_2[i]:
+                if range_start is None:
+                    range_start = i
+            elif range_start is not None:
+                result.append((range_start, i))
+                range_start = None
+
+    if range_start is not None:
+        result.append((range_start, end))
+
+    return result
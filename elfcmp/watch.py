@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2020 Dmitriy Nezamaev (dnezamaev@gmail.com).
+#
+# This file is part of pyelfcmp.
+#
+# pyelfcmp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyelfcmp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
+
+from typing import Callable, Optional, Set, Tuple
+import os
+import struct
+import time
+
+from elftools.common.exceptions import ELFError
+
+from .elfcmp import ComparableElf
+from .rules import Rules
+from .structs import BlockType, ElfDiff
+
+
+class FileState:
+    """
+    Parsed watched file with digests of its parts.
+
+    :signature: (st_mtime_ns, st_size, st_ino) of file when it was parsed
+    :elf: ComparableElf of file
+    :tables: {BlockType name: digest} of ELF header, program and section
+        header tables
+    :sections: {section name: (header values, data digest)}
+    :not_used: list of (offset, size, digest) of not used blocks
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        stat = os.stat(path)
+        self.signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        self.file = open(path, "rb")
+
+        try:
+            self.elf = ComparableElf(self.file, compact=True)
+            self.tables = {}
+            self.sections = {}
+
+            for block in self.elf.used_blocks:
+                if block.block_type != BlockType.SECTION:
+                    self.tables[block.block_type.name] = block.digest()
+
+            sections_digests = {
+                block.name(): block.digest()
+                for block in self.elf.used_blocks
+                if block.block_type == BlockType.SECTION}
+
+            for section in self.elf.sections:
+                self.sections[section.name] = (
+                    tuple(section.header.items()),
+                    sections_digests.get(section.name))
+
+            self.not_used = [
+                (block.start_offset, block.size, block.digest())
+                for block in self.elf.not_used_blocks]
+
+        except Exception:
+            self.file.close()
+            raise
+
+
+    def close(self):
+        self.file.close()
+
+
+def changed_parts(
+    old: FileState, new: FileState) -> Tuple[Set[str], Set[str]]:
+    """
+    Find compare phases affected by file change.
+    :returns: tuple (set of phases, set of changed section names), see
+        ComparableElf.recompare().
+    """
+    phases = set()
+
+    if old.tables.get("ELF_HEADER") != new.tables.get("ELF_HEADER"):
+        phases.add("headers")
+
+    if (old.tables.get("PROGRAM_HEADER_TABLE")
+        != new.tables.get("PROGRAM_HEADER_TABLE")):
+        phases.add("segments")
+
+    section_names = {
+        name for name in old.sections.keys() | new.sections.keys()
+        if old.sections.get(name) != new.sections.get(name)}
+    if section_names:
+        phases.add("sections")
+
+    if old.not_used != new.not_used:
+        phases.add("blocks")
+
+    return phases, section_names
+
+
+class Watcher:
+    """
+    Compare two files again every time one of them changes. Files are
+    polled by stat(). Changed file is parsed again and digests of its
+    headers, sections and not used blocks show which compare phases and
+    which sections must be compared again, other results are kept.
+    Files which can not be parsed (being written) are retried on next poll.
+
+    :rules, similarity: options of compare, see ComparableElf.compare_to()
+    """
+
+    def __init__(
+        self, left_path: str, right_path: str, rules: Rules = None,
+        similarity: bool = False):
+
+        self.paths = (left_path, right_path)
+        self.rules = rules
+        self.similarity = similarity
+        self.states = [FileState(left_path), FileState(right_path)]
+        self.last_phases = None
+        self.result = self.states[0].elf.compare_to(
+            self.states[1].elf, rules, similarity)
+
+
+    def _reload(self, index: int) -> Optional[Tuple[Set[str], Set[str]]]:
+        """
+        Parse file again if it was changed.
+        :returns: changed parts (see changed_parts()) or None.
+        """
+        path = self.paths[index]
+        old = self.states[index]
+
+        try:
+            stat = os.stat(path)
+            if (stat.st_mtime_ns, stat.st_size, stat.st_ino) == old.signature:
+                return None
+            new = FileState(path)
+        except (OSError, ELFError, struct.error):
+            return None
+
+        self.states[index] = new
+        old.close()
+        return changed_parts(old, new)
+
+
+    def poll(self) -> Optional[ElfDiff]:
+        """
+        Check files once.
+        :returns: new ElfDiff if any file was changed, None otherwise.
+        """
+        phases = set()
+        section_names = set()
+        reloaded = False
+
+        for index in range(2):
+            changes = self._reload(index)
+            if changes is not None:
+                reloaded = True
+                phases |= changes[0]
+                section_names |= changes[1]
+
+        if not reloaded:
+            return None
+
+        # Result is made again even without changes to bind it to new files.
+        self.last_phases = phases
+        left, right = self.states[0].elf, self.states[1].elf
+        self.result = left.recompare(
+            right, self.result, phases, section_names, self.rules,
+            self.similarity)
+        return self.result if phases else None
+
+
+    def run(
+        self, callback: Callable[[ElfDiff], None], interval: float = 0.5,
+        stop: Callable[[], bool] = None):
+        """
+        Call callback with first result and then with every new one.
+        :interval: seconds between polls
+        :stop: function telling to stop watching, never by default
+        """
+        callback(self.result)
+
+        while stop is None or not stop():
+            time.sleep(interval)
+            result = self.poll()
+            if result is not None:
+                callback(result)
+
+
+    def close(self):
+        for state in self.states:
+            state.close()
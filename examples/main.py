@@ -18,7 +18,10 @@
 # along with py-elfcmp. If not, see <http://www.gnu.org/licenses/>.
 
 from typing import Any, Tuple, List, Dict, Union, Optional
+import argparse
+import contextlib
 import io
+import os
 import sys
 
 from elftools.elf.elffile import ELFFile
@@ -28,25 +31,197 @@ from elftools.elf.segments import Segment
 # Allows import local files when running from the root of project.
 sys.path.insert(1, ".")
 
+from elfcmp.cache import ResultCache
+from elfcmp.dwarf import compare_debug_info, diff_unit_dies
 from elfcmp.elfcmp import *
+from elfcmp.hexview import hex_context
+from elfcmp.memimage import compare_images
+from elfcmp.merkle import Sidecar, compare_trees
+from elfcmp.report import write_html_report
+from elfcmp.relocations import compare_relocations
+from elfcmp.reproducible import verify_reproducible
+from elfcmp.rules import Rules
+from elfcmp.sampling import compare_sampled
+from elfcmp.stream import DEFAULT_MAX_MEMORY, open_streams
+from elfcmp.strings import compare_strings
+from elfcmp.watch import Watcher
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare two ELF files.")
+    parser.add_argument(
+        "left", help="path to first ELF file, \"-\" for standard input")
+    parser.add_argument(
+        "right", help="path to second ELF file, \"-\" for standard input")
+    parser.add_argument(
+        "--rules", help="JSON file with ignore and severity rules")
+    parser.add_argument(
+        "--similarity", action="store_true",
+        help="print similarity scores of changed sections and blocks")
+    parser.add_argument(
+        "--context", metavar="N", type=int,
+        help="print hex views of N bytes around found differences")
+    parser.add_argument(
+        "--html", metavar="DIR", help="write HTML report to directory")
+    parser.add_argument(
+        "--relocations", action="store_true",
+        help="compare sections data except bytes patched by relocations "
+            "and diff relocation entries")
+    parser.add_argument(
+        "--strings", action="store_true",
+        help="print strings added to and removed from string tables "
+            "and .rodata sections")
+    parser.add_argument(
+        "--reproducible", action="store_true",
+        help="verify reproducible build: compare bytes except build-id, "
+            "debuglink CRC and --mask-section sections")
+    parser.add_argument(
+        "--mask-section", action="append", default=[],
+        help="section name pattern to mask in --reproducible mode")
+    parser.add_argument(
+        "--cache", metavar="DIR",
+        help="directory of compare results cache, same files compared "
+            "with same options are not compared again")
+    parser.add_argument(
+        "--watch", metavar="SECONDS", type=float,
+        help="poll files every SECONDS and print new result on change")
+    parser.add_argument(
+        "--first", metavar="N", type=int,
+        help="print first N differences as soon as they are found and stop")
+    parser.add_argument(
+        "--sample", metavar="RATE", type=float,
+        help="approximate compare reading only RATE fraction of pages "
+            "of every block")
+    parser.add_argument(
+        "--sidecars", action="store_true",
+        help="compare by Merkle trees of pages stored near files, trees are "
+            "built and saved on first use")
+    parser.add_argument(
+        "--memory-image", action="store_true",
+        help="compare memory images made of PT_LOAD segments, print "
+            "different virtual address ranges")
+    parser.add_argument(
+        "--debug-info", action="store_true",
+        help="compare DWARF compilation units by hashes, print DIE "
+            "differences of changed units")
+    parser.add_argument(
+        "--max-memory", type=int, default=DEFAULT_MAX_MEMORY,
+        help="memory limit of non-seekable input buffer (pipes), "
+            "bigger inputs are buffered in temporary files")
+
+    args = parser.parse_args()
+    # Standard input can be read only once.
+    if args.left == "-" and args.right == "-":
+        parser.error("only one of files can be standard input")
+    if args.sample is not None and not 0 < args.sample <= 1:
+        parser.error("--sample rate must be in (0, 1]")
+    if args.first is not None and args.first < 1:
+        parser.error("--first requires N >= 1")
+    # Sidecars are bound to file paths and modification times.
+    if args.sidecars and not all(
+        os.path.isfile(path) for path in (args.left, args.right)):
+        parser.error("--sidecars requires regular files")
+    return args
+
+
+def open_input(path: str):
+    """ Open file, "-" is standard input. """
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin.buffer)
+    return open(path, "rb")
+
 
 if __name__ == '__main__':
 
-    if len(sys.argv) < 3:
-        print("No arguments")
-    else:
-        with\
-        open(sys.argv[1], 'rb') as file_1,\
-        open(sys.argv[2], 'rb') as file_2:
+    args = parse_args()
+    rules = Rules.from_file(args.rules) if args.rules else None
+
+    if args.watch:
+        watcher = Watcher(args.left, args.right, rules, args.similarity)
+        try:
+            watcher.run(
+                lambda result: print("{}\n{}".format(
+                    result, "=" * 79), flush=True),
+                args.watch)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+        sys.exit(0)
+
+    # Pipes are read once into buffers, see elfcmp/stream.py.
+    with\
+    open_input(args.left) as file_1,\
+    open_input(args.right) as file_2,\
+    open_streams(file_1, file_2, args.max_memory, compact=False) as\
+    (left_elf, right_elf, equal_ranges):
+
+        if args.relocations:
+            result = compare_relocations(left_elf, right_elf)
+            for name, diff in sorted(result.items()):
+                print("Section {}:\n\t{}".format(
+                    name, str(diff).replace("\n", "\n\t")))
+            sys.exit(1 if result else 0)
+
+        if args.strings:
+            result = compare_strings(left_elf, right_elf)
+            for name, diff in result.items():
+                print("Section {}:\n\t{}".format(
+                    name, str(diff).replace("\n", "\n\t")))
+            sys.exit(1 if result else 0)
+
+        if args.reproducible:
+            result = verify_reproducible(
+                left_elf, right_elf, args.mask_section)
+            print(result)
+            sys.exit(0 if result.passed() else 1)
+
+        if args.sample is not None:
+            result = compare_sampled(left_elf, right_elf, rate=args.sample)
+            print(result)
+            sys.exit(1 if result.has_changes() else 0)
+
+        if args.sidecars:
+            result = compare_trees(
+                left_elf, right_elf,
+                Sidecar.load_or_build(args.left, left_elf),
+                Sidecar.load_or_build(args.right, right_elf))
+            print(result)
+            sys.exit(1 if result.has_changes() else 0)
+
+        if args.memory_image:
+            result = compare_images(left_elf, right_elf)
+            print(result)
+            sys.exit(1 if result.has_changes() else 0)
+
+        if args.debug_info:
+            result = compare_debug_info(left_elf, right_elf)
+            print(result)
+            for name, offsets in sorted(result.offsets.items()):
+                if name in result.unparsed:
+                    continue
+                print("{}:".format(name))
+                for line in diff_unit_dies(left_elf, right_elf, *offsets):
+                    print("\t{}".format(line))
+            sys.exit(1 if result.has_changes() else 0)
 
-            left_elf = ComparableElf(file_1)
-            right_elf = ComparableElf(file_2)
+        if args.first is not None:
+            for event in left_elf.iter_compare(
+                right_elf, rules, args.similarity, equal_ranges, args.first):
+                print(event, flush=True)
+            sys.exit(0)
 
-            # print(type(left_elf.header).mro())
-            # for s in left_elf.segments:
-            #     print(s["p_type"], s["p_offset"], s["p_offset"] + s["p_filesz"])
-            # exit()
+        if args.cache:
+            cmp_result = ResultCache(args.cache).compare(
+                left_elf, right_elf, rules, similarity=args.similarity,
+                equal_ranges=equal_ranges)
+        else:
+            cmp_result = left_elf.compare_to(
+                right_elf, rules, similarity=args.similarity,
+                equal_ranges=equal_ranges)
+        print(cmp_result)
 
-            cmp_result = left_elf.compare_to(right_elf)
-            print(cmp_result)
+        if args.context:
+            print(hex_context(cmp_result, args.context))
 
+        if args.html:
+            print(write_html_report(cmp_result, args.html))
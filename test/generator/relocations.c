@@ -0,0 +1,6 @@
+#include <stdio.h>
+#ifdef EXTRA
+const char pad[] = "some padding string";
+#endif
+const char *message = "Hello";
+int main(void) { puts(message); puts("World"); return 0; }
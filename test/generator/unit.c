@@ -0,0 +1,11 @@
+#ifdef EXTRA
+int extra_counter;
+#endif
+
+int unit_function(int value)
+{
+#ifdef EXTRA
+  extra_counter++;
+#endif
+  return value * 2;
+}
@@ -17,15 +17,48 @@
 # You should have received a copy of the GNU General Public License
 # along with pyelfcmp. If not, see <http://www.gnu.org/licenses/>.
 
+import bz2
+import gzip
+import io
+import lzma
+import random
+import shutil
+import struct
+import threading
+import types
 import unittest
 import sys
+import tempfile
+import os
 
 # Allows import local files when running from the root of project.
 sys.path.insert(1, ".")
 
+from elfcmp.batch import ElfPool, compare_pairs
+from elfcmp.cache import ResultCache
+from elfcmp.client import DaemonError, compare, request
+from elfcmp.compact import CompactSection, CompactSegment
+from elfcmp.compressed import SeekableDecompressor
+from elfcmp.corpus import LshIndex, compare_candidates, content_chunks
+from elfcmp.daemon import CompareServer, ElfCache, serve
+from elfcmp.dwarf import compare_debug_info, diff_unit_dies, read_units
 from elfcmp.elfcmp import ComparableElf
+from elfcmp.fastheaders import read_sections, read_segments
+from elfcmp.relocations import compare_relocations, decode_relocations
+from elfcmp.hexview import *
+from elfcmp.memimage import MemoryImage, compare_images
+from elfcmp.merkle import MerkleTree, Sidecar, compare_trees, diff_pages
+from elfcmp.report import write_html_report
+from elfcmp.reproducible import compute_masks, verify_reproducible
+from elfcmp.rules import Level, Rules
+from elfcmp.sampling import compare_blocks, compare_sampled
+from elfcmp.similarity import *
+from elfcmp.store import SectionStore, file_digest
+from elfcmp.stream import open_streams, spool_pair
+from elfcmp.strings import compare_strings, diff_strings, iter_strings
 from elfcmp.structs import *
 from elfcmp.utils import *
+from elfcmp.watch import Watcher
 
 
 class TestUtils(unittest.TestCase):
@@ -44,6 +77,17 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(1, locate_array_diff(array_1, array_4))
 
 
+    def test_interval_covers(self):
+
+        intervals = [(0, 10), (20, 30)]
+
+        self.assertTrue(interval_covers(intervals, 0, 10))
+        self.assertTrue(interval_covers(intervals, 22, 25))
+        self.assertFalse(interval_covers(intervals, 5, 21))
+        self.assertFalse(interval_covers(intervals, 10, 11))
+        self.assertFalse(interval_covers([], 0, 1))
+
+
 def compare_elf_files(
     left_file: str, right_file: str, print_result: bool=False) -> ElfDiff:
 
@@ -61,6 +105,59 @@ def compare_elf_files(
         return result
 
 
+def make_elf(elfclass: int, little_endian: bool) -> bytes:
+    """
+    Minimal ELF file of given class and byte order with PT_LOAD segment
+    and .text, .bss and .shstrtab sections, for classes and byte orders
+    test/generator can not build.
+    """
+    endian = "<" if little_endian else ">"
+    if elfclass == 32:
+        header_format = endian + "16sHHIIIIIHHHHHH"
+        segment_format = endian + "IIIIIIII"
+        section_format = endian + "IIIIIIIIII"
+    else:
+        header_format = endian + "16sHHIQQQIHHHHHH"
+        segment_format = endian + "IIQQQQQQ"
+        section_format = endian + "IIQQQQIIQQ"
+
+    header_size = struct.calcsize(header_format)
+    segment_size = struct.calcsize(segment_format)
+    text = bytes(range(32))
+    names = b"\0.text\0.bss\0.shstrtab\0"
+    text_offset = header_size + segment_size
+    names_offset = text_offset + len(text)
+    sections_offset = names_offset + len(names)
+
+    if elfclass == 32:
+        # PT_LOAD: type, offset, vaddr, paddr, filesz, memsz, flags, align.
+        segment = struct.pack(
+            segment_format, 1, text_offset, 0x1000, 0x1000, len(text),
+            0x100, 5, 0x1000)
+    else:
+        # PT_LOAD: type, flags, offset, vaddr, paddr, filesz, memsz, align.
+        segment = struct.pack(
+            segment_format, 1, 5, text_offset, 0x1000, 0x1000, len(text),
+            0x100, 0x1000)
+
+    sections = [
+        (0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+        (1, 1, 6, 0x1000, text_offset, len(text), 0, 0, 16, 0),
+        (7, 8, 3, 0x1020, names_offset, 0xe0, 0, 0, 32, 0),
+        (12, 3, 0, 0, names_offset, len(names), 0, 0, 1, 0),
+        ]
+    ident = b"\x7fELF" + bytes([
+        1 if elfclass == 32 else 2, 1 if little_endian else 2, 1])
+    header = struct.pack(
+        header_format, ident, 2, 3 if elfclass == 32 else 62, 1, 0x1000,
+        header_size, sections_offset, 0, header_size, segment_size, 1,
+        struct.calcsize(section_format), len(sections), 3)
+
+    return b"".join([
+        header, segment, text, names,
+        *(struct.pack(section_format, *section) for section in sections)])
+
+
 class TestElfCmp(unittest.TestCase):
     
     def test_elf_header_diff(self):
@@ -103,7 +200,1010 @@ class TestElfCmp(unittest.TestCase):
         # for s in e1.sections:
         #     print(s.header)
         result = compare_elf_files(f1, f2, True)
-        
+
+
+    def test_iter_compare(self):
+        f1 = "test/data/defined_string/1"
+        f2 = "test/data/relocations/2"
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+            left_elf = ComparableElf(file_1)
+            right_elf = ComparableElf(file_2)
+            rules = Rules(rules={"section_names": {".comment": "info"}})
+
+            result = left_elf.compare_to(right_elf, rules)
+            events = list(left_elf.iter_compare(right_elf, rules))
+            self.assertEqual(
+                ElfDiff.from_events(events, left_elf, right_elf).to_dict(),
+                result.to_dict())
+
+            types = [event.event_type for event in events]
+            self.assertEqual(types[0], EventType.HEADER_MODIFIED)
+            self.assertIn(EventType.SECTION_RIGHT_NEW, types)
+            self.assertIn(EventType.NOT_USED_COUNTS, types)
+
+            comment = [event for event in events if event.key == ".comment"]
+            self.assertEqual(comment[0].level, Level.INFO)
+
+            first = list(left_elf.iter_compare(right_elf, max_events=3))
+            self.assertEqual(
+                [str(e) for e in first], [str(e) for e in events[:3]])
+
+
+class TestCompressed(unittest.TestCase):
+
+    def setUp(self):
+        with open("test/data/defined_string/1", "rb") as f:
+            self.raw = f.read()
+
+
+    def test_random_seeks(self):
+        # Two members/streams, small chunks and cache to force restarts
+        # from checkpoints.
+        for compress in (gzip.compress, lzma.compress, bz2.compress):
+            data = self.raw + self.raw
+            stream = SeekableDecompressor(
+                io.BytesIO(compress(self.raw) + compress(self.raw)),
+                chunk_size=512, max_cached_chunks=2,
+                checkpoint_interval=1024, max_checkpoints=4)
+
+            rnd = random.Random(0)
+            for _ in range(200):
+                offset = rnd.randrange(len(data) + 16)
+                size = rnd.randrange(3000)
+                stream.seek(offset)
+                self.assertEqual(stream.read(size), data[offset:offset+size])
+
+            self.assertEqual(stream.seek(0, io.SEEK_END), len(data))
+            self.assertLessEqual(len(stream._checkpoints), 4)
+
+
+    def test_compare_compressed(self):
+        for compress in (gzip.compress, lzma.compress, bz2.compress):
+            left_elf = ComparableElf(io.BytesIO(compress(self.raw)))
+            right_elf = ComparableElf(io.BytesIO(self.raw))
+            self.assertFalse(left_elf.compare_to(right_elf).has_changes())
+
+
+class TestRules(unittest.TestCase):
+
+    def test_matcher(self):
+        rules = Rules.from_dict({
+            "default_level": "warning",
+            "section_names": {".note.*": "ignored", ".comment": 1},
+            "section_types": {"SHT_NOTE": "error"},
+            })
+        self.assertEqual(
+            rules.section_level(".note.gnu.build-id", "SHT_NOTE"),
+            Level.IGNORED)
+        self.assertEqual(rules.section_level(".comment", "SHT_PROGBITS"),
+            Level.INFO)
+        self.assertEqual(rules.section_level(".foo", "SHT_NOTE"), Level.ERROR)
+        self.assertEqual(rules.section_level(".text", "SHT_PROGBITS"),
+            Level.WARNING)
+        self.assertRaises(ValueError, Rules, rules={"unknown": {}})
+
+
+    def test_ignored_sections(self):
+        f1 = "test/data/build_id/with"
+        f2 = "test/data/build_id/without"
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+            left_elf = ComparableElf(file_1)
+            right_elf = ComparableElf(file_2)
+
+            result = left_elf.compare_to(right_elf)
+            self.assertIn(
+                ".note.gnu.build-id", result.compared_sections.left_new)
+            self.assertEqual(result.max_level(), Level.ERROR)
+
+            rules = Rules(Level.WARNING, {
+                "section_names": {".note.*": "ignored"},
+                "section_header_keys": {"sh_offset": "info", "sh_addr": "info"},
+                })
+            result = left_elf.compare_to(right_elf, rules)
+            sections = result.compared_sections
+            self.assertNotIn(".note.gnu.build-id", sections.left_new)
+            self.assertEqual(sections.levels, {})
+
+            for name, diff in sections.modified.items():
+                if diff.data_sizes is None and diff.data_diff_offset == -1:
+                    self.assertEqual(
+                        diff.level, max(diff.headers.levels.values()), name)
+                else:
+                    self.assertEqual(diff.level, Level.WARNING, name)
+
+            # Only offset and address of .fini are changed.
+            self.assertEqual(sections.modified[".fini"].level, Level.INFO)
+
+
+class TestSimilarity(unittest.TestCase):
+
+    def test_fuzzy_hash(self):
+        rnd = random.Random(0)
+        data = bytes(rnd.randrange(256) for _ in range(20000))
+        changed = data[:10000] + b"inserted" + data[10000:]
+        other = bytes(rnd.randrange(256) for _ in range(20000))
+
+        # Streaming gives same result as hashing at once.
+        hasher = FuzzyHasher(len(data))
+        for i in range(0, len(data), 777):
+            hasher.update(data[i:i+777])
+        self.assertEqual(hasher.digest(), fuzzy_hash(data))
+
+        self.assertEqual(similarity(data, data), 100)
+        self.assertGreater(similarity(data, changed), 80)
+        self.assertEqual(similarity(data, other), 0)
+
+
+    def test_sections_similarity(self):
+        f1 = "test/data/defined_string/1"
+        f2 = "test/data/defined_string/3"
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+            left_elf = ComparableElf(file_1)
+            right_elf = ComparableElf(file_2)
+
+            result = left_elf.compare_to(right_elf, similarity=True)
+            modified = result.compared_sections.modified
+            self.assertGreater(modified[".symtab"].similarity, 50)
+
+            left_sig = ElfSignatures.from_elf(left_elf)
+            right_sig = ElfSignatures.from_elf(right_elf)
+
+        # Stored signatures give same scores without files.
+        left_sig = ElfSignatures.from_dict(left_sig.to_dict())
+        scores = left_sig.compare(right_sig)
+        self.assertEqual(scores[".symtab"], modified[".symtab"].similarity)
+        self.assertEqual(scores[".text"], 100)
+
+
+class TestCorpus(unittest.TestCase):
+
+    def test_lsh_index(self):
+        paths = {
+            "ds1": "test/data/defined_string/1",
+            "ds2": "test/data/defined_string/2",
+            "ds3": "test/data/defined_string/3",
+            "hello": "test/generator/hello",
+            }
+
+        index = LshIndex(num_perm=64, bands=32)
+        for key, path in paths.items():
+            index.add_file(key, path)
+
+        pairs = index.candidate_pairs()
+        self.assertIn(("ds1", "ds2"), pairs)
+        self.assertGreater(index.similarity("ds1", "ds2"), 0.5)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "index.json")
+            index.save(path)
+            loaded = LshIndex.load(path)
+
+        self.assertEqual(loaded.candidate_pairs(), pairs)
+
+        loaded.remove("ds2")
+        self.assertNotIn(("ds1", "ds2"), loaded.candidate_pairs())
+
+        results = list(compare_candidates(index, paths, threshold=0.5))
+        self.assertIn(("ds1", "ds2"), [(k1, k2) for k1, k2, _ in results])
+        for _, _, diff in results:
+            self.assertTrue(diff.has_changes())
+
+
+    def test_content_chunks(self):
+        rnd = random.Random(0)
+        data = bytes(rnd.randrange(256) for _ in range(20000))
+        changed = data[:10000] + b"inserted" + data[10000:]
+
+        chunks = list(content_chunks(data, 64))
+        self.assertEqual(b"".join(chunks), data)
+        self.assertLessEqual(max(len(c) for c in chunks), 4 * 64)
+        self.assertEqual(
+            b"".join(content_chunks(bytes(1000), 64)), bytes(1000))
+
+        # Only chunks around inserted bytes change.
+        shingles = set(chunks)
+        changed_shingles = set(content_chunks(changed, 64))
+        self.assertGreater(
+            len(shingles & changed_shingles)
+            / len(shingles | changed_shingles), 0.9)
+
+
+class TestStore(unittest.TestCase):
+
+    def test_ingest_and_lookup(self):
+        with SectionStore(":memory:") as store:
+            count = sum(
+                len(files) for _, _, files in os.walk("test/data"))
+            self.assertEqual(
+                store.ingest_tree("test/data", batch_size=2), count)
+            # Unchanged files are skipped.
+            self.assertEqual(store.ingest_tree("test/data"), 0)
+
+            path = os.path.abspath("test/data/defined_string/1")
+            with open(path, "rb") as f:
+                elf = ComparableElf(f)
+                records = store.lookup_section(elf, ".rodata")
+                self.assertIn(path, [r.path for r in records])
+                self.assertTrue(all(r.name == ".rodata" for r in records))
+
+                # Same .text is shipped in both build_id files.
+                text = store.lookup_section(elf, ".text")
+                self.assertGreater(len(text), 1)
+
+            self.assertEqual(store.lookup_file(file_digest(path)), [path])
+            blocks = store.blocks(path)
+            self.assertEqual(blocks[0].block_type, "ELF_HEADER")
+
+
+    def test_ingest_truncated(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+            SectionStore(":memory:") as store:
+            path = os.path.join(tmp_dir, "elf")
+            with open("test/data/defined_string/1", "rb") as f:
+                data = f.read()
+            with open(path, "wb") as f:
+                f.write(data[:1000])
+
+            # Broken file leaves no record and is tried again.
+            self.assertEqual(store.ingest([path]), 0)
+            self.assertEqual(store.lookup_file(file_digest(path)), [])
+            self.assertEqual(store.blocks(path), [])
+
+            with open(path, "wb") as f:
+                f.write(data)
+            self.assertEqual(store.ingest([path]), 1)
+            self.assertEqual(store.lookup_file(file_digest(path)), [path])
+            self.assertTrue(store.blocks(path))
+
+
+class TestReproducible(unittest.TestCase):
+
+    def test_masks(self):
+        with open("test/data/defined_string/1", "rb") as f:
+            raw = f.read()
+
+        left_elf = ComparableElf(io.BytesIO(raw))
+        build_id = left_elf.get_section_by_name(".note.gnu.build-id")
+        masks = compute_masks(left_elf)
+        # Only 20 bytes of SHA-1 descriptor are masked.
+        self.assertEqual(masks, [(build_id["sh_offset"] + 16,
+            build_id["sh_offset"] + 36)])
+
+        patched = bytearray(raw)
+        for start, end in masks:
+            patched[start:end] = bytes(end - start)
+        result = verify_reproducible(
+            left_elf, ComparableElf(io.BytesIO(bytes(patched))))
+        self.assertTrue(result.passed())
+
+        text = left_elf.get_section_by_name(".text")
+        patched[text["sh_offset"] + 3] ^= 0xFF
+        patched[text["sh_offset"] + 4] ^= 0xFF
+        result = verify_reproducible(
+            left_elf, ComparableElf(io.BytesIO(bytes(patched))))
+        self.assertFalse(result.passed())
+        self.assertEqual(
+            [(r.name, r.start, r.end) for r in result.unexplained],
+            [(".text", 3, 5)])
+
+        result = verify_reproducible(
+            left_elf, ComparableElf(io.BytesIO(bytes(patched))), [".te*"])
+        self.assertTrue(result.passed())
+
+
+    def test_streams(self):
+        path = "test/data/defined_string/1"
+        with open(path, "rb") as f, \
+            tempfile.SpooledTemporaryFile(max_size=1 << 20) as spooled:
+            spooled.write(f.read())
+
+            # Mapped file and spooled stream read without rollover.
+            result = verify_reproducible(
+                ComparableElf(f), ComparableElf(spooled))
+            self.assertTrue(result.passed())
+            self.assertFalse(spooled._rolled)
+
+
+class TestRelocations(unittest.TestCase):
+
+    def test_relocations(self):
+        f1 = "test/data/relocations/1"
+        f2 = "test/data/relocations/2"
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+            left_elf = ComparableElf(file_1)
+            right_elf = ComparableElf(file_2)
+
+            relocations, intervals = decode_relocations(left_elf)[".text"]
+            self.assertEqual(
+                relocations, sorted(relocations, key=lambda r: r[:2]))
+            self.assertIn("main", [r.symbol for r in relocations])
+
+            # Plain compare finds diffs in code and data.
+            sections = left_elf.compare_to(right_elf).compared_sections
+            self.assertNotEqual(sections.modified[".text"].data_diff_offset, -1)
+            self.assertNotEqual(sections.modified[".data"].data_diff_offset, -1)
+
+            # All of them are in relocated bytes.
+            result = compare_relocations(left_elf, right_elf)
+            self.assertFalse(result[".text"].unexplained)
+            self.assertFalse(result[".data"].unexplained)
+            self.assertTrue(result[".data"].modified)
+            self.assertTrue(result[".rodata"].unexplained)
+
+
+class TestReport(unittest.TestCase):
+
+    def test_html_report(self):
+        f1 = "test/data/relocations/1"
+        f2 = "test/data/relocations/2"
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2, \
+            tempfile.TemporaryDirectory() as temp_dir:
+
+            result = ComparableElf(file_1).compare_to(ComparableElf(file_2))
+            index = write_html_report(result, temp_dir, page_size=5)
+            modified = len(result.compared_sections.modified)
+
+            pages = sorted(
+                p for p in os.listdir(temp_dir) if p.startswith("sections_"))
+            self.assertEqual(len(pages), (modified + 4) // 5)
+
+            with open(os.path.join(temp_dir, "sections_1.html")) as f:
+                page = f.read()
+            self.assertIn("sections_2.html", page)
+            self.assertIn("class=\"diff\"", page)
+
+            with open(index) as f:
+                self.assertIn("sections_1.html", f.read())
+
+            # Hex views do not show bytes of neighbouring sections.
+            write_html_report(result, temp_dir, page_size=100, hex_window=256)
+            with open(os.path.join(temp_dir, "sections_1.html")) as f:
+                page = f.read()
+            view = page[page.index("Section .rodata"):]
+            view = view[view.index("First data diff"):]
+            view = view[:view.index("</tr></table>")]
+            rows = [
+                pre.split("</pre>")[0].replace(
+                    "<span class=\"diff\">", "").replace("</span>", "")
+                for pre in view.split("<pre class=\"hex\">")[1:]]
+            self.assertEqual(
+                [len(r.split()) - len(r.splitlines()) for r in rows],
+                list(result.compared_sections.modified[".rodata"].data_sizes))
+
+
+class TestHexView(unittest.TestCase):
+
+    def test_read_windows(self):
+        reads = []
+
+        class CountingStream(io.BytesIO):
+            def read(self, size=-1):
+                reads.append(size)
+                return super().read(size)
+
+        stream = CountingStream(bytes(range(256)) * 64)
+        stream.seek(5)
+
+        windows = [(100, 10), (10, 10), (120, 4), (10000, 8)]
+        result = read_windows(stream, windows, max_gap=100)
+
+        self.assertEqual(result[0], stream.getvalue()[100:110])
+        self.assertEqual(result[1], stream.getvalue()[10:20])
+        self.assertEqual(result[2], stream.getvalue()[120:124])
+        self.assertEqual(result[3], stream.getvalue()[10000:10008])
+        # First three windows are coalesced.
+        self.assertEqual(reads, [114, 8])
+        self.assertEqual(stream.tell(), 5)
+
+
+    def test_hex_context(self):
+        f1 = "test/data/defined_string/1"
+        f2 = "test/data/defined_string/2"
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+            result = ComparableElf(file_1).compare_to(ComparableElf(file_2))
+            position = file_1.tell()
+            text = hex_context(result, context=8)
+            self.assertEqual(file_1.tell(), position)
+
+        self.assertIn("Section .rodata:", text)
+        self.assertIn("|Hello, World!.  |", text)
+        self.assertIn("|Hello, WORLD!.  |", text)
+
+
+    def test_nobits_window(self):
+        left = make_elf(64, True)
+        right = bytearray(left)
+        # Grow .bss, its sh_size is at offset 32 of third section header.
+        sections_offset = struct.unpack_from("<Q", left, 0x28)[0]
+        struct.pack_into("<Q", right, sections_offset + 2 * 64 + 32, 0xf0)
+
+        result = ComparableElf(io.BytesIO(left)).compare_to(
+            ComparableElf(io.BytesIO(bytes(right))))
+        self.assertEqual(
+            result.compared_sections.modified[".bss"].data_diff_offset, 0xe0)
+
+        # NOBITS data is not in file, bytes of other data are not shown.
+        [window] = diff_windows(result)
+        self.assertEqual((window.left_size, window.right_size), (0, 0))
+
+
+class TestDaemon(unittest.TestCase):
+
+    def test_compare(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, "socket")
+            left = os.path.join(tmp_dir, "left")
+            right = "test/data/defined_string/2"
+            shutil.copy("test/data/defined_string/1", left)
+
+            server = CompareServer(socket_path, ElfCache(max_entries=2))
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+
+            try:
+                results = []
+                threads = [
+                    threading.Thread(target=lambda: results.append(
+                        compare(socket_path, left, right)))
+                    for i in range(8)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+
+                self.assertEqual(len(results), 8)
+                for result in results:
+                    self.assertIn(
+                        ".rodata", result["compared_sections"]["modified"])
+                    self.assertEqual(result["max_level"], Level.ERROR)
+
+                stats = request(socket_path, "stats")
+                self.assertEqual(stats["entries"], 2)
+                self.assertEqual(stats["hits"] + stats["misses"], 16)
+
+                # Changed file is parsed again.
+                shutil.copy(right, left)
+                os.utime(left, ns=(1, 1))
+                result = compare(socket_path, left, right)
+                self.assertIsNone(result["max_level"])
+
+                # Third file evicts least recently used one.
+                compare(socket_path, left, "test/data/relocations/1")
+                self.assertEqual(request(socket_path, "stats")["entries"], 2)
+
+                digests = request(socket_path, "digests", path=left)
+                self.assertEqual(digests, request(
+                    socket_path, "digests",
+                    path=os.path.abspath(right)))
+
+                with self.assertRaises(DaemonError):
+                    request(socket_path, "unknown")
+
+                # Socket of running daemon and not socket paths are kept.
+                with self.assertRaises(FileExistsError):
+                    serve(socket_path)
+                with self.assertRaises(FileExistsError):
+                    serve(left)
+                self.assertTrue(os.path.isfile(left))
+
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+                server.cache.clear()
+
+
+    def test_shared_entries(self):
+        cache = ElfCache()
+        left = "test/data/defined_string/1"
+        right = "test/data/defined_string/2"
+        results = []
+
+        def compare_in_thread():
+            with cache.open(left, right) as (entry_1, entry_2):
+                results.append(entry_1.elf.view().compare_to(
+                    entry_2.elf.view()).to_dict())
+
+        try:
+            # Entries in use by one request do not block other requests.
+            with cache.open(left) as (entry,):
+                threads = [
+                    threading.Thread(target=compare_in_thread)
+                    for i in range(4)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join(10)
+                self.assertFalse(any(t.is_alive() for t in threads))
+                self.assertIsNone(entry.elf.other)
+                self.assertIsNone(
+                    entry.elf.compare_result.compared_elf_headers)
+
+            self.assertEqual(len(results), 4)
+            self.assertEqual(
+                results[0], compare_elf_files(left, right).to_dict())
+            self.assertTrue(all(r == results[0] for r in results))
+        finally:
+            cache.clear()
+
+
+class TestCompact(unittest.TestCase):
+
+    def test_same_result(self):
+        f1 = "test/data/defined_string/1"
+        f2 = "test/data/relocations/2"
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+            result = ComparableElf(file_1).compare_to(ComparableElf(file_2))
+            compact_1 = ComparableElf(file_1, compact=True)
+            compact_2 = ComparableElf(file_2, compact=True)
+            compact_result = compact_1.compare_to(compact_2)
+
+            self.assertIsInstance(compact_1.sections[1], CompactSection)
+            self.assertIsInstance(compact_1.segments[0], CompactSegment)
+            self.assertEqual(result.to_dict(), compact_result.to_dict())
+            self.assertEqual(str(result), str(compact_result))
+            self.assertLess(
+                compact_1.metadata_size(),
+                ComparableElf(file_1).metadata_size())
+
+
+    def test_pool_budget(self):
+        paths = [
+            "test/data/defined_string/1", "test/data/defined_string/2",
+            "test/data/relocations/1", "test/data/relocations/2"]
+        pairs = [(p1, p2) for p1 in paths for p2 in paths if p1 < p2]
+
+        with ElfPool(memory_budget=1) as pool:
+            for p1, p2 in pairs:
+                with pool.open(p1, p2):
+                    self.assertEqual(len(pool), 2)
+            self.assertEqual(len(pool), 0)
+
+        with ElfPool() as pool:
+            for p1, p2 in pairs:
+                with pool.open(p1, p2):
+                    pass
+            self.assertEqual(len(pool), 4)
+
+        results = list(compare_pairs(pairs, memory_budget=1))
+        self.assertEqual([r[:2] for r in results], pairs)
+        self.assertIn(".rodata", results[0][2].compared_sections.modified)
+
+
+class TestFastHeaders(unittest.TestCase):
+
+    def test_read_headers(self):
+        for directory in sorted(os.listdir("test/data")):
+            directory = os.path.join("test/data", directory)
+            for name in sorted(os.listdir(directory)):
+                with open(os.path.join(directory, name), "rb") as f:
+                    elf = ELFFile(f)
+                    sections = read_sections(elf)
+                    segments = read_segments(elf)
+
+                    self.assertEqual(len(sections), elf.num_sections())
+                    for i, section in enumerate(elf.iter_sections()):
+                        self.assertEqual(sections[i].name, section.name)
+                        self.assertEqual(sections[i].index, i)
+                        self.assertEqual(
+                            dict(sections[i].header), dict(section.header))
+
+                    self.assertEqual(
+                        [dict(s.header) for s in segments],
+                        [dict(s.header) for s in elf.iter_segments()])
+
+        for elfclass in (32, 64):
+            for little_endian in (True, False):
+                elf = ELFFile(io.BytesIO(make_elf(elfclass, little_endian)))
+                self.assertEqual(elf.elfclass, elfclass)
+                self.assertEqual(elf.little_endian, little_endian)
+
+                sections = read_sections(elf)
+                self.assertEqual(
+                    [(s.name, dict(s.header)) for s in sections],
+                    [(s.name, dict(s.header)) for s in elf.iter_sections()])
+                self.assertEqual(
+                    [dict(s.header) for s in read_segments(elf)],
+                    [dict(s.header) for s in elf.iter_segments()])
+                self.assertEqual(sections[1].data(), bytes(range(32)))
+
+
+    def test_default_mode(self):
+        with open("test/data/relocations/1", "rb") as f:
+            elf = ComparableElf(f)
+            pyelftools = ELFFile(f)
+
+            self.assertIsInstance(elf.sections[1], CompactSection)
+            self.assertIsInstance(elf.segments[0], CompactSegment)
+            for section in elf.sections:
+                full = elf.get_section(section.index)
+                self.assertEqual(section.name, full.name)
+                self.assertEqual(dict(section.header), dict(full.header))
+                self.assertEqual(section.data(), full.data())
+            self.assertEqual(
+                [dict(s.header) for s in elf.segments],
+                [dict(s.header) for s in pyelftools.iter_segments()])
+
+
+class TestStrings(unittest.TestCase):
+
+    def test_iter_strings(self):
+        data = b"\0abc\0\0de" + b"f" * 10000 + b"\0tail"
+        for chunk_size in (1, 3, 7, 100000):
+            chunks = [
+                data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+            self.assertEqual(
+                list(iter_strings(chunks)),
+                [b"abc", b"de" + b"f" * 10000, b"tail"])
+
+
+    def test_diff_strings(self):
+        diff = diff_strings(
+            [b"a", b"b", b"b", b"c"], [b"b", b"c", b"c", b"d", b"d"])
+        self.assertEqual(diff.removed, {b"a"})
+        self.assertEqual(diff.added, {b"d"})
+        self.assertEqual(diff.common_count, 2)
+
+
+    def test_compare_strings(self):
+        f1 = "test/data/defined_string/1"
+        f2 = "test/data/defined_string/2"
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+            result = compare_strings(
+                ComparableElf(file_1), ComparableElf(file_2, compact=True))
+
+        self.assertEqual(list(result), [".rodata"])
+        self.assertEqual(result[".rodata"].removed, {b"Hello, World!"})
+        self.assertEqual(result[".rodata"].added, {b"Hello, WORLD!"})
+
+
+class NotSeekableStream(io.RawIOBase):
+    """ Pipe like stream, reads only forward by small parts. """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), 1000, len(self.data) - self.position)
+        buffer[:size] = self.data[self.position:self.position + size]
+        self.position += size
+        return size
+
+
+class TestStream(unittest.TestCase):
+
+    def test_spool_pair(self):
+        data_1 = b"\x7fELF" + bytes(300000)
+        data_2 = data_1[:200000] + b"x" + data_1[200001:]
+
+        spool_1, spool_2, equal_ranges = spool_pair(
+            NotSeekableStream(data_1), NotSeekableStream(data_2),
+            max_memory=100000, chunk_size=65536)
+
+        with spool_1, spool_2:
+            self.assertTrue(spool_1._rolled)
+            self.assertEqual(spool_1.read(), data_1)
+            self.assertEqual(spool_2.read(), data_2)
+            self.assertEqual(equal_ranges, [(0, 196608), (262144, 300004)])
+
+
+    def test_compare(self):
+        f1 = "test/data/defined_string/1"
+        f2 = "test/data/defined_string/2"
+        expected = compare_elf_files(f1, f2).to_dict()
+
+        with open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+            stream_1 = NotSeekableStream(file_1.read())
+            stream_2 = NotSeekableStream(file_2.read())
+
+        with open_streams(stream_1, stream_2, chunk_size=256) \
+        as (left_elf, right_elf, equal_ranges):
+            self.assertTrue(equal_ranges)
+            result = left_elf.compare_to(right_elf, equal_ranges=equal_ranges)
+            self.assertEqual(result.to_dict(), expected)
+
+
+class TestCache(unittest.TestCase):
+
+    def test_compare(self):
+        f1 = "test/data/defined_string/1"
+        f2 = "test/data/defined_string/2"
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+            open(f1, "rb") as file_1, open(f2, "rb") as file_2:
+
+            cache = ResultCache(tmp_dir)
+            left_elf = ComparableElf(file_1)
+            right_elf = ComparableElf(file_2)
+            expected = cache.compare(left_elf, right_elf)
+
+            calls = []
+            compare_to = left_elf.compare_to
+
+            def counted_compare_to(*args, **kwargs):
+                calls.append(args)
+                return compare_to(*args, **kwargs)
+
+            left_elf.compare_to = counted_compare_to
+
+            result = cache.compare(left_elf, right_elf)
+            self.assertEqual(calls, [])
+            self.assertEqual(result.to_dict(), expected.to_dict())
+            self.assertIn("WORLD", hex_context(result))
+
+            # Other options is other key.
+            rules = Rules.from_dict({"section_names": {".rodata": "info"}})
+            self.assertNotEqual(
+                cache.key(left_elf, right_elf),
+                cache.key(left_elf, right_elf, rules))
+            cache.compare(left_elf, right_elf, rules)
+            self.assertEqual(len(calls), 1)
+
+
+    def test_bad_entries(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+            open("test/data/defined_string/1", "rb") as file_1, \
+            open("test/data/defined_string/2", "rb") as file_2:
+
+            cache = ResultCache(tmp_dir)
+            left_elf = ComparableElf(file_1)
+            right_elf = ComparableElf(file_2)
+            key = cache.key(left_elf, right_elf)
+            expected = left_elf.compare_to(right_elf).to_dict()
+
+            # Valid JSON of wrong shape and corrupt JSON are misses.
+            for content in ('{"value": 1}', "[1, 2]", "{"):
+                cache.put(key, {})
+                with open(cache._path(key), "w") as f:
+                    f.write(content)
+                result = cache.compare(left_elf, right_elf)
+                self.assertEqual(result.to_dict(), expected)
+                self.assertEqual(cache.get(key), expected)
+
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ResultCache(tmp_dir, max_bytes=150)
+            cache.put("aa01", {"value": "x" * 100})
+            os.utime(cache._path("aa01"), ns=(1, 1))
+            cache.put("bb02", {"value": "y" * 100})
+
+            self.assertIsNone(cache.get("aa01"))
+            self.assertEqual(cache.get("bb02"), {"value": "y" * 100})
+            self.assertLessEqual(cache.size(), 150)
+
+
+    def test_evict_amortized(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ResultCache(tmp_dir, max_bytes=2000)
+            scans = []
+            entries = cache._entries
+            cache._entries = lambda: scans.append(1) or entries()
+
+            for i in range(200):
+                cache.put("{:04x}".format(i), {"value": "x" * 100})
+                self.assertLessEqual(cache._size, 2000)
+
+            # Directory is listed once per several puts, not on every put.
+            self.assertLess(len(scans), 50)
+            self.assertEqual(cache._size, cache.size())
+            self.assertIsNotNone(cache.get("{:04x}".format(199)))
+
+
+class TestWatch(unittest.TestCase):
+
+    def test_poll(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            left = os.path.join(tmp_dir, "left")
+            right = "test/data/defined_string/2"
+            shutil.copy("test/data/defined_string/1", left)
+
+            watcher = Watcher(left, right)
+            try:
+                self.assertIsNone(watcher.poll())
+                self.assertIn(
+                    ".rodata", watcher.result.compared_sections.modified)
+
+                # Only changed sections are compared again.
+                shutil.copy(right, left)
+                os.utime(left, ns=(1, 1))
+                result = watcher.poll()
+                self.assertEqual(watcher.last_phases, {"sections"})
+                self.assertFalse(result.has_changes())
+
+                for i, new_left in enumerate((
+                    "test/data/relocations/1", "test/data/defined_string/1")):
+                    shutil.copy(new_left, left)
+                    os.utime(left, ns=(i + 2, i + 2))
+                    result = watcher.poll()
+                    expected = compare_elf_files(left, right)
+                    self.assertEqual(result.to_dict(), expected.to_dict())
+            finally:
+                watcher.close()
+
+
+class TestSampling(unittest.TestCase):
+
+    def test_sampled(self):
+        with open("test/data/defined_string/1", "rb") as f:
+            data = bytearray(f.read())
+            left_elf = ComparableElf(f)
+            text = [s for s in left_elf.sections if s.name == ".text"][0]
+            data[text["sh_offset"] + 300] ^= 0xff
+            right_elf = ComparableElf(io.BytesIO(bytes(data)))
+
+            result = compare_sampled(left_elf, right_elf, 64, rate=1.0)
+            self.assertEqual(result.different, {".text": [256]})
+            self.assertEqual(result.bytes_read, result.total_bytes)
+            self.assertEqual(result.confidence(), 1.0)
+            self.assertEqual(
+                compare_blocks(left_elf, right_elf, result.changed_blocks()),
+                {".text": 300})
+
+            result = compare_sampled(left_elf, right_elf, 64, rate=0.1)
+            self.assertLess(result.bytes_read, result.total_bytes / 2)
+            self.assertLess(result.confidence(), 0.5)
+            self.assertEqual(
+                compare_sampled(left_elf, right_elf, 64, rate=0.1).different,
+                result.different)
+
+        # Empty sections of object file do not lower confidence.
+        with open("test/data/object/1", "rb") as f:
+            elf = ComparableElf(f)
+            result = compare_sampled(elf, elf, rate=1.0)
+            self.assertFalse(result.has_changes())
+            self.assertEqual(result.bytes_read, result.total_bytes)
+            self.assertEqual(result.confidence(), 1.0)
+
+
+class TestMerkle(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_compare_trees(self):
+        left = os.path.join(self.temp_dir, "left")
+        right = os.path.join(self.temp_dir, "right")
+        shutil.copy("test/data/defined_string/1", left)
+
+        with open(left, "rb") as f:
+            data = bytearray(f.read())
+            left_elf = ComparableElf(f)
+            text = [s for s in left_elf.sections if s.name == ".text"][0]
+            data[text["sh_offset"] + 300] ^= 0xff
+            with open(right, "wb") as out:
+                out.write(data)
+
+            with open(right, "rb") as f2:
+                right_elf = ComparableElf(f2)
+                built = Sidecar.load_or_build(left, left_elf, 64)
+                Sidecar.load_or_build(right, right_elf, 64)
+                left_sidecar = Sidecar.load(left)
+                right_sidecar = Sidecar.load(right)
+                self.assertIsNotNone(left_sidecar)
+                self.assertEqual(
+                    left_sidecar.trees[".text"].levels,
+                    built.trees[".text"].levels)
+
+                result = compare_trees(
+                    left_elf, right_elf, left_sidecar, right_sidecar)
+                self.assertEqual(result.data_diff_offsets, {".text": 300})
+                self.assertEqual(result.pages, {".text": [256]})
+                self.assertEqual(result.bytes_read, 128)
+
+        # Truncated sidecar is ignored.
+        with open(right + ".merkle", "r+b") as f:
+            f.truncate(100)
+        self.assertIsNone(Sidecar.load(right))
+
+        # Changed file makes its sidecar stale.
+        os.utime(left, ns=(0, 0))
+        self.assertIsNone(Sidecar.load(left))
+
+
+    def test_diff_pages(self):
+        pages = [bytes([i]) * 8 for i in range(37)]
+        tree_1 = MerkleTree.from_pages(0, 37 * 8, pages)
+        pages[5] = pages[30] = b"x" * 8
+        tree_2 = MerkleTree.from_pages(0, 37 * 8, pages)
+        tree_3 = MerkleTree.from_pages(0, 36 * 8, pages[:-1])
+
+        self.assertEqual(diff_pages(tree_1, tree_1), ([], 1))
+        self.assertEqual(diff_pages(tree_1, tree_2)[0], [5, 30])
+        self.assertEqual(diff_pages(tree_2, tree_3)[0], [36])
+
+
+class TestMemoryImage(unittest.TestCase):
+
+    def test_compare_images(self):
+        with open("test/data/defined_string/1", "rb") as f:
+            data = bytearray(f.read())
+            left_elf = ComparableElf(f)
+            section = [s for s in left_elf.sections if s.name == ".data"][0]
+            data[section["sh_offset"] + 8] ^= 0xff
+            right_elf = ComparableElf(io.BytesIO(bytes(data)), compact=True)
+
+            address = section["sh_addr"] + 8
+            result = compare_images(left_elf, right_elf, page_size=64)
+            self.assertEqual(len(result.different), 1)
+            start, end = result.different[0]
+            self.assertEqual(start, address // 64 * 64)
+            self.assertTrue(address < end <= start + 64)
+            self.assertFalse(result.left_only or result.right_only)
+            self.assertFalse(compare_images(left_elf, left_elf).has_changes())
+
+            with MemoryImage(left_elf) as image:
+                bss = [s for s in left_elf.sections if s.name == ".bss"][0]
+                self.assertTrue(
+                    image.is_zero_fill(bss["sh_addr"], bss["sh_size"]))
+                self.assertEqual(
+                    bytes(image.read(bss["sh_addr"], bss["sh_size"])),
+                    bytes(bss["sh_size"]))
+                self.assertEqual(
+                    bytes(image.read(section["sh_addr"], section["sh_size"])),
+                    section.data())
+
+
+    def test_overlapping_segments(self):
+        data = bytes(range(0x60))
+        segments = [
+            {"p_type": "PT_LOAD", "p_vaddr": 0x1000, "p_memsz": 0x20,
+                "p_offset": 0, "p_filesz": 0x20},
+            {"p_type": "PT_LOAD", "p_vaddr": 0x1010, "p_memsz": 0x8,
+                "p_offset": 0x40, "p_filesz": 0x8},
+            ]
+        elf = types.SimpleNamespace(segments=segments, stream=io.BytesIO(data))
+
+        # Later segment replaces overlapped addresses, like loader does.
+        with MemoryImage(elf) as image:
+            self.assertEqual(image.segments, [
+                (0x1000, 0x10, 0, 0x10), (0x1010, 0x8, 0x40, 0x8),
+                (0x1018, 0x8, 0x18, 0x8)])
+            self.assertEqual(
+                bytes(image.read(0x1000, 0x20)),
+                data[:0x10] + data[0x40:0x48] + data[0x18:0x20])
+
+
+class TestDwarf(unittest.TestCase):
+
+    def test_compare_debug_info(self):
+        with open("test/data/debug_info/1", "rb") as f1, \
+            open("test/data/debug_info/2", "rb") as f2:
+            left_elf = ComparableElf(f1)
+            right_elf = ComparableElf(f2, compact=True)
+
+            self.assertEqual(set(read_units(left_elf)), {"main.c", "unit.c"})
+            self.assertFalse(
+                compare_debug_info(left_elf, left_elf).has_changes())
+
+            result = compare_debug_info(left_elf, right_elf)
+            self.assertFalse(result.added or result.removed)
+            self.assertEqual(result.changed, {"unit.c": {"info", "line"}})
+
+            self.assertFalse(result.unparsed)
+            differences = diff_unit_dies(
+                left_elf, right_elf, *result.offsets["unit.c"])
+            self.assertTrue(any("extra_counter" in d for d in differences))
+            offset = read_units(left_elf)["main.c"].offset
+            self.assertEqual(
+                diff_unit_dies(left_elf, left_elf, offset, offset), [])
 
 
 if __name__ == '__main__':